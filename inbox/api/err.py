@@ -22,6 +22,16 @@ class NotFoundError(APIException):
         self.message = message
 
 
+class CursorExpiredError(APIException):
+    """Raised when a delta cursor refers to a part of the transaction log
+    that has been removed by the retention service."""
+    status_code = 410
+
+    def __init__(self, cursor):
+        self.message = 'Cursor {} has expired. Please generate a new ' \
+                       'cursor and resync.'.format(cursor)
+
+
 class ConflictError(APIException):
     status_code = 409
 
@@ -1,21 +1,29 @@
-from sqlalchemy import and_, or_, desc, asc, func, bindparam
+from collections import defaultdict
+from itertools import islice
+
+import arrow
+from sqlalchemy import and_, or_, desc, asc, func, bindparam, true, false
 from sqlalchemy.orm import subqueryload, contains_eager
 from inbox.api.err import InputError
 from inbox.api.validation import valid_public_id
+from inbox.events.occurrences import (materialised_window,
+                                      materialised_start_times)
+from inbox.events.recurring import EXPAND_RECURRING_YEARS, merge_events
 from inbox.models import (Contact, Event, Calendar, Message,
                           MessageContactAssociation, Thread,
                           Block, Part, MessageCategory, Category)
-from inbox.models.event import RecurringEvent
+from inbox.models.event import RecurringEvent, RecurringEventOverride
+from inbox.models.thread import preload_categories
 from inbox.sqlalchemy_ext.util import bakery
 
 
 def threads(namespace_id, subject, from_addr, to_addr, cc_addr, bcc_addr,
             any_email, thread_public_id, started_before, started_after,
             last_message_before, last_message_after, filename, in_, unread,
-            starred, limit, offset, view, db_session):
+            starred, limit, offset, view, db_session, page_cursor=None):
 
     if view == 'count':
-        query = db_session.query(func.count(Thread.id))
+        query = db_session.query(func.count(Thread.id)).select_from(Thread)
     elif view == 'ids':
         query = db_session.query(Thread.public_id)
     else:
@@ -40,106 +48,67 @@ def threads(namespace_id, subject, from_addr, to_addr, cc_addr, bcc_addr,
     if subject is not None:
         filters.append(Thread.subject == subject)
 
-    query = query.filter(*filters)
-
-    if from_addr is not None:
-        from_query = db_session.query(Message.thread_id). \
-            join(MessageContactAssociation).join(Contact).filter(
-                Contact.email_address == from_addr,
-                Contact.namespace_id == namespace_id,
-                MessageContactAssociation.field == 'from_addr').subquery()
-        query = query.filter(Thread.id.in_(from_query))
-
-    if to_addr is not None:
-        to_query = db_session.query(Message.thread_id). \
-            join(MessageContactAssociation).join(Contact).filter(
-                Contact.email_address == to_addr,
-                Contact.namespace_id == namespace_id,
-                MessageContactAssociation.field == 'to_addr').subquery()
-        query = query.filter(Thread.id.in_(to_query))
-
-    if cc_addr is not None:
-        cc_query = db_session.query(Message.thread_id). \
-            join(MessageContactAssociation).join(Contact).filter(
-                Contact.email_address == cc_addr,
-                Contact.namespace_id == namespace_id,
-                MessageContactAssociation.field == 'cc_addr').subquery()
-        query = query.filter(Thread.id.in_(cc_query))
-
-    if bcc_addr is not None:
-        bcc_query = db_session.query(Message.thread_id). \
-            join(MessageContactAssociation).join(Contact).filter(
-                Contact.email_address == bcc_addr,
-                Contact.namespace_id == namespace_id,
-                MessageContactAssociation.field == 'bcc_addr').subquery()
-        query = query.filter(Thread.id.in_(bcc_query))
-
-    if any_email is not None:
-        any_contact_query = db_session.query(Message.thread_id). \
-            join(MessageContactAssociation).join(Contact). \
-            filter(Contact.email_address == any_email,
-                   Contact.namespace_id == namespace_id).subquery()
-        query = query.filter(Thread.id.in_(any_contact_query))
-
-    if filename is not None:
-        files_query = db_session.query(Message.thread_id). \
-            join(Part).join(Block). \
-            filter(Block.filename == filename,
-                   Block.namespace_id == namespace_id). \
-            subquery()
-        query = query.filter(Thread.id.in_(files_query))
-
-    if in_ is not None:
-        category_filters = [Category.name == in_, Category.display_name == in_]
-        try:
-            valid_public_id(in_)
-            category_filters.append(Category.public_id == in_)
-        except InputError:
-            pass
-        category_query = db_session.query(Message.thread_id). \
-            join(MessageCategory).join(Category). \
-            filter(Category.namespace_id == namespace_id,
-                   or_(*category_filters)).subquery()
-        query = query.filter(Thread.id.in_(category_query))
-
     if unread is not None:
-        read = not unread
-        unread_query = db_session.query(Message.thread_id).filter(
-            Message.namespace_id == namespace_id,
-            Message.is_read == read).subquery()
-        query = query.filter(Thread.id.in_(unread_query))
+        filters.append(_thread_flag_filter(
+            Thread.unread_count, Message.is_read == false(), unread,
+            db_session))
 
     if starred is not None:
-        starred_query = db_session.query(Message.thread_id).filter(
-            Message.namespace_id == namespace_id,
-            Message.is_starred == starred).subquery()
-        query = query.filter(Thread.id.in_(starred_query))
+        filters.append(_thread_flag_filter(
+            Thread.starred_count, Message.is_starred == true(), starred,
+            db_session))
+
+    if page_cursor is not None:
+        # Keyset pagination: continue after the (recentdate, id) of the last
+        # thread of the previous page. The redundant `<=` condition lets
+        # MySQL use it for an index range scan.
+        recentdate, id_ = page_cursor
+        filters.append(Thread.recentdate <= recentdate)
+        filters.append(or_(Thread.recentdate < recentdate,
+                           and_(Thread.recentdate == recentdate,
+                                Thread.id < id_)))
+
+    query = query.filter(*filters)
+
+    message_filters = _thread_message_filters(
+        namespace_id, from_addr, to_addr, cc_addr, bcc_addr, any_email,
+        filename, in_, db_session)
+    if message_filters:
+        # The most selective filter drives the query: join against the
+        # (distinct) ids of the threads it matches. The remaining filters are
+        # checked per thread with correlated EXISTS clauses.
+        driving = message_filters[0].with_entities(Message.thread_id). \
+            distinct().subquery()
+        query = query.join(driving, driving.c.thread_id == Thread.id)
+        for message_filter in message_filters[1:]:
+            query = query.filter(message_filter.filter(
+                Message.thread_id == Thread.id).correlate(Thread).exists())
 
     if view == 'count':
         return {"count": query.one()[0]}
 
     # Eager-load some objects in order to make constructing API
     # representations faster.
-    if view != 'ids':
-        if view == 'expanded':
-            load_only_columns = ('public_id', 'subject', 'is_draft', 'version',
-                                 'from_addr', 'to_addr', 'cc_addr', 'bcc_addr',
-                                 'received_date', 'snippet', 'is_read',
-                                 'reply_to_message_id', 'reply_to')
-        else:
-            load_only_columns = ('public_id', 'is_draft', 'from_addr',
-                                 'to_addr', 'cc_addr', 'bcc_addr', 'is_read',
-                                 'is_starred')
+    if view == 'expanded':
         query = query.options(
             subqueryload(Thread.messages).
-            load_only(*load_only_columns)
+            load_only('public_id', 'subject', 'is_draft', 'version',
+                      'from_addr', 'to_addr', 'cc_addr', 'bcc_addr',
+                      'received_date', 'snippet', 'is_read', 'is_starred',
+                      'reply_to_message_id', 'reply_to')
             .joinedload(Message.messagecategories)
             .joinedload(MessageCategory.category),
             subqueryload(Thread.messages)
             .joinedload(Message.parts)
             .joinedload(Part.block))
+    elif view != 'ids':
+        # The thread's summary columns cover everything else in its API
+        # representation.
+        query = query.options(
+            subqueryload(Thread.messages).load_only('public_id', 'is_draft'))
 
-    query = query.order_by(desc(Thread.recentdate)).limit(limit)
+    query = query.order_by(desc(Thread.recentdate), desc(Thread.id)). \
+        limit(limit)
 
     if offset:
         query = query.offset(offset)
@@ -147,7 +116,77 @@ def threads(namespace_id, subject, from_addr, to_addr, cc_addr, bcc_addr,
     if view == 'ids':
         return [x[0] for x in query.all()]
 
-    return query.all()
+    results = query.all()
+    preload_categories(db_session, results)
+    return results
+
+
+def _thread_flag_filter(count, message_condition, value, db_session):
+    """
+    Return a filter for threads that have (if `value` is True) or don't have
+    any message matching `message_condition`, counted by the summary column
+    `count`. Threads that haven't been summarized yet are checked against
+    their messages.
+
+    As with the thread's `unread` and `starred` properties, drafts don't
+    count: a thread whose only unread message is a draft isn't unread.
+
+    """
+    summarized = count > 0 if value else count == 0
+    matching = db_session.query(Message).filter(
+        Message.thread_id == Thread.id, Message.is_draft == false(),
+        message_condition).correlate(Thread).exists()
+    return or_(and_(Thread._participants.isnot(None), summarized),
+               and_(Thread._participants.is_(None),
+                    matching if value else ~matching))
+
+
+def _thread_message_filters(namespace_id, from_addr, to_addr, cc_addr,
+                            bcc_addr, any_email, filename, in_, db_session):
+    """
+    Return queries over Message, one for each of the given thread filters
+    that match on properties of a thread's messages, ordered from the
+    (typically) most to least selective. A thread matches a filter if any
+    of its messages is in the filter's query.
+
+    """
+    filters = []
+    for field, email_address in (('from_addr', from_addr),
+                                 ('to_addr', to_addr),
+                                 ('cc_addr', cc_addr),
+                                 ('bcc_addr', bcc_addr)):
+        if email_address is not None:
+            filters.append(db_session.query(Message).
+                           join(MessageContactAssociation).join(Contact).
+                           filter(Contact.email_address == email_address,
+                                  Contact.namespace_id == namespace_id,
+                                  MessageContactAssociation.field == field))
+
+    if filename is not None:
+        # Attachment filenames are rarely shared by many threads.
+        filters.insert(0, db_session.query(Message).join(Part).join(Block).
+                       filter(Block.filename == filename,
+                              Block.namespace_id == namespace_id))
+
+    if any_email is not None:
+        filters.append(db_session.query(Message).
+                       join(MessageContactAssociation).join(Contact).
+                       filter(Contact.email_address == any_email,
+                              Contact.namespace_id == namespace_id))
+
+    if in_ is not None:
+        category_filters = [Category.name == in_, Category.display_name == in_]
+        try:
+            valid_public_id(in_)
+            category_filters.append(Category.public_id == in_)
+        except InputError:
+            pass
+        filters.append(db_session.query(Message).
+                       join(MessageCategory).join(Category).
+                       filter(Category.namespace_id == namespace_id,
+                              or_(*category_filters)))
+
+    return filters
 
 
 def messages_or_drafts(namespace_id, drafts, subject, from_addr, to_addr,
@@ -155,7 +194,7 @@ def messages_or_drafts(namespace_id, drafts, subject, from_addr, to_addr,
                        started_before, started_after, last_message_before,
                        last_message_after, received_before, received_after,
                        filename, in_, unread, starred, limit, offset, view,
-                       db_session):
+                       db_session, page_cursor=None):
     # Warning: complexities ahead. This function sets up the query that gets
     # results for the /messages API. It loads from several tables, supports a
     # variety of views and filters, and is performance-critical for the API. As
@@ -191,6 +230,8 @@ def messages_or_drafts(namespace_id, drafts, subject, from_addr, to_addr,
         'limit': limit,
         'offset': offset
     }
+    if page_cursor is not None:
+        param_dict['cursor_date'], param_dict['cursor_id'] = page_cursor
 
     if view == 'count':
         target = func.count(Message.id)
@@ -246,6 +287,14 @@ def messages_or_drafts(namespace_id, drafts, subject, from_addr, to_addr,
         query += lambda q: q.filter(
             Message.received_date > bindparam('received_after'))
 
+    if page_cursor is not None:
+        # Keyset pagination on (received_date, id); see threads().
+        query += lambda q: q.filter(
+            Message.received_date <= bindparam('cursor_date'),
+            or_(Message.received_date < bindparam('cursor_date'),
+                and_(Message.received_date == bindparam('cursor_date'),
+                     Message.id < bindparam('cursor_id'))))
+
     if to_addr is not None:
         query.spoil()
         to_query = db_session.query(MessageContactAssociation.message_id). \
@@ -321,7 +370,8 @@ def messages_or_drafts(namespace_id, drafts, subject, from_addr, to_addr,
         res = query(db_session).params(**param_dict).one()[0]
         return {"count": res}
 
-    query += lambda q: q.order_by(desc(Message.received_date))
+    query += lambda q: q.order_by(desc(Message.received_date),
+                                  desc(Message.id))
     query += lambda q: q.limit(bindparam('limit'))
     if offset:
         query += lambda q: q.offset(bindparam('offset'))
@@ -422,6 +472,20 @@ def recurring_events(filters, starts_before, starts_after, ends_before,
     # Expands individual recurring events into full instances.
     # If neither starts_before or ends_before is given, the recurring range
     # defaults to now + 1 year (see events/recurring.py)
+    recur_instances = []
+    for instances in expanded_recurring_events(
+            filters, starts_before, starts_after, ends_before, ends_after,
+            db_session, show_cancelled):
+        recur_instances.extend(instances)
+    return recur_instances
+
+
+def expanded_recurring_events(filters, starts_before, starts_after,
+                              ends_before, ends_after, db_session,
+                              show_cancelled=False):
+    # Returns an iterator over the instances of each matching recurring
+    # event, in start order. Instances are only expanded as the iterators
+    # are consumed.
 
     recur_query = db_session.query(RecurringEvent)
     recur_query = filter_event_query(recur_query, RecurringEvent, *filters)
@@ -435,6 +499,11 @@ def recurring_events(filters, starts_before, starts_after, ends_before,
     if ends_before:
         # start < end, so event start < ends_before
         before_criteria.append(RecurringEvent.start < ends_before)
+    if not before_criteria:
+        # Events are only expanded this far, so later ones have no
+        # instances.
+        before_criteria.append(RecurringEvent.start <= arrow.utcnow().replace(
+            years=+EXPAND_RECURRING_YEARS))
     recur_query = recur_query.filter(and_(*before_criteria))
     after_criteria = []
     if starts_after:
@@ -445,24 +514,42 @@ def recurring_events(filters, starts_before, starts_after, ends_before,
                                   RecurringEvent.until == None))
 
     recur_query = recur_query.filter(and_(*after_criteria))
-
-    recur_instances = []
-    for r in recur_query:
+    recurring = recur_query.all()
+    if not recurring:
+        return []
+
+    # Load the overrides of all events at once rather than per event.
+    overrides = defaultdict(list)
+    for override in db_session.query(RecurringEventOverride).filter(
+            RecurringEventOverride.master_event_id.in_(
+                [r.id for r in recurring])):
+        overrides[override.master_event_id].append(override)
+
+    ranges = []
+    for r in recurring:
         # the occurrences check only checks starting timestamps
         if ends_before and not starts_before:
             starts_before = ends_before - r.length
         if ends_after and not starts_after:
             starts_after = ends_after - r.length
-        instances = r.all_events(start=starts_after, end=starts_before)
-        recur_instances.extend(instances)
+        ranges.append((r, starts_after, starts_before))
 
-    return recur_instances
+    # Read the start times from the occurrence table where they're
+    # materialised, rather than expanding the RRULEs.
+    start_times = {}
+    window = materialised_window(db_session)
+    if window is not None:
+        start_times = materialised_start_times(db_session, ranges, window)
+
+    return [r.iter_events(start=start, end=end, overrides=overrides[r.id],
+                          start_times=start_times.get(r.id))
+            for r, start, end in ranges]
 
 
 def events(namespace_id, event_public_id, calendar_public_id, title,
            description, location, busy, starts_before, starts_after,
            ends_before, ends_after, limit, offset, view,
-           expand_recurring, show_cancelled, db_session):
+           expand_recurring, show_cancelled, db_session, page_cursor=None):
 
     query = db_session.query(Event)
 
@@ -504,29 +591,42 @@ def events(namespace_id, event_public_id, calendar_public_id, title,
                 ((Event.status != 'cancelled') & (Event.discriminator !=
                                                   'recurringeventoverride')))
 
+    if page_cursor is not None:
+        if expand_recurring:
+            raise InputError('Cursors are not supported together with '
+                             'expand_recurring')
+        # Keyset pagination on (start, id); see threads().
+        start, id_ = page_cursor
+        event_criteria.append(Event.start >= start)
+        event_criteria.append(or_(Event.start > start,
+                                  and_(Event.start == start, Event.id > id_)))
+
     event_predicate = and_(*event_criteria)
     query = query.filter(event_predicate)
 
     if expand_recurring:
-        expanded = recurring_events(filters, starts_before, starts_after,
-                                    ends_before, ends_after, db_session,
-                                    show_cancelled=show_cancelled)
-
-        # Combine non-recurring events with expanded recurring ones
-        all_events = query.filter(Event.discriminator == 'event').all() + \
-            expanded
+        expanded = expanded_recurring_events(
+            filters, starts_before, starts_after, ends_before, ends_after,
+            db_session, show_cancelled=show_cancelled)
 
+        query = query.filter(Event.discriminator == 'event')
         if view == 'count':
-            return {"count": len(all_events)}
-
-        all_events = sorted(all_events, key=lambda e: e.start)
+            return {"count": query.count() +
+                    sum(sum(1 for _ in instances) for instances in expanded)}
+
+        # Combine non-recurring events with expanded recurring ones. Each
+        # source is ordered by start time, so only the first offset + limit
+        # events of each are needed.
+        query = query.order_by(asc(Event.start), asc(Event.id))
+        offset = offset or 0
         if limit:
-            offset = offset or 0
-            all_events = all_events[offset:offset + limit]
+            query = query.limit(offset + limit)
+        all_events = list(islice(merge_events([query] + expanded), offset,
+                                 offset + limit if limit else None))
     else:
         if view == 'count':
             return {"count": query.one()[0]}
-        query = query.order_by(asc(Event.start)).limit(limit)
+        query = query.order_by(asc(Event.start), asc(Event.id)).limit(limit)
         if offset:
             query = query.offset(offset)
         # Eager-load some objects in order to make constructing API
@@ -1,13 +1,8 @@
-import talon
-from talon import quotations
-talon.init()
-
-
 import arrow
 import datetime
 import calendar
 from json import JSONEncoder, dumps
-from flask import Response
+from flask import Response, request, has_request_context, stream_with_context
 
 from inbox.models import (Message, Contact, Calendar, Event, When,
                           Thread, Namespace, Block, Category, Account)
@@ -63,40 +58,68 @@ def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
     dictionary or None
 
     """
-    def _get_namespace_public_id(obj):
-        return namespace_public_id or obj.namespace.public_id
+    encoder = _encoder_for(type(obj))
+    if encoder is None:
+        return None
+    return encoder(obj, namespace_public_id, expand, legacy_nsid)
+
+
+def _encoder_for(cls):
+    """
+    Return the function encoding instances of `cls`: the one registered in
+    `_ENCODERS` for the closest class in its MRO. Lookups are cached per
+    class, so that encoding doesn't walk a chain of isinstance checks.
 
-    def _format_participant_data(participant):
-        """Event.participants is a JSON blob which may contain internal data.
-        This function returns a dict with only the data we want to make
-        public."""
-        dct = {}
-        for attribute in ['name', 'status', 'email', 'comment']:
-            dct[attribute] = participant.get(attribute)
+    """
+    try:
+        return _encoders_by_class[cls]
+    except KeyError:
+        encoder = next((_ENCODERS[base] for base in cls.__mro__
+                        if base in _ENCODERS), None)
+        _encoders_by_class[cls] = encoder
+        return encoder
 
-        return dct
 
-    def _get_lowercase_class_name(obj):
-        return type(obj).__name__.lower()
+def _public_id_key_name(legacy_nsid):
+    return 'namespace_id' if legacy_nsid else 'account_id'
 
-    if legacy_nsid:
-        public_id_key_name = 'namespace_id'
-    else:
-        public_id_key_name = 'account_id'
 
-    # Flask's jsonify() doesn't handle datetimes or json arrays as primary
-    # objects.
-    if isinstance(obj, datetime.datetime):
-        return calendar.timegm(obj.utctimetuple())
+def _get_namespace_public_id(obj, namespace_public_id):
+    return namespace_public_id or obj.namespace.public_id
+
 
-    if isinstance(obj, datetime.date):
-        return obj.isoformat()
+def _format_participant_data(participant):
+    """Event.participants is a JSON blob which may contain internal data.
+    This function returns a dict with only the data we want to make
+    public."""
+    dct = {}
+    for attribute in ['name', 'status', 'email', 'comment']:
+        dct[attribute] = participant.get(attribute)
 
-    if isinstance(obj, arrow.arrow.Arrow):
-        return encode(obj.datetime, legacy_nsid=legacy_nsid)
+    return dct
 
+
+def _get_lowercase_class_name(obj):
+    return type(obj).__name__.lower()
+
+
+# Flask's jsonify() doesn't handle datetimes or json arrays as primary
+# objects.
+def _encode_datetime(obj, namespace_public_id, expand, legacy_nsid):
+    return calendar.timegm(obj.utctimetuple())
+
+
+def _encode_date(obj, namespace_public_id, expand, legacy_nsid):
+    return obj.isoformat()
+
+
+def _encode_arrow(obj, namespace_public_id, expand, legacy_nsid):
+    return encode(obj.datetime, legacy_nsid=legacy_nsid)
+
+
+def _encode_namespace(obj, namespace_public_id, expand, legacy_nsid):
     # TODO deprecate this and remove -- legacy_nsid
-    elif isinstance(obj, Namespace) and legacy_nsid:
+    if legacy_nsid:
         return {
             'id': obj.public_id,
             'object': 'namespace',
@@ -109,243 +132,278 @@ def _encode(obj, namespace_public_id=None, expand=False, legacy_nsid=False):
             'provider': obj.account.provider,
             'organization_unit': obj.account.category_type
         }
-    elif isinstance(obj, Namespace):  # these are now "Account" objects
-        return {
-            'id': obj.public_id,
-            'object': 'account',
-            'account_id': obj.public_id,
+    # these are now "Account" objects
+    return {
+        'id': obj.public_id,
+        'object': 'account',
+        'account_id': obj.public_id,
+
+        'email_address': obj.account.email_address,
+        'name': obj.account.name,
+        'provider': obj.account.provider,
+        'organization_unit': obj.account.category_type
+    }
 
-            'email_address': obj.account.email_address,
-            'name': obj.account.name,
-            'provider': obj.account.provider,
-            'organization_unit': obj.account.category_type
-        }
 
-    elif isinstance(obj, Account) and not legacy_nsid:
+def _encode_account(obj, namespace_public_id, expand, legacy_nsid):
+    if not legacy_nsid:
         raise Exception("Should never be serializing accounts (legacy_nsid)")
 
-    elif isinstance(obj, Account):
-        return {
-            'account_id': obj.namespace.public_id,  # ugh
-            'id': obj.namespace.public_id,  # ugh
-            'object': 'account',
-            'email_address': obj.email_address,
-            'name': obj.name,
-            'organization_unit': obj.category_type,
+    return {
+        'account_id': obj.namespace.public_id,  # ugh
+        'id': obj.namespace.public_id,  # ugh
+        'object': 'account',
+        'email_address': obj.email_address,
+        'name': obj.name,
+        'organization_unit': obj.category_type,
+
+        'provider': obj.provider,
+
+        # TODO add capabilities/scope (i.e. mail, contacts, cal, etc.)
+
+        # 'status':  'syncing',  # TODO what are values here
+        # 'last_sync':  1398790077,  # tuesday 4/29
+    }
+
+
+def _encode_message(obj, namespace_public_id, expand, legacy_nsid):
+    public_id_key_name = _public_id_key_name(legacy_nsid)
+    resp = {
+        'id': obj.public_id,
+        'object': 'message',
+        public_id_key_name: _get_namespace_public_id(obj, namespace_public_id),
+        'subject': obj.subject,
+        'from': format_address_list(obj.from_addr),
+        'reply_to': format_address_list(obj.reply_to),
+        'to': format_address_list(obj.to_addr),
+        'cc': format_address_list(obj.cc_addr),
+        'bcc': format_address_list(obj.bcc_addr),
+        'date': obj.received_date,
+        'thread_id': obj.thread.public_id,
+        'snippet': obj.snippet,
+        'body': obj.body,
+        'text': obj.reply_text,
+        'unread': not obj.is_read,
+        'starred': obj.is_starred,
+        'files': obj.api_attachment_metadata,
+        'events': [encode(e, legacy_nsid=legacy_nsid) for e in obj.events]
+    }
+
+    categories = format_categories(obj.categories)
+    if obj.namespace.account.category_type == 'folder':
+        resp['folder'] = categories[0] if categories else None
+    else:
+        resp['labels'] = categories
+
+    # If the message is a draft (Inbox-created or otherwise):
+    if obj.is_draft:
+        resp['object'] = 'draft'
+        resp['version'] = obj.version
+        if obj.reply_to_message is not None:
+            resp['reply_to_message_id'] = obj.reply_to_message.public_id
+        else:
+            resp['reply_to_message_id'] = None
 
-            'provider': obj.provider,
+    if expand:
+        resp['headers'] = {
+            'Message-Id': obj.message_id_header,
+            'In-Reply-To': obj.in_reply_to,
+            'References': obj.references
+        }
 
-            # TODO add capabilities/scope (i.e. mail, contacts, cal, etc.)
+    return resp
+
+
+def _encode_thread(obj, namespace_public_id, expand, legacy_nsid):
+    public_id_key_name = _public_id_key_name(legacy_nsid)
+    base = {
+        'id': obj.public_id,
+        'object': 'thread',
+        public_id_key_name: _get_namespace_public_id(obj, namespace_public_id),
+        'subject': obj.subject,
+        'participants': format_address_list(obj.participants),
+        'last_message_timestamp': obj.recentdate,
+        'last_message_received_timestamp': obj.receivedrecentdate,
+        'first_message_timestamp': obj.subjectdate,
+        'snippet': obj.snippet,
+        'unread': obj.unread,
+        'starred': obj.starred,
+        'has_attachments': obj.has_attachments,
+        'version': obj.version,
+        # For backwards-compatibility -- remove after deprecating tags API
+        'tags': obj.tags
+    }
+
+    categories = format_categories(obj.categories)
+    if obj.namespace.account.category_type == 'folder':
+        base['folders'] = categories
+    else:
+        base['labels'] = categories
 
-            # 'status':  'syncing',  # TODO what are values here
-            # 'last_sync':  1398790077,  # tuesday 4/29
-        }
+    if not expand:
+        base['message_ids'] = \
+            [m.public_id for m in obj.messages if not m.is_draft]
+        base['draft_ids'] = [m.public_id for m in obj.drafts]
+        return base
 
-    elif isinstance(obj, Message):
+    # Expand messages within threads
+    all_expanded_messages = []
+    all_expanded_drafts = []
+    for msg in obj.messages:
         resp = {
-            'id': obj.public_id,
+            'id': msg.public_id,
             'object': 'message',
-            public_id_key_name: _get_namespace_public_id(obj),
-            'subject': obj.subject,
-            'from': format_address_list(obj.from_addr),
-            'reply_to': format_address_list(obj.reply_to),
-            'to': format_address_list(obj.to_addr),
-            'cc': format_address_list(obj.cc_addr),
-            'bcc': format_address_list(obj.bcc_addr),
-            'date': obj.received_date,
-            'thread_id': obj.thread.public_id,
-            'snippet': obj.snippet,
-            'body': obj.body,
-            'text': quotations.extract_from_html(quotations.extract_from(obj.body, 'text/html')),
-            'unread': not obj.is_read,
-            'starred': obj.is_starred,
-            'files': obj.api_attachment_metadata,
-            'events': [encode(e, legacy_nsid=legacy_nsid) for e in obj.events]
+            public_id_key_name: _get_namespace_public_id(
+                msg, namespace_public_id),
+            'subject': msg.subject,
+            'from': format_address_list(msg.from_addr),
+            'reply_to': format_address_list(msg.reply_to),
+            'to': format_address_list(msg.to_addr),
+            'cc': format_address_list(msg.cc_addr),
+            'bcc': format_address_list(msg.bcc_addr),
+            'date': msg.received_date,
+            'thread_id': obj.public_id,
+            'snippet': msg.snippet,
+            'unread': not msg.is_read,
+            'starred': msg.is_starred,
+            'files': msg.api_attachment_metadata
         }
-
-        categories = format_categories(obj.categories)
+        categories = format_categories(msg.categories)
         if obj.namespace.account.category_type == 'folder':
             resp['folder'] = categories[0] if categories else None
         else:
             resp['labels'] = categories
 
-        # If the message is a draft (Inbox-created or otherwise):
-        if obj.is_draft:
+        if msg.is_draft:
             resp['object'] = 'draft'
-            resp['version'] = obj.version
-            if obj.reply_to_message is not None:
-                resp['reply_to_message_id'] = obj.reply_to_message.public_id
+            resp['version'] = msg.version
+            if msg.reply_to_message is not None:
+                resp['reply_to_message_id'] = \
+                    msg.reply_to_message.public_id
             else:
                 resp['reply_to_message_id'] = None
-
-        if expand:
-            resp['headers'] = {
-                'Message-Id': obj.message_id_header,
-                'In-Reply-To': obj.in_reply_to,
-                'References': obj.references
-            }
-
-        return resp
-
-    elif isinstance(obj, Thread):
-        base = {
-            'id': obj.public_id,
-            'object': 'thread',
-            public_id_key_name: _get_namespace_public_id(obj),
-            'subject': obj.subject,
-            'participants': format_address_list(obj.participants),
-            'last_message_timestamp': obj.recentdate,
-            'last_message_received_timestamp': obj.receivedrecentdate,
-            'first_message_timestamp': obj.subjectdate,
-            'snippet': obj.snippet,
-            'unread': obj.unread,
-            'starred': obj.starred,
-            'has_attachments': obj.has_attachments,
-            'version': obj.version,
-            # For backwards-compatibility -- remove after deprecating tags API
-            'tags': obj.tags
-        }
-
-        categories = format_categories(obj.categories)
-        if obj.namespace.account.category_type == 'folder':
-            base['folders'] = categories
+            all_expanded_drafts.append(resp)
         else:
-            base['labels'] = categories
-
-        if not expand:
-            base['message_ids'] = \
-                [m.public_id for m in obj.messages if not m.is_draft]
-            base['draft_ids'] = [m.public_id for m in obj.drafts]
-            return base
-
-        # Expand messages within threads
-        all_expanded_messages = []
-        all_expanded_drafts = []
-        for msg in obj.messages:
-            resp = {
-                'id': msg.public_id,
-                'object': 'message',
-                public_id_key_name: _get_namespace_public_id(msg),
-                'subject': msg.subject,
-                'from': format_address_list(msg.from_addr),
-                'reply_to': format_address_list(msg.reply_to),
-                'to': format_address_list(msg.to_addr),
-                'cc': format_address_list(msg.cc_addr),
-                'bcc': format_address_list(msg.bcc_addr),
-                'date': msg.received_date,
-                'thread_id': obj.public_id,
-                'snippet': msg.snippet,
-                'unread': not msg.is_read,
-                'starred': msg.is_starred,
-                'files': msg.api_attachment_metadata
-            }
-            categories = format_categories(msg.categories)
-            if obj.namespace.account.category_type == 'folder':
-                resp['folder'] = categories[0] if categories else None
-            else:
-                resp['labels'] = categories
-
-            if msg.is_draft:
-                resp['object'] = 'draft'
-                resp['version'] = msg.version
-                if msg.reply_to_message is not None:
-                    resp['reply_to_message_id'] = \
-                        msg.reply_to_message.public_id
-                else:
-                    resp['reply_to_message_id'] = None
-                all_expanded_drafts.append(resp)
-            else:
-                all_expanded_messages.append(resp)
-
-        base['messages'] = all_expanded_messages
-        base['drafts'] = all_expanded_drafts
-        return base
-
-    elif isinstance(obj, Contact):
-        return {
-            'id': obj.public_id,
-            'object': 'contact',
-            public_id_key_name: _get_namespace_public_id(obj),
-            'name': obj.name,
-            'email': obj.email_address
-        }
-
-    elif isinstance(obj, Event):
-        resp = {
-            'id': obj.public_id,
-            'object': 'event',
-            public_id_key_name: _get_namespace_public_id(obj),
-            'calendar_id': obj.calendar.public_id if obj.calendar else None,
-            'message_id': obj.message.public_id if obj.message else None,
-            'title': obj.title,
-            'description': obj.description,
-            'owner': obj.owner,
-            'participants': [_format_participant_data(participant)
-                             for participant in obj.participants],
-            'read_only': obj.read_only,
-            'location': obj.location,
-            'when': encode(obj.when, legacy_nsid=legacy_nsid),
-            'busy': obj.busy,
-            'status': obj.status,
-        }
-        if isinstance(obj, RecurringEvent):
-            resp['recurrence'] = {
-                'rrule': obj.recurring,
-                'timezone': obj.start_timezone
-            }
-        if isinstance(obj, RecurringEventOverride):
-            resp['original_start_time'] = encode(obj.original_start_time,
-                                                 legacy_nsid=legacy_nsid)
-            if obj.master:
-                resp['master_event_id'] = obj.master.public_id
-        return resp
-
-    elif isinstance(obj, Calendar):
-        return {
-            'id': obj.public_id,
-            'object': 'calendar',
-            public_id_key_name: _get_namespace_public_id(obj),
-            'name': obj.name,
-            'description': obj.description,
-            'read_only': obj.read_only,
+            all_expanded_messages.append(resp)
+
+    base['messages'] = all_expanded_messages
+    base['drafts'] = all_expanded_drafts
+    return base
+
+
+def _encode_contact(obj, namespace_public_id, expand, legacy_nsid):
+    public_id_key_name = _public_id_key_name(legacy_nsid)
+    return {
+        'id': obj.public_id,
+        'object': 'contact',
+        public_id_key_name: _get_namespace_public_id(obj, namespace_public_id),
+        'name': obj.name,
+        'email': obj.email_address
+    }
+
+
+def _encode_event(obj, namespace_public_id, expand, legacy_nsid):
+    public_id_key_name = _public_id_key_name(legacy_nsid)
+    resp = {
+        'id': obj.public_id,
+        'object': 'event',
+        public_id_key_name: _get_namespace_public_id(obj, namespace_public_id),
+        'calendar_id': obj.calendar.public_id if obj.calendar else None,
+        'message_id': obj.message.public_id if obj.message else None,
+        'title': obj.title,
+        'description': obj.description,
+        'owner': obj.owner,
+        'participants': [_format_participant_data(participant)
+                         for participant in obj.participants],
+        'read_only': obj.read_only,
+        'location': obj.location,
+        'when': encode(obj.when, legacy_nsid=legacy_nsid),
+        'busy': obj.busy,
+        'status': obj.status,
+    }
+    if isinstance(obj, RecurringEvent):
+        resp['recurrence'] = {
+            'rrule': obj.recurring,
+            'timezone': obj.start_timezone
         }
-
-    elif isinstance(obj, When):
-        # Get time dictionary e.g. 'start_time': x, 'end_time': y or 'date': z
-        times = obj.get_time_dict()
-        resp = {k: encode(v, legacy_nsid=legacy_nsid) for
-                                         k, v in times.iteritems()}
-        resp['object'] = _get_lowercase_class_name(obj)
-        return resp
-
-    elif isinstance(obj, Block):  # ie: Attachments/Files
-        resp = {
-            'id': obj.public_id,
-            'object': 'file',
-            public_id_key_name: _get_namespace_public_id(obj),
-            'content_type': obj.content_type,
-            'size': obj.size,
-            'filename': obj.filename,
-        }
-        if len(obj.parts):
-            # if obj is actually a message attachment (and not merely an
-            # uploaded file), set additional properties
-            resp.update({
-                'message_ids': [p.message.public_id for p in obj.parts]
-            })
-
-        return resp
-
-    elif isinstance(obj, Category):
-        # 'object' is set to 'folder' or 'label'
-        resp = {
-            'id': obj.public_id,
-            'object': obj.type,
-            public_id_key_name: _get_namespace_public_id(obj),
-            'name': obj.name,
-            'display_name': obj.api_display_name
-        }
-        return resp
+    if isinstance(obj, RecurringEventOverride):
+        resp['original_start_time'] = encode(obj.original_start_time,
+                                             legacy_nsid=legacy_nsid)
+        if obj.master:
+            resp['master_event_id'] = obj.master.public_id
+    return resp
+
+
+def _encode_calendar(obj, namespace_public_id, expand, legacy_nsid):
+    public_id_key_name = _public_id_key_name(legacy_nsid)
+    return {
+        'id': obj.public_id,
+        'object': 'calendar',
+        public_id_key_name: _get_namespace_public_id(obj, namespace_public_id),
+        'name': obj.name,
+        'description': obj.description,
+        'read_only': obj.read_only,
+    }
+
+
+def _encode_when(obj, namespace_public_id, expand, legacy_nsid):
+    # Get time dictionary e.g. 'start_time': x, 'end_time': y or 'date': z
+    times = obj.get_time_dict()
+    resp = {k: encode(v, legacy_nsid=legacy_nsid) for
+                                     k, v in times.iteritems()}
+    resp['object'] = _get_lowercase_class_name(obj)
+    return resp
+
+
+def _encode_block(obj, namespace_public_id, expand, legacy_nsid):
+    public_id_key_name = _public_id_key_name(legacy_nsid)
+    resp = {
+        'id': obj.public_id,
+        'object': 'file',
+        public_id_key_name: _get_namespace_public_id(obj, namespace_public_id),
+        'content_type': obj.content_type,
+        'size': obj.size,
+        'filename': obj.filename,
+    }
+    if len(obj.parts):
+        # if obj is actually a message attachment (and not merely an
+        # uploaded file), set additional properties
+        resp.update({
+            'message_ids': [p.message.public_id for p in obj.parts]
+        })
+
+    return resp
+
+
+def _encode_category(obj, namespace_public_id, expand, legacy_nsid):
+    public_id_key_name = _public_id_key_name(legacy_nsid)
+    # 'object' is set to 'folder' or 'label'
+    resp = {
+        'id': obj.public_id,
+        'object': obj.type,
+        public_id_key_name: _get_namespace_public_id(obj, namespace_public_id),
+        'name': obj.name,
+        'display_name': obj.api_display_name
+    }
+    return resp
+
+
+_ENCODERS = {
+    datetime.datetime: _encode_datetime,
+    datetime.date: _encode_date,
+    arrow.arrow.Arrow: _encode_arrow,
+    Namespace: _encode_namespace,
+    Account: _encode_account,
+    Message: _encode_message,
+    Thread: _encode_thread,
+    Contact: _encode_contact,
+    Event: _encode_event,
+    Calendar: _encode_calendar,
+    When: _encode_when,
+    Block: _encode_block,
+    Category: _encode_category
+}
+_encoders_by_class = {}
 
 
 class APIEncoder(object):
@@ -403,16 +461,39 @@ class APIEncoder(object):
                          indent=4,
                          separators=(',', ': '),
                          cls=self.encoder_class)
-        return dumps(obj, cls=self.encoder_class)
+        return dumps(obj, separators=(',', ':'), cls=self.encoder_class)
 
-    def jsonify(self, obj):
+    def iter_cereal(self, objs, chunk_size=100):
+        """
+        Yields the compact JSON representation of the list objs in pieces,
+        encoding chunk_size elements at a time.
+
+        """
+        encoder = self.encoder_class(separators=(',', ':'))
+        if not objs:
+            yield '[]'
+            return
+        for i in range(0, len(objs), chunk_size):
+            chunk = ','.join(encoder.encode(obj)
+                             for obj in objs[i:i + chunk_size])
+            yield ('[' if i == 0 else ',') + chunk
+        yield ']'
+
+    def jsonify(self, obj, stream=False):
         """
         Returns a Flask Response object encapsulating the JSON
         representation of obj.
 
+        The JSON is pretty-printed for browsers and for requests with
+        `pretty=true`, and compact otherwise.
+
         Parameters
         ----------
         obj: serializable object
+        stream: bool, optional
+            If obj is a list, encode its elements as the response is sent
+            (compact output only). The caller must keep the objects' session
+            open until the end of the request.
 
         Raises
         ------
@@ -420,5 +501,39 @@ class APIEncoder(object):
             If obj is not serializable.
 
         """
-        return Response(self.cereal(obj, pretty=True),
+        pretty = _wants_pretty_json()
+        if stream and not pretty and isinstance(obj, list) and \
+                has_request_context():
+            chunks = self.iter_cereal(obj)
+            # Encode the first chunk before the status is sent, so that most
+            # encoding errors are still a 500 error.
+            first = next(chunks)
+            return Response(
+                stream_with_context(_abort_on_error(first, chunks)),
+                mimetype='application/json')
+        return Response(self.cereal(obj, pretty=pretty),
                         mimetype='application/json')
+
+
+def _abort_on_error(first, chunks):
+    yield first
+    try:
+        for chunk in chunks:
+            yield chunk
+    except Exception:
+        # The 200 status has been sent already. Re-raise so that the server
+        # drops the connection instead of ending the response as if it were
+        # complete.
+        log.error('Error encoding streamed response', exc_info=True)
+        raise
+
+
+def _wants_pretty_json():
+    if not has_request_context():
+        return True
+    pretty = request.args.get('pretty')
+    if pretty is not None:
+        return pretty.lower() == 'true'
+    # Browsers get human-readable output, API clients compact output.
+    return any(mimetype == 'text/html'
+               for mimetype, _ in request.accept_mimetypes)
@@ -0,0 +1,62 @@
+"""
+Process-wide cache of namespace public id -> (id, account_id).
+
+Every API request authenticates by namespace public id. The cache lets the
+auth hook resolve it without a database round trip, and the request attaches
+a namespace with the cached attributes to its session instead of loading it;
+its other attributes and relationships are only loaded if they're accessed.
+Entries expire after `NAMESPACE_CACHE_TTL` seconds, and are dropped as soon
+as a namespace is deleted through the ORM in this process.
+
+"""
+from collections import namedtuple
+
+from sqlalchemy import event
+from sqlalchemy.orm.session import make_transient_to_detached
+
+from inbox.config import config
+from inbox.models import Namespace
+from inbox.util.lru import LRUCache
+
+CachedNamespace = namedtuple('CachedNamespace', ['id', 'account_id'])
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 60
+
+
+class NamespaceCache(LRUCache):
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        LRUCache.__init__(self, max_entries, ttl)
+
+    def set_namespace(self, namespace):
+        value = CachedNamespace(namespace.id, namespace.account_id)
+        self.set(namespace.public_id, value)
+        return value
+
+    def load_namespace(self, public_id, db_session):
+        """
+        Return the namespace with the given public id in db_session. It's
+        only queried if it isn't cached. Raises NoResultFound if it doesn't
+        exist.
+
+        """
+        cached = self.get(public_id)
+        if cached is None:
+            namespace = Namespace.from_public_id(public_id, db_session)
+            self.set_namespace(namespace)
+            return namespace
+        namespace = Namespace(id=cached.id, public_id=public_id,
+                              account_id=cached.account_id)
+        make_transient_to_detached(namespace)
+        db_session.add(namespace)
+        return namespace
+
+
+namespace_cache = NamespaceCache(
+    int(config.get('NAMESPACE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+    int(config.get('NAMESPACE_CACHE_TTL', DEFAULT_TTL)))
+
+
+@event.listens_for(Namespace, 'after_delete')
+def invalidate_deleted_namespace(mapper, connection, target):
+    namespace_cache.invalidate(target.public_id)
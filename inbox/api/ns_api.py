@@ -1,12 +1,12 @@
 import os
-import base64
 import email.header
+import itertools
 import uuid
 import gevent
 import time
 from datetime import datetime
 
-from flask import request, g, Blueprint, make_response, Response
+from flask import request, g, Blueprint, Response
 from flask import jsonify as flask_jsonify
 from flask.ext.restful import reqparse
 from sqlalchemy import asc, func
@@ -20,6 +20,7 @@ from inbox.models.backends.generic import GenericAccount
 from inbox.api.sending import send_draft, send_raw_mime
 from inbox.api.update import update_message, update_thread
 from inbox.api.kellogs import APIEncoder
+from inbox.api.namespace_cache import namespace_cache
 from inbox.api import filtering
 from inbox.api.validation import (get_attachments, get_calendar,
                                   get_recipients, get_draft, valid_public_id,
@@ -28,7 +29,8 @@ from inbox.api.validation import (get_attachments, get_calendar,
                                   limit, offset, ValidatableArgument,
                                   strict_bool, validate_draft_recipients,
                                   valid_delta_object_types, valid_display_name,
-                                  noop_event_update)
+                                  noop_event_update, page_cursor,
+                                  encode_page_cursor)
 from inbox.config import config
 from inbox.contacts.algorithms import (calculate_contact_scores,
                                        calculate_group_scores,
@@ -42,7 +44,10 @@ from inbox.models.action_log import schedule_action
 from inbox.models.session import new_session, session_scope
 from inbox.search.base import get_search_client
 from inbox.transactions import delta_sync
-from inbox.api.err import err, APIException, NotFoundError, InputError
+from inbox.transactions.retention import compacted_cursor, log_trimmed
+from inbox.util.encoding import iter_base64
+from inbox.api.err import (err, APIException, NotFoundError, InputError,
+                           CursorExpiredError)
 from inbox.events.ical import (generate_icalendar_invite, send_invite,
                                generate_rsvp, send_rsvp)
 
@@ -93,11 +98,15 @@ def pull_lang_code(endpoint, values):
 
 @app.before_request
 def start():
-    g.db_session = new_session(engine)
+    # The auth hook may already have opened the session and loaded the
+    # namespace; reuse them.
+    if not hasattr(g, 'db_session'):
+        g.db_session = new_session(engine)
     try:
         valid_public_id(g.namespace_public_id)
-        g.namespace = Namespace.from_public_id(g.namespace_public_id,
-                                               g.db_session)
+        if getattr(g, 'namespace', None) is None:
+            g.namespace = namespace_cache.load_namespace(
+                g.namespace_public_id, g.db_session)
 
         g.encoder = APIEncoder(g.namespace.public_id,
                                legacy_nsid=g.legacy_nsid)
@@ -112,6 +121,8 @@ def start():
     g.parser.add_argument('limit', default=DEFAULT_LIMIT, type=limit,
                           location='args')
     g.parser.add_argument('offset', default=0, type=offset, location='args')
+    # Read by the encoder.
+    g.parser.add_argument('pretty', type=strict_bool, location='args')
 
     if hasattr(g, 'namespace_public_id') and \
             not g.namespace_public_id == g.namespace.public_id:
@@ -120,6 +131,12 @@ def start():
 
 @app.after_request
 def finish(response):
+    if response.is_streamed:
+        # The body of a (read-only) streamed response is encoded as it's
+        # sent, so leave the session open; it's closed on teardown. If
+        # encoding fails partway, the connection is dropped (see
+        # APIEncoder.jsonify).
+        return response
     if response.status_code == 200 and hasattr(g, 'db_session'):  # be cautions
         g.db_session.commit()
     if hasattr(g, 'db_session'):
@@ -143,6 +160,22 @@ def handle_input_error(error):
     return response
 
 
+def paged_response(encoder, results, args, sort_attr):
+    """
+    Return the JSON response for one page of a list endpoint. If the page is
+    full, include an opaque cursor for the next page in the X-Next-Cursor
+    header. (Not available for the 'count' and 'ids' views.)
+
+    """
+    response = encoder.jsonify(results, stream=True)
+    if args['view'] not in ('count', 'ids') and args['limit'] and \
+            len(results) == args['limit']:
+        last = results[-1]
+        response.headers['X-Next-Cursor'] = encode_page_cursor(
+            getattr(last, sort_attr), last.id)
+    return response
+
+
 # TODO remove legacy_nsid
 @app.route('/n/<namespace_id>')
 def single_namespace(namespace_id):
@@ -187,6 +220,7 @@ def thread_query_api():
     g.parser.add_argument('unread', type=strict_bool, location='args')
     g.parser.add_argument('starred', type=strict_bool, location='args')
     g.parser.add_argument('view', type=view, location='args')
+    g.parser.add_argument('cursor', type=page_cursor, location='args')
 
     # For backwards-compatibility -- remove after deprecating tags API.
     g.parser.add_argument('tag', type=bounded_str, location='args')
@@ -221,13 +255,14 @@ def thread_query_api():
         limit=args['limit'],
         offset=args['offset'],
         view=args['view'],
-        db_session=g.db_session)
+        db_session=g.db_session,
+        page_cursor=args['cursor'])
 
     # Use a new encoder object with the expand parameter set.
     encoder = APIEncoder(g.namespace.public_id,
                          args['view'] == 'expanded',
                          legacy_nsid=g.legacy_nsid)
-    return encoder.jsonify(threads)
+    return paged_response(encoder, threads, args, 'recentdate')
 
 
 @app.route('/threads/search', methods=['GET'])
@@ -320,6 +355,7 @@ def message_query_api():
     g.parser.add_argument('unread', type=strict_bool, location='args')
     g.parser.add_argument('starred', type=strict_bool, location='args')
     g.parser.add_argument('view', type=view, location='args')
+    g.parser.add_argument('cursor', type=page_cursor, location='args')
 
     # For backwards-compatibility -- remove after deprecating tags API.
     g.parser.add_argument('tag', type=bounded_str, location='args')
@@ -351,12 +387,13 @@ def message_query_api():
         limit=args['limit'],
         offset=args['offset'],
         view=args['view'],
-        db_session=g.db_session)
+        db_session=g.db_session,
+        page_cursor=args['cursor'])
 
     # Use a new encoder object with the expand parameter set.
     encoder = APIEncoder(g.namespace.public_id, args['view'] == 'expanded',
                          legacy_nsid=g.legacy_nsid)
-    return encoder.jsonify(messages)
+    return paged_response(encoder, messages, args, 'received_date')
 
 
 @app.route('/messages/search', methods=['GET'])
@@ -393,8 +430,7 @@ def message_read_api(public_id):
 
     if request.headers.get('Accept', None) == 'message/rfc822':
         if message.full_body is not None:
-            return Response(message.full_body.data,
-                            mimetype='message/rfc822')
+            return _blob_response(message.full_body, 'message/rfc822')
         else:
             g.log.error("Message without full_body attribute: id='{0}'"
                         .format(message.id))
@@ -435,15 +471,19 @@ def raw_message_api(public_id):
     if message.full_body is None:
         raise NotFoundError("Couldn't find message {0}".format(public_id))
 
-    if message.full_body is not None:
-        b64_contents = base64.b64encode(message.full_body.data)
-    else:
-        g.log.error("Message without full_body attribute: id='{0}'"
-                    .format(message.id))
-        raise NotFoundError(
-                    "Couldn't find raw contents for message `{0}` "
-                    .format(public_id))
-    return g.encoder.jsonify({"rfc2822": b64_contents})
+    if request.headers.get('Accept', None) == 'message/rfc822':
+        return _blob_response(message.full_body, 'message/rfc822')
+
+    # Equivalent to jsonify({"rfc2822": <base64 contents>}), without holding
+    # the raw message or its encoding in memory.
+    chunks = iter_base64(message.full_body.iter_data())
+
+    def generate():
+        yield '{"rfc2822":"'
+        for chunk in chunks:
+            yield chunk
+        yield '"}'
+    return Response(generate(), mimetype='application/json')
 
 
 # Folders / Labels
@@ -689,6 +729,7 @@ def event_api():
     g.parser.add_argument('expand_recurring', type=strict_bool,
                           location='args')
     g.parser.add_argument('show_cancelled', type=strict_bool, location='args')
+    g.parser.add_argument('cursor', type=page_cursor, location='args')
 
     args = strict_parse_args(g.parser, request.args)
 
@@ -709,9 +750,12 @@ def event_api():
         view=args['view'],
         expand_recurring=args['expand_recurring'],
         show_cancelled=args['show_cancelled'],
-        db_session=g.db_session)
+        db_session=g.db_session,
+        page_cursor=args['cursor'])
 
-    return g.encoder.jsonify(results)
+    if args['expand_recurring']:
+        return g.encoder.jsonify(results)
+    return paged_response(g.encoder, results, args, 'start')
 
 
 @app.route('/events/', methods=['POST'])
@@ -1070,11 +1114,7 @@ def file_download_api(public_id):
             # HACK just append the major part of the content type
             name = 'attachment.{0}'.format(ct.split('/')[0])
 
-    # TODO the part.data object should really behave like a stream we can read
-    # & write to
-    response = make_response(f.data)
-
-    response.headers['Content-Type'] = 'application/octet-stream'  # ct
+    response = _blob_response(f, 'application/octet-stream')  # ct
     # Werkzeug will try to encode non-ascii header values as latin-1. Try that
     # first; if it fails, use RFC2047/MIME encoding. See
     # https://tools.ietf.org/html/rfc7230#section-3.2.4.
@@ -1088,6 +1128,55 @@ def file_download_api(public_id):
     return response
 
 
+def _blob_response(blob, content_type):
+    """
+    Return a streaming response with the data of `blob`. Supports
+    conditional requests (the ETag is the data's sha256) and single byte
+    ranges.
+
+    """
+    etag = blob.data_sha256
+    if etag and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    status = 200
+    start, end = 0, blob.size
+    headers = {'Accept-Ranges': 'bytes'}
+    if request.range is not None:
+        byte_range = request.range.range_for_length(blob.size)
+        if byte_range is None:
+            if request.range.units == 'bytes' and \
+                    len(request.range.ranges) == 1:
+                headers['Content-Range'] = 'bytes */{}'.format(blob.size)
+                return Response(status=416, headers=headers)
+            # Multiple ranges aren't supported; send everything instead.
+        else:
+            status = 206
+            start, end = byte_range
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end - 1, blob.size)
+
+    # Read the first chunk before committing to a status and length, so that
+    # missing data is an error rather than an empty 200 response.
+    chunks = blob.iter_data(start, end)
+    first = next(chunks, None)
+    if first is None and end > start:
+        g.log.error('Missing blob data', data_sha256=blob.data_sha256)
+        raise NotFoundError("Couldn't find the data of this object")
+    if first is not None:
+        chunks = itertools.chain([first], chunks)
+
+    headers['Content-Length'] = str(end - start)
+    response = Response(chunks, status=status,
+                        headers=headers, content_type=content_type,
+                        direct_passthrough=True)
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
 ##
 # Calendars
 ##
@@ -1160,6 +1249,7 @@ def draft_query_api():
     g.parser.add_argument('unread', type=strict_bool, location='args')
     g.parser.add_argument('starred', type=strict_bool, location='args')
     g.parser.add_argument('view', type=view, location='args')
+    g.parser.add_argument('cursor', type=page_cursor, location='args')
 
     args = strict_parse_args(g.parser, request.args)
 
@@ -1186,9 +1276,10 @@ def draft_query_api():
         limit=args['limit'],
         offset=args['offset'],
         view=args['view'],
-        db_session=g.db_session)
+        db_session=g.db_session,
+        page_cursor=args['cursor'])
 
-    return g.encoder.jsonify(drafts)
+    return paged_response(g.encoder, drafts, args, 'received_date')
 
 
 @app.route('/drafts/<public_id>', methods=['GET'])
@@ -1328,7 +1419,12 @@ def sync_deltas():
                 filter(Transaction.public_id == cursor,
                        Transaction.namespace_id == g.namespace.id).one()
         except NoResultFound:
-            raise InputError('Invalid cursor parameter')
+            start_pointer = compacted_cursor(g.db_session, g.namespace.id,
+                                             cursor)
+            if start_pointer is None:
+                if log_trimmed(g.db_session, g.namespace, cursor):
+                    raise CursorExpiredError(cursor)
+                raise InputError('Invalid cursor parameter')
 
     # The client wants us to wait until there are changes
     g.db_session.close()  # hack to close the flask session
@@ -1435,9 +1531,15 @@ def stream_changes():
         query_result = g.db_session.query(Transaction.id).filter(
             Transaction.namespace_id == g.namespace.id,
             Transaction.public_id == cursor).first()
-        if query_result is None:
+        if query_result is not None:
+            transaction_pointer = query_result[0]
+        else:
+            transaction_pointer = compacted_cursor(g.db_session,
+                                                   g.namespace.id, cursor)
+        if transaction_pointer is None:
+            if log_trimmed(g.db_session, g.namespace, cursor):
+                raise CursorExpiredError(cursor)
             raise InputError('Invalid cursor {}'.format(args['cursor']))
-        transaction_pointer = query_result[0]
 
     # Hack to not keep a database session open for the entire (long) request
     # duration.
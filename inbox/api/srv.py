@@ -6,9 +6,10 @@ from sqlalchemy.orm.exc import NoResultFound
 from inbox.api.kellogs import APIEncoder
 from nylas.logging import get_logger
 from inbox.models import Namespace, Account
-from inbox.models.session import session_scope
+from inbox.models.session import new_session, session_scope
+from inbox.api.namespace_cache import namespace_cache
 from inbox.api.validation import (bounded_str, ValidatableArgument,
-                                  strict_parse_args, limit)
+                                  strict_parse_args, limit, strict_bool)
 from inbox.api.validation import valid_public_id
 from inbox.api.err import err
 
@@ -41,6 +42,25 @@ for code in default_exceptions.iterkeys():
     app.error_handler_spec[None][code] = default_json_error
 
 
+def _resolve_namespace(namespace_public_id):
+    """
+    Check that the namespace exists, consulting the namespace cache first.
+    On a cache miss, the namespace is loaded using the request's session and
+    stored in g.namespace so that it isn't queried again.
+
+    """
+    if namespace_cache.get(namespace_public_id) is not None:
+        return True
+    g.db_session = new_session(engine)
+    try:
+        g.namespace = Namespace.from_public_id(namespace_public_id,
+                                               g.db_session)
+    except NoResultFound:
+        return False
+    namespace_cache.set_namespace(g.namespace)
+    return True
+
+
 @app.before_request
 def auth():
     """ Check for account ID on all non-root URLS """
@@ -53,13 +73,9 @@ def auth():
         namespace_public_id = ns_parts[1]
         valid_public_id(namespace_public_id)
 
-        with session_scope() as db_session:
-            try:
-                namespace = db_session.query(Namespace) \
-                    .filter(Namespace.public_id == namespace_public_id).one()
-                g.namespace_public_id = namespace.public_id
-            except NoResultFound:
-                return err(404, "Unknown namespace ID")
+        if not _resolve_namespace(namespace_public_id):
+            return err(404, "Unknown namespace ID")
+        g.namespace_public_id = namespace_public_id
 
     else:
         if not request.authorization or not request.authorization.username:
@@ -70,16 +86,20 @@ def auth():
 
         g.namespace_public_id = request.authorization.username
 
-        with session_scope() as db_session:
-            try:
-                valid_public_id(g.namespace_public_id)
-                namespace = db_session.query(Namespace) \
-                    .filter(Namespace.public_id == g.namespace_public_id).one()
-            except NoResultFound:
-                return make_response((
-                    "Could not verify access credential.", 401,
-                    {'WWW-Authenticate': 'Basic realm="API '
-                     'Access Token Required"'}))
+        valid_public_id(g.namespace_public_id)
+        if not _resolve_namespace(g.namespace_public_id):
+            return make_response((
+                "Could not verify access credential.", 401,
+                {'WWW-Authenticate': 'Basic realm="API '
+                 'Access Token Required"'}))
+
+
+@app.teardown_request
+def close_session(exception=None):
+    # The session may have been opened by auth() for a request that isn't
+    # handled by the namespace API blueprint.
+    if hasattr(g, 'db_session'):
+        g.db_session.close()
 
 
 @app.after_request
@@ -107,6 +127,7 @@ def ns_all():
                             location='args')
         parser.add_argument('offset', default=0, type=int, location='args')
         parser.add_argument('email_address', type=bounded_str, location='args')
+        parser.add_argument('pretty', type=strict_bool, location='args')
         args = strict_parse_args(parser, request.args)
 
         query = db_session.query(Namespace)
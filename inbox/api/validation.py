@@ -1,4 +1,7 @@
 """Utilities for validating user input to the API."""
+import base64
+from datetime import datetime
+
 import arrow
 from arrow.parser import ParserError
 from flanker.addresslib import address
@@ -83,6 +86,29 @@ def timestamp(value, key):
         raise ValueError('Invalid datetime value {} for {}'.format(value, key))
 
 
+PAGE_CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_page_cursor(sort_value, id_):
+    """
+    Return an opaque cursor for keyset pagination, pointing just past the
+    row with the given sort key (a datetime) and id.
+
+    """
+    return base64.urlsafe_b64encode('{}:{}'.format(
+        sort_value.strftime(PAGE_CURSOR_DATE_FORMAT), id_))
+
+
+def page_cursor(value, key):
+    """ Decode a cursor made by `encode_page_cursor` into (datetime, id). """
+    try:
+        sort_value, id_ = base64.urlsafe_b64decode(str(value)).split(':')
+        return (datetime.strptime(sort_value, PAGE_CURSOR_DATE_FORMAT),
+                int(id_))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid value {} for {}'.format(value, key))
+
+
 def strict_parse_args(parser, raw_args):
     """
     Wrapper around parser.parse_args that raises a ValueError if unexpected
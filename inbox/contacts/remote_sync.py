@@ -1,15 +1,15 @@
 from datetime import datetime
 from collections import Counter
 
-from sqlalchemy.orm.exc import NoResultFound
-
 from nylas.logging import get_logger
 logger = get_logger()
+from inbox.config import config
 from inbox.models import Contact, Account
 from inbox.sync.base_sync import BaseSyncMonitor
 from inbox.contacts.google import GoogleContactsProvider
 from inbox.contacts.icloud import ICloudContactsProvider
 from inbox.util.debug import bind_context
+from inbox.util.itert import chunk
 from inbox.models.session import session_scope
 from inbox.basicauth import ValidationError
 
@@ -19,6 +19,8 @@ CONTACT_SYNC_PROVIDER_MAP = {'gmail': GoogleContactsProvider,
 
 CONTACT_SYNC_FOLDER_ID = -1
 CONTACT_SYNC_FOLDER_NAME = 'Contacts'
+# Number of contacts loaded and committed at a time.
+CONTACT_SYNC_PAGE_SIZE = config.get('CONTACT_SYNC_PAGE_SIZE', 1000)
 
 
 class ContactSync(BaseSyncMonitor):
@@ -72,41 +74,52 @@ class ContactSync(BaseSyncMonitor):
             account = db_session.query(Account).get(self.account_id)
             last_sync_dt = account.last_synced_contacts
 
-            all_contacts = self.provider.get_items(sync_from_dt=last_sync_dt)
-
-            # Do a batch insertion of every 100 contact objects
-            change_counter = Counter()
-            for new_contact in all_contacts:
-                new_contact.namespace = account.namespace
-                assert new_contact.uid is not None, \
-                    'Got remote item with null uid'
-                assert isinstance(new_contact.uid, basestring)
-
-                try:
-                    existing_contact = db_session.query(Contact).filter(
-                        Contact.namespace == account.namespace,
+        all_contacts = self.provider.get_items(sync_from_dt=last_sync_dt)
+
+        # Load the existing contacts of each page with one query, and commit
+        # each page on its own.
+        change_counter = Counter()
+        for page in chunk(all_contacts, CONTACT_SYNC_PAGE_SIZE):
+            with session_scope() as db_session:
+                account = db_session.query(Account).get(self.account_id)
+                uids = set()
+                for new_contact in page:
+                    assert new_contact.uid is not None, \
+                        'Got remote item with null uid'
+                    assert isinstance(new_contact.uid, basestring)
+                    uids.add(new_contact.uid)
+
+                existing_contacts = {
+                    c.uid: c for c in db_session.query(Contact).filter(
+                        Contact.namespace_id == self.namespace_id,
                         Contact.provider_name == self.provider.PROVIDER_NAME,
-                        Contact.uid == new_contact.uid).one()
-
-                    # If the remote item was deleted, purge the corresponding
-                    # database entries.
-                    if new_contact.deleted:
-                        db_session.delete(existing_contact)
-                        change_counter['deleted'] += 1
+                        Contact.uid.in_(uids))}
+
+                for new_contact in page:
+                    new_contact.namespace = account.namespace
+                    existing_contact = existing_contacts.get(new_contact.uid)
+                    if existing_contact is not None:
+                        # If the remote item was deleted, purge the
+                        # corresponding database entries.
+                        if new_contact.deleted:
+                            if existing_contact in db_session.new:
+                                # Added earlier in this page; it can only be
+                                # deleted once it's been inserted.
+                                db_session.flush()
+                            db_session.delete(existing_contact)
+                            del existing_contacts[new_contact.uid]
+                            change_counter['deleted'] += 1
+                        else:
+                            # Update fields in our old item with the new.
+                            # Don't save the newly returned item to the
+                            # database.
+                            existing_contact.merge_from(new_contact)
+                            change_counter['updated'] += 1
                     else:
-                        # Update fields in our old item with the new.
-                        # Don't save the newly returned item to the database.
-                        existing_contact.merge_from(new_contact)
-                        change_counter['updated'] += 1
-
-                except NoResultFound:
-                    # We didn't know about this before! Add this item.
-                    db_session.add(new_contact)
-                    change_counter['added'] += 1
-
-                # Flush every 100 objects for perf
-                if sum(change_counter.values()) % 100:
-                    db_session.flush()
+                        # We didn't know about this before! Add this item.
+                        db_session.add(new_contact)
+                        existing_contacts[new_contact.uid] = new_contact
+                        change_counter['added'] += 1
 
         # Update last sync
         with session_scope() as db_session:
@@ -64,11 +64,13 @@ class FolderMissingError(Exception):
     pass
 
 
-def _get_connection_pool(account_id, pool_size, pool_map, readonly):
+def _get_connection_pool(account_id, pool_size, pool_map, readonly,
+                         update_sync_state=True):
     with _lock_map[account_id]:
         if account_id not in pool_map:
             pool_map[account_id] = CrispinConnectionPool(
-                account_id, num_connections=pool_size, readonly=readonly)
+                account_id, num_connections=pool_size, readonly=readonly,
+                update_sync_state=update_sync_state)
         return pool_map[account_id]
 
 
@@ -101,6 +103,17 @@ def writable_connection_pool(account_id, pool_size=1, pool_map=dict()):
     return _get_connection_pool(account_id, pool_size, pool_map, False)
 
 
+def search_connection_pool(account_id, pool_size=3, pool_map=dict()):
+    """ Per-account crispin connection pool for API searches.
+
+    Unlike the pool of `connection_pool`, connecting doesn't mark the
+    account as running, since accounts can be searched whether or not
+    they're syncing.
+    """
+    return _get_connection_pool(account_id, pool_size, pool_map, True,
+                                update_sync_state=False)
+
+
 class CrispinConnectionPool(object):
     """
     Connection pool for Crispin clients.
@@ -115,12 +128,16 @@ class CrispinConnectionPool(object):
         How many connections in the pool.
     readonly : bool
         Is the connection to the IMAP server read-only?
+    update_sync_state : bool
+        Whether to mark the account as running once a connection succeeds.
     """
-    def __init__(self, account_id, num_connections, readonly):
+    def __init__(self, account_id, num_connections, readonly,
+                 update_sync_state=True):
         log.info('Creating Crispin connection pool for account {} with {} '
                  'connections'.format(account_id, num_connections))
         self.account_id = account_id
         self.readonly = readonly
+        self.update_sync_state = update_sync_state
         self._queue = Queue(num_connections, items=num_connections * [None])
         self._sem = BoundedSemaphore(num_connections)
         self._set_account_info()
@@ -157,6 +174,18 @@ class CrispinConnectionPool(object):
                     log.error('Error on IMAP logout', exc_info=True)
                 client = None
             raise exc
+        except gevent.GreenletExit:
+            # The greenlet was killed, possibly with a command in flight
+            # whose response would be read by the connection's next user.
+            # Close the connection without logging out, which would read it.
+            log.info('Greenlet killed; discarding IMAP connection')
+            if client is not None:
+                try:
+                    client.conn.shutdown()
+                except:
+                    log.error('Error on IMAP shutdown', exc_info=True)
+                client = None
+            raise
         except:
             raise
         finally:
@@ -184,7 +213,7 @@ class CrispinConnectionPool(object):
             conn = self.auth_handler.connect_account(account)
             # If we can connect the account, then we can set the state
             # to 'running' if it wasn't already
-            if self.sync_state != 'running':
+            if self.update_sync_state and self.sync_state != 'running':
                 self.sync_state = account.sync_state = 'running'
         return self.client_cls(self.account_id, self.provider_info,
                                self.email_address, conn,
@@ -6,6 +6,7 @@ import urllib
 import gevent
 import requests
 import uuid
+from requests.adapters import HTTPAdapter
 
 from inbox.basicauth import AccessNotEnabledError
 from inbox.config import config
@@ -19,7 +20,9 @@ from inbox.events.util import (google_to_event_time, parse_google_time,
 
 
 log = get_logger()
-CALENDARS_URL = 'https://www.googleapis.com/calendar/v3/users/me/calendarList'
+API_URL = config.get('GOOGLE_CALENDAR_API_URL',
+                     'https://www.googleapis.com/calendar/v3')
+CALENDARS_URL = API_URL + '/users/me/calendarList'
 STATUS_MAP = {'accepted': 'yes', 'needsAction': 'noreply',
               'declined': 'no', 'tentative': 'maybe'}
 
@@ -31,8 +34,37 @@ CALENDAR_LIST_WEBHOOK_URL = URL_PREFIX + '/w/calendar_list_update/{}'
 EVENTS_LIST_WEHOOK_URL = URL_PREFIX + '/w/calendar_update/{}'
 
 WATCH_CALENDARS_URL = CALENDARS_URL + '/watch'
-WATCH_EVENTS_URL = \
-    'https://www.googleapis.com/calendar/v3/calendars/{}/events/watch'
+WATCH_EVENTS_URL = API_URL + '/calendars/{}/events/watch'
+EVENTS_URL = API_URL + '/calendars/{}/events'
+
+# Maximum number of connections to the calendar API kept open per account.
+DEFAULT_CONNECTIONS_PER_ACCOUNT = 4
+USER_AGENT = 'Nylas Sync Engine (gzip)'
+
+_sessions = {}
+
+
+def get_session(account_id):
+    """
+    Return the HTTP session used for the calendar API requests of an account.
+    Sessions keep connections alive between requests, so that fetching
+    further pages or calendars doesn't pay for TCP and TLS setup again, and
+    ask for gzipped responses (Google only compresses them if the user agent
+    contains "gzip").
+
+    """
+    session = _sessions.get(account_id)
+    if session is None:
+        size = config.get('GOOGLE_API_CONNECTIONS_PER_ACCOUNT',
+                          DEFAULT_CONNECTIONS_PER_ACCOUNT)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip',
+                                'User-Agent': USER_AGENT})
+        _sessions[account_id] = session
+    return session
 
 
 class GoogleEventsProvider(object):
@@ -45,6 +77,7 @@ class GoogleEventsProvider(object):
         self.account_id = account_id
         self.namespace_id = namespace_id
         self.log = log.new(account_id=account_id)
+        self.session = get_session(account_id)
 
         # A hash to store whether a calendar is read-only or not.
         # This is a bit of a hack because this isn't exposed at the event level
@@ -120,8 +153,7 @@ class GoogleEventsProvider(object):
             # Note explicit offset is required by Google calendar API.
             sync_from_time = datetime.datetime.isoformat(sync_from_time) + 'Z'
 
-        url = 'https://www.googleapis.com/calendar/v3/' \
-              'calendars/{}/events'.format(urllib.quote(calendar_uid))
+        url = EVENTS_URL.format(urllib.quote(calendar_uid))
         try:
             return self._get_resource_list(url, updatedMin=sync_from_time)
         except requests.exceptions.HTTPError as exc:
@@ -150,7 +182,7 @@ class GoogleEventsProvider(object):
         while True:
             if next_page_token is not None:
                 params['pageToken'] = next_page_token
-            r = requests.get(url, params=params, auth=OAuth(token))
+            r = self.session.get(url, params=params, auth=OAuth(token))
             if r.status_code == 200:
                 data = r.json()
                 items += data['items']
@@ -192,11 +224,11 @@ class GoogleEventsProvider(object):
                             **kwargs):
         """ Makes a POST/PUT/DELETE request for a particular event. """
         event_uid = event_uid or ''
-        url = 'https://www.googleapis.com/calendar/v3/' \
-              'calendars/{}/events/{}'.format(urllib.quote(calendar_uid),
-                                              urllib.quote(event_uid))
+        url = (EVENTS_URL + '/{}').format(urllib.quote(calendar_uid),
+                                          urllib.quote(event_uid))
         token = self._get_access_token()
-        response = requests.request(method, url, auth=OAuth(token), **kwargs)
+        response = self.session.request(method, url, auth=OAuth(token),
+                                        **kwargs)
         return response
 
     def create_remote_event(self, event, **kwargs):
@@ -290,10 +322,10 @@ class GoogleEventsProvider(object):
         headers = {
             'content-type': 'application/json'
         }
-        r = requests.post(WATCH_CALENDARS_URL,
-                          data=json.dumps(data),
-                          headers=headers,
-                          auth=OAuth(token))
+        r = self.session.post(WATCH_CALENDARS_URL,
+                              data=json.dumps(data),
+                              headers=headers,
+                              auth=OAuth(token))
 
         if r.status_code == 200:
             data = r.json()
@@ -329,10 +361,10 @@ class GoogleEventsProvider(object):
         headers = {
             'content-type': 'application/json'
         }
-        r = requests.post(watch_url,
-                          data=json.dumps(data),
-                          headers=headers,
-                          auth=OAuth(token))
+        r = self.session.post(watch_url,
+                              data=json.dumps(data),
+                              headers=headers,
+                              auth=OAuth(token))
 
         if r.status_code == 200:
             data = r.json()
@@ -0,0 +1,241 @@
+"""
+Materialised start times of recurring events.
+
+Expanding the RRULE of every matching recurring event is the bulk of the
+work of an `/events?expand_recurring=true` request. When
+`EVENT_OCCURRENCE_TABLE` is set, the start and end times of all instances of
+recurring events within a rolling window are instead stored as
+`EventOccurrence` rows, and requests whose time range falls within the
+window read them with a range scan on (event_id, start).
+
+* `EventOccurrenceService` rebuilds the rows of all recurring events once a
+  day, drops the ones that have fallen out of the window and records the
+  window it covers in `EventOccurrenceWindow`.
+* In between, the rows of recurring events that are created or whose
+  recurrence changes are rewritten when the session is flushed (see
+  `track_occurrence_changes`). Rows of deleted events go away with them, by
+  the foreign key's ON DELETE CASCADE.
+
+Overrides aren't materialised: they're filtered against the occurrences at
+read time the same way they are against expanded start times, so changing an
+override doesn't require any rows to be rewritten. Requests that reach beyond
+the stored window fall back to expanding the RRULE.
+
+"""
+from datetime import datetime, timedelta
+
+import arrow
+import gevent
+from gevent import Greenlet
+from sqlalchemy.orm import attributes
+
+from nylas.logging import get_logger
+log = get_logger()
+from inbox.config import config
+from inbox.events.recurring import EXPAND_RECURRING_YEARS, get_start_times
+from inbox.models.event import (RecurringEvent, EventOccurrence,
+                                 EventOccurrenceWindow)
+from inbox.models.session import session_scope
+from inbox.util.stats import statsd_client
+
+DEFAULT_PAST_DAYS = 30
+# Materialise a little further ahead than requests expand by default, so
+# that they're still covered by the window until the next rebuild.
+WINDOW_MARGIN = timedelta(days=7)
+
+PENDING_OCCURRENCES_KEY = 'pending_occurrences'
+RECURRENCE_FIELDS = ('rrule', 'exdate', 'start', 'end', 'all_day',
+                     'start_timezone')
+
+
+def enabled():
+    return bool(config.get('EVENT_OCCURRENCE_TABLE', False))
+
+
+def current_window(current_time=None):
+    """ Return the (start, end) datetimes that should be materialised. """
+    current_time = current_time or datetime.utcnow()
+    past_days = config.get('EVENT_OCCURRENCE_PAST_DAYS', DEFAULT_PAST_DAYS)
+    return (arrow.get(current_time - timedelta(days=past_days)),
+            arrow.get(current_time).replace(years=+EXPAND_RECURRING_YEARS) +
+            WINDOW_MARGIN)
+
+
+def materialised_window(db_session):
+    """
+    Return the (start, end) of the window for which occurrences are
+    materialised, or None if they aren't.
+
+    """
+    if not enabled():
+        return None
+    window = db_session.query(EventOccurrenceWindow).first()
+    if window is None:
+        return None
+    return window.start, window.end
+
+
+def write_occurrences(db_session, events, window):
+    """
+    Replace the occurrences of the given recurring events with their start
+    times within window. Returns the number of rows written.
+
+    """
+    if not events:
+        return 0
+    table = EventOccurrence.__table__
+    db_session.execute(table.delete().where(
+        table.c.event_id.in_([e.id for e in events])))
+    rows = []
+    for event in events:
+        length = event.length
+        for start in get_start_times(event, *window):
+            rows.append({'event_id': event.id, 'start': start,
+                         'end': start + length})
+    if rows:
+        db_session.execute(table.insert(), rows)
+    statsd_client.incr('events.occurrences.written', len(rows))
+    return len(rows)
+
+
+def track_occurrence_changes(session):
+    """
+    Note recurring events whose occurrences need to be rewritten. Must be
+    called from the pre-flush hook.
+
+    """
+    if not enabled():
+        return
+    pending = session.info.setdefault(PENDING_OCCURRENCES_KEY, {})
+    for obj in session.new:
+        if isinstance(obj, RecurringEvent):
+            pending[id(obj)] = obj
+    for obj in session.dirty:
+        if isinstance(obj, RecurringEvent) and \
+                any(attributes.get_history(obj, field).has_changes()
+                    for field in RECURRENCE_FIELDS):
+            pending[id(obj)] = obj
+
+
+def update_occurrences(session):
+    """
+    Rewrite the occurrences of the recurring events noted by
+    `track_occurrence_changes`. Must be called from the post-flush hook, so
+    that new events have ids.
+
+    """
+    pending = session.info.pop(PENDING_OCCURRENCES_KEY, {})
+    events = [obj for obj in pending.itervalues()
+              if obj.id is not None and obj in session]
+    if not events:
+        return
+    window = current_window()
+    stored = session.query(EventOccurrenceWindow).first()
+    if stored is not None:
+        # Cover all of the stored window, which may start earlier.
+        window = (min(window[0], stored.start), max(window[1], stored.end))
+    write_occurrences(session, events, window)
+
+
+def materialised_start_times(db_session, ranges, window):
+    """
+    Look up the start times of recurring events from their materialised
+    occurrences.
+
+    Parameters
+    ----------
+    ranges: list
+        (event, start, end) tuples, where start and end may be None to use
+        the defaults of `inbox.events.recurring.get_start_times`.
+    window: tuple
+        The materialised window, from `materialised_window`.
+
+    Returns a dict mapping the ids of the events whose range is covered by
+    the window to a list of their start times in order. Events that aren't
+    covered have to be expanded.
+
+    """
+    default_end = arrow.utcnow().replace(years=+EXPAND_RECURRING_YEARS)
+    covered = {}
+    for event, start, end in ranges:
+        start = arrow.get(start) if start else event.start
+        end = arrow.get(end) if end else default_end
+        if window[0] <= start and end <= window[1]:
+            covered[event.id] = (start, end)
+    if not covered:
+        return {}
+
+    start_times = {event_id: [] for event_id in covered}
+    rows = db_session.query(EventOccurrence.event_id, EventOccurrence.start). \
+        filter(EventOccurrence.event_id.in_(covered.keys()),
+               EventOccurrence.start >= min(s for s, _ in covered.values()),
+               EventOccurrence.start <= max(e for _, e in covered.values())). \
+        order_by(EventOccurrence.event_id, EventOccurrence.start)
+    for event_id, start in rows:
+        lower, upper = covered[event_id]
+        if lower <= start <= upper:
+            start_times[event_id].append(start)
+    statsd_client.incr('events.occurrences.materialised', len(covered))
+    return start_times
+
+
+class EventOccurrenceService(Greenlet):
+    """
+    Periodically rebuild the occurrences of all recurring events.
+
+    Parameters
+    ----------
+    batch_size: int
+        Number of recurring events rebuilt per database transaction.
+    poll_interval: float
+        Seconds to sleep between runs.
+
+    """
+    def __init__(self, batch_size=100, poll_interval=24 * 3600):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.log = log.new(component='event-occurrences')
+        Greenlet.__init__(self)
+
+    def _run(self):
+        self.log.info('Starting event occurrence service')
+        while True:
+            self.run_once()
+            gevent.sleep(self.poll_interval)
+
+    def run_once(self, current_time=None):
+        """
+        Rebuild all occurrences for the window around `current_time`.
+        Returns the number of rows written.
+
+        """
+        window = current_window(current_time)
+        written = 0
+        cursor = 0
+        while True:
+            with session_scope(versioned=False) as db_session:
+                events = db_session.query(RecurringEvent). \
+                    filter(RecurringEvent.id > cursor). \
+                    order_by(RecurringEvent.id). \
+                    limit(self.batch_size).all()
+                if not events:
+                    break
+                cursor = events[-1].id
+                written += write_occurrences(db_session, events, window)
+                db_session.commit()
+
+        with session_scope(versioned=False) as db_session:
+            table = EventOccurrence.__table__
+            expired = db_session.execute(table.delete().where(
+                table.c.start < window[0])).rowcount
+            stored = db_session.query(EventOccurrenceWindow).first()
+            if stored is None:
+                stored = EventOccurrenceWindow()
+                db_session.add(stored)
+            stored.start, stored.end = window
+            db_session.commit()
+
+        self.log.info('Rebuilt event occurrences', written=written,
+                      expired=expired, window_start=window[0].isoformat(),
+                      window_end=window[1].isoformat())
+        return written
@@ -1,9 +1,14 @@
+import heapq
+from bisect import bisect_left
+
 import arrow
 from dateutil.rrule import (rrulestr, rrule, rruleset,
                             MO, TU, WE, TH, FR, SA, SU)
 
+from inbox.config import config
 from inbox.models.event import RecurringEvent, RecurringEventOverride
 from inbox.events.util import parse_rrule_datetime
+from inbox.util.lru import LRUCache
 
 from nylas.logging import get_logger
 log = get_logger()
@@ -11,6 +16,14 @@ log = get_logger()
 # How far in the future to expand recurring events
 EXPAND_RECURRING_YEARS = 1
 
+DEFAULT_RRULE_CACHE_SIZE = 1000
+# Bound on the start times kept by all cached expansions together.
+DEFAULT_RRULE_CACHE_START_TIMES = 100000
+# Bounds on the start times kept by each cached expansion. Start times past
+# them are expanded again whenever they're needed.
+CACHED_EXPANSION_MONTHS = 12 * EXPAND_RECURRING_YEARS + 1
+MAX_CACHED_START_TIMES = 1000
+
 
 def link_events(db_session, event):
     if isinstance(event, RecurringEvent):
@@ -83,13 +96,148 @@ def parse_exdate(event):
     return excl_dates
 
 
-def get_start_times(event, start=None, end=None):
-    # Expands the rrule on event to return a list of arrow datetimes
-    # representing start times for its recurring instances.
-    # If start and/or end are supplied, will return times within that range,
-    # otherwise defaults to the event start date and now + 1 year;
-    # this can return a lot of instances if the event recurs more frequently
-    # than weekly!
+class Expansion(object):
+    """
+    The start times of a recurrence rule, expanded lazily and kept as they
+    are. Iterating yields (datetime as generated by the rule, UTC arrow
+    time) pairs in order.
+
+    Only the start times up to `horizon` (and at most
+    `MAX_CACHED_START_TIMES` of them) are kept. Iterations that go past
+    them expand the rule again without keeping what they find.
+
+    """
+    def __init__(self, rrules, horizon):
+        self._rrules = rrules
+        self._generator = iter(rrules)
+        self._horizon = horizon
+        self._times = []
+        self._complete = False
+        self._capped = False
+
+    @property
+    def cached_count(self):
+        """ Number of start times kept. """
+        return len(self._times)
+
+    def iter_from(self, start):
+        # Skips start times before `start` that were already expanded, but
+        # not necessarily all of them.
+        i = bisect_left(self._times, (start,))
+        while True:
+            if i < len(self._times):
+                yield self._times[i]
+                i += 1
+            elif self._complete:
+                return
+            elif self._capped:
+                for item in self._iter_uncached():
+                    yield item
+                return
+            else:
+                try:
+                    t = next(self._generator)
+                except StopIteration:
+                    self._complete = True
+                    return
+                # Convert back to UTC, which covers daylight savings
+                # differences
+                item = (t, arrow.get(t).to('utc'))
+                if item[1] > self._horizon or \
+                        len(self._times) >= MAX_CACHED_START_TIMES:
+                    self._capped = True
+                    self._generator = None
+                else:
+                    self._times.append(item)
+
+    def _iter_uncached(self):
+        last = self._times[-1][0] if self._times else None
+        for t in self._rrules:
+            if last is None or t > last:
+                yield t, arrow.get(t).to('utc')
+
+
+_MISSING = object()
+
+
+class RRuleCache(object):
+    """
+    Bounded LRU cache of the expansions of the recurrence rules of events,
+    with their exception dates applied.
+
+    Entries are keyed by event id and the fields the rules depend on, so a
+    changed event gets a new entry. Start times are expanded as far as any
+    request has needed them, so expanding the same event again mostly walks
+    a list. Least recently used entries are evicted once there are more than
+    `max_entries`, or once they keep more than `max_start_times` start times
+    together (counted as of the last lookup, since expansions grow as they
+    are iterated).
+
+    """
+    def __init__(self, max_entries=DEFAULT_RRULE_CACHE_SIZE,
+                 max_start_times=DEFAULT_RRULE_CACHE_START_TIMES):
+        self.max_start_times = max_start_times
+        self._entries = LRUCache(max_entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, event):
+        """ Return the Expansion of event, or None if it has no valid rule.
+        """
+        if event.id is None:
+            return _expand(event)
+        key = (event.id, event.rrule, event.exdate, event.start.datetime,
+               event.all_day, event.start_timezone)
+        expansion = self._entries.get(key, _MISSING)
+        if expansion is _MISSING:
+            expansion = _expand(event)
+            self._entries.set(key, expansion)
+        start_times = self.start_times()
+        while start_times > self.max_start_times and len(self._entries) > 1:
+            evicted = self._entries.evict()
+            if evicted is not None:
+                start_times -= evicted.cached_count
+        return expansion
+
+    def start_times(self):
+        """ Number of start times kept by all entries. """
+        return sum(expansion.cached_count
+                   for expansion in self._entries.values()
+                   if expansion is not None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+rrule_cache = RRuleCache(
+    int(config.get('RRULE_CACHE_SIZE', DEFAULT_RRULE_CACHE_SIZE)),
+    int(config.get('RRULE_CACHE_START_TIMES',
+                   DEFAULT_RRULE_CACHE_START_TIMES)))
+
+
+def _expand(event):
+    rrules = parse_rrule(event)
+    if not rrules:
+        return None
+
+    excl_dates = parse_exdate(event)
+
+    if len(excl_dates) > 0:
+        if not isinstance(rrules, rruleset):
+            rrules = rruleset().rrule(rrules)
+
+        # We want naive-everything for all-day events.
+        if event.all_day:
+            excl_dates = map(lambda x: x.naive, excl_dates)
+        map(rrules.exdate, excl_dates)
+    return Expansion(rrules, arrow.utcnow().replace(
+        months=+CACHED_EXPANSION_MONTHS))
+
+
+def iter_start_times(event, start=None, end=None):
+    # Like get_start_times, but lazily yields the start times in order, so
+    # that callers that only need the first few don't expand the rest.
 
     if isinstance(event, RecurringEvent):
         # Localize first so that expansion covers DST
@@ -105,22 +253,12 @@ def get_start_times(event, start=None, end=None):
         else:
             end = arrow.get(end)
 
-        rrules = parse_rrule(event)
-        if not rrules:
+        expansion = rrule_cache.get(event)
+        if expansion is None:
             log.warn('Tried to expand a non-recurring event',
                      event_id=event.id)
-            return [event.start]
-
-        excl_dates = parse_exdate(event)
-
-        if len(excl_dates) > 0:
-            if not isinstance(rrules, rruleset):
-                rrules = rruleset().rrule(rrules)
-
-            # We want naive-everything for all-day events.
-            if event.all_day:
-                excl_dates = map(lambda x: x.naive, excl_dates)
-            map(rrules.exdate, excl_dates)
+            yield event.start
+            return
 
         # Return all start times between start and end, including start and
         # end themselves if they obey the rule.
@@ -129,15 +267,45 @@ def get_start_times(event, start=None, end=None):
             # when UNTIL takes the form YYYYMMDD
             start = start.to('utc').naive
             end = end.to('utc').naive
+        else:
+            start = start.datetime
+            end = end.datetime
+
+        for t, start_time in expansion.iter_from(start):
+            if t > end:
+                return
+            if t >= start:
+                yield start_time
+        return
+
+    yield event.start
+
+
+def get_start_times(event, start=None, end=None):
+    # Expands the rrule on event to return a list of arrow datetimes
+    # representing start times for its recurring instances.
+    # If start and/or end are supplied, will return times within that range,
+    # otherwise defaults to the event start date and now + 1 year;
+    # this can return a lot of instances if the event recurs more frequently
+    # than weekly!
+    return list(iter_start_times(event, start, end))
 
-        start_times = rrules.between(start, end, inc=True)
 
-        # Convert back to UTC, which covers daylight savings differences
-        start_times = [arrow.get(t).to('utc') for t in start_times]
+def merge_events(streams):
+    """
+    Merge iterables of events that are each ordered by start time into one
+    iterator ordered by start time. Events with the same start time keep the
+    order of the iterables they came from. Only consumes the iterables as far
+    as needed.
 
-        return start_times
+    """
+    def keyed(i, events):
+        for j, event in enumerate(events):
+            yield event.start, i, j, event
 
-    return [event.start]
+    for _, _, _, event in heapq.merge(*[keyed(i, events) for i, events in
+                                        enumerate(streams)]):
+        yield event
 
 
 # rrule constant values
@@ -1,6 +1,6 @@
 from datetime import datetime, timedelta
+from gevent.pool import Pool
 from requests.exceptions import HTTPError
-from sqlalchemy import func
 
 from nylas.logging import get_logger
 logger = get_logger()
@@ -11,6 +11,7 @@ from inbox.sync.base_sync import BaseSyncMonitor
 from inbox.models import Event, Calendar
 from inbox.models.event import RecurringEvent, RecurringEventOverride
 from inbox.util.debug import bind_context
+from inbox.util.itert import chunk
 from inbox.models.session import session_scope
 
 from inbox.models.account import Account
@@ -22,15 +23,22 @@ from inbox.events.google import GoogleEventsProvider
 EVENT_SYNC_FOLDER_ID = -2
 EVENT_SYNC_FOLDER_NAME = 'Events'
 POLL_FREQUENCY = config.get('CALENDAR_POLL_FREQUENCY', 300)
+# Number of calendars of an account whose events are fetched at a time.
+FETCH_CONCURRENCY = config.get('CALENDAR_FETCH_CONCURRENCY', 4)
 
 MAX_TIME_WITHOUT_SYNC = timedelta(seconds=3600)
 
+# Number of events loaded and committed at a time.
+EVENT_SYNC_PAGE_SIZE = config.get('EVENT_SYNC_PAGE_SIZE', 1000)
+
 
 class EventSync(BaseSyncMonitor):
     """Per-account event sync engine."""
     def __init__(self, email_address, provider_name, account_id, namespace_id,
-                 poll_frequency=POLL_FREQUENCY):
+                 poll_frequency=POLL_FREQUENCY,
+                 fetch_concurrency=FETCH_CONCURRENCY):
         bind_context(self, 'eventsync', account_id)
+        self.fetch_concurrency = fetch_concurrency
         # Only Google for now, can easily parametrize by provider later.
         self.provider = GoogleEventsProvider(account_id, namespace_id)
 
@@ -65,17 +73,20 @@ class EventSync(BaseSyncMonitor):
                                                             db_session)
             db_session.commit()
 
-        for (uid, id_) in calendar_uids_and_ids:
-            # Get a timestamp before polling, so that we don't subsequently
-            # miss remote updates that happen while the poll loop is executing.
-            sync_timestamp = datetime.utcnow()
-            with session_scope() as db_session:
-                last_sync = db_session.query(Calendar.last_synced).filter(
-                    Calendar.id == id_).scalar()
-
-            event_changes = self.provider.sync_events(
-                uid, sync_from_time=last_sync)
-
+        calendar_ids = [id_ for _, id_ in calendar_uids_and_ids]
+        if not calendar_ids:
+            return
+        with session_scope() as db_session:
+            calendars = db_session.query(
+                Calendar.id, Calendar.uid, Calendar.last_synced).filter(
+                    Calendar.id.in_(calendar_ids)).all()
+
+        for id_, sync_timestamp, event_changes in \
+                self._fetch_events(calendars):
+            if event_changes is None:
+                self.log.warning('Tried to sync a deleted calendar.',
+                                 calendar_id=id_)
+                continue
             with session_scope() as db_session:
                 handle_event_updates(self.namespace_id, id_, event_changes,
                                      self.log, db_session)
@@ -83,6 +94,44 @@ class EventSync(BaseSyncMonitor):
                 cal.last_synced = sync_timestamp
                 db_session.commit()
 
+    def _fetch_events(self, calendars):
+        """
+        Fetch the changed events of each calendar from the provider, fetching
+        up to `fetch_concurrency` calendars at a time.
+
+        Parameters
+        ----------
+        calendars: list
+            (id, uid, last_synced) tuples.
+
+        Yields
+        ------
+        (id, sync timestamp, events) tuples in the order fetches complete.
+        `events` is None if the calendar no longer exists remotely.
+
+        """
+        def fetch(calendar):
+            id_, uid, last_synced = calendar
+            # Get a timestamp before polling, so that we don't subsequently
+            # miss remote updates that happen while the poll loop is
+            # executing.
+            sync_timestamp = datetime.utcnow()
+            try:
+                event_changes = self.provider.sync_events(
+                    uid, sync_from_time=last_synced)
+            except HTTPError as exc:
+                if exc.response.status_code != 404:
+                    raise
+                event_changes = None
+            return id_, sync_timestamp, event_changes
+
+        pool = Pool(self.fetch_concurrency)
+        try:
+            for result in pool.imap_unordered(fetch, calendars):
+                yield result
+        finally:
+            pool.kill()
+
 
 def handle_calendar_deletes(namespace_id, deleted_calendar_uids, log,
                             db_session):
@@ -131,63 +180,73 @@ def handle_calendar_updates(namespace_id, calendars, log, db_session):
 
 
 def handle_event_updates(namespace_id, calendar_id, events, log, db_session):
-    """Persists new or updated Event objects to the database."""
+    """Persists new or updated Event objects to the database.
+
+    Events are processed in pages of `EVENT_SYNC_PAGE_SIZE`: the existing
+    events of each page are loaded with a single query, and each page is
+    committed on its own to avoid long transactions that may lock calendar
+    rows.
+    """
     added_count = 0
     updated_count = 0
-    existing_event_count = db_session.query(func.count(Event.id)).filter(
-        Event.namespace_id == namespace_id,
-        Event.calendar_id == calendar_id).scalar()
-    for event in events:
-        assert event.uid is not None, 'Got remote item with null uid'
-
-        local_event = None
-        if existing_event_count:
-            # Skip this lookup if there are no local events at all, for faster
-            # first sync.
-            local_event = db_session.query(Event).filter(
-                Event.namespace_id == namespace_id,
-                Event.calendar_id == calendar_id,
-                Event.uid == event.uid).first()
-
-        if local_event is not None:
-            # We also need to mark all overrides as cancelled if we're
-            # cancelling a recurring event. However, note the original event
-            # may not itself be recurring (recurrence may have been added).
-            if isinstance(local_event, RecurringEvent) and \
-                    event.status == 'cancelled' and \
-                    local_event.status != 'cancelled':
-                    for override in local_event.overrides:
-                        override.status = 'cancelled'
-
-            merged_participants = local_event.\
-                _partial_participants_merge(event)
-
-            local_event.update(event)
-
-            # We have to do this mumbo-jumbo because MutableList does
-            # not register changes to nested elements.
-            local_event.participants = []
-            for participant in merged_participants:
-                local_event.participants.append(participant)
-
-            updated_count += 1
-        else:
-            local_event = event
-            local_event.namespace_id = namespace_id
-            local_event.calendar_id = calendar_id
-            db_session.add(local_event)
-            added_count += 1
-
-        # If we just updated/added a recurring event or override, make sure
-        # we link it to the right master event.
-        if isinstance(event, RecurringEvent) or \
-                isinstance(event, RecurringEventOverride):
+    for page in chunk(events, EVENT_SYNC_PAGE_SIZE):
+        uids = set()
+        for event in page:
+            assert event.uid is not None, 'Got remote item with null uid'
+            uids.add(event.uid)
+
+        local_events = {e.uid: e for e in db_session.query(Event).filter(
+            Event.namespace_id == namespace_id,
+            Event.calendar_id == calendar_id,
+            Event.uid.in_(uids))}
+
+        linked = []
+        for event in page:
+            local_event = local_events.get(event.uid)
+            if local_event is not None:
+                # We also need to mark all overrides as cancelled if we're
+                # cancelling a recurring event. However, note the original
+                # event may not itself be recurring (recurrence may have been
+                # added).
+                if isinstance(local_event, RecurringEvent) and \
+                        event.status == 'cancelled' and \
+                        local_event.status != 'cancelled':
+                        for override in local_event.overrides:
+                            override.status = 'cancelled'
+
+                merged_participants = local_event.\
+                    _partial_participants_merge(event)
+
+                local_event.update(event)
+
+                # We have to do this mumbo-jumbo because MutableList does
+                # not register changes to nested elements.
+                local_event.participants = []
+                for participant in merged_participants:
+                    local_event.participants.append(participant)
+
+                updated_count += 1
+            else:
+                local_event = event
+                local_event.namespace_id = namespace_id
+                local_event.calendar_id = calendar_id
+                db_session.add(local_event)
+                # The same event may appear again later in the page.
+                local_events[event.uid] = local_event
+                added_count += 1
+
+            # If we just updated/added a recurring event or override, make
+            # sure we link it to the right master event.
+            if isinstance(event, RecurringEvent) or \
+                    isinstance(event, RecurringEventOverride):
+                linked.append(event)
+
+        if linked:
             db_session.flush()
-            link_events(db_session, event)
+            for event in linked:
+                link_events(db_session, event)
 
-        # Batch commits to avoid long transactions that may lock calendar rows.
-        if (added_count + updated_count) % 1000 == 0:
-            db_session.commit()
+        db_session.commit()
 
     log.info('synced added and updated events',
              calendar_id=calendar_id,
@@ -266,23 +325,29 @@ class GoogleEventSync(EventSync):
             if account.should_update_calendars(MAX_TIME_WITHOUT_SYNC):
                 self._sync_calendar_list(account, db_session)
 
-            stale_calendars = (
-                cal for cal in account.namespace.calendars
+            stale_calendars = {
+                cal.id: cal for cal in account.namespace.calendars
                 if cal.should_update_events(MAX_TIME_WITHOUT_SYNC)
-            )
-            for cal in stale_calendars:
-                try:
-                    self._sync_calendar(cal, db_session)
-                except HTTPError as exc:
-                    if exc.response.status_code == 404:
-                        self.log.warning(
-                            'Tried to sync a deleted calendar.'
-                            'Deleting local calendar.',
-                            calendar_id=cal.id,
-                            calendar_uid=cal.uid)
-                        db_session.delete(cal)
-                    else:
-                        raise exc
+            }
+            calendars = [(cal.id, cal.uid, cal.last_synced)
+                         for cal in stale_calendars.itervalues()]
+            for id_, sync_timestamp, event_changes in \
+                    self._fetch_events(calendars):
+                cal = stale_calendars[id_]
+                if event_changes is None:
+                    self.log.warning(
+                        'Tried to sync a deleted calendar.'
+                        'Deleting local calendar.',
+                        calendar_id=cal.id,
+                        calendar_uid=cal.uid)
+                    db_session.delete(cal)
+                    db_session.commit()
+                    continue
+
+                handle_event_updates(self.namespace_id, cal.id,
+                                     event_changes, self.log, db_session)
+                cal.last_synced = sync_timestamp
+                db_session.commit()
 
     def _sync_calendar_list(self, account, db_session):
         sync_timestamp = datetime.utcnow()
@@ -297,13 +362,3 @@ class GoogleEventSync(EventSync):
 
         account.last_calendar_list_sync = sync_timestamp
         db_session.commit()
-
-    def _sync_calendar(self, calendar, db_session):
-        sync_timestamp = datetime.utcnow()
-        event_changes = self.provider.sync_events(
-            calendar.uid, sync_from_time=calendar.last_synced)
-
-        handle_event_updates(self.namespace_id, calendar.id,
-                             event_changes, self.log, db_session)
-        calendar.last_synced = sync_timestamp
-        db_session.commit()
@@ -1,5 +1,5 @@
 from sqlalchemy import (Column, Integer, String, Boolean,
-                        Enum, ForeignKey, event)
+                        Enum, ForeignKey, Index, event)
 from sqlalchemy.orm import reconstructor, relationship, backref
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.sql.expression import false
@@ -8,6 +8,7 @@ from inbox.models.roles import Blob
 from inbox.models.mixins import HasPublicID, HasRevisions
 from inbox.models.base import MailSyncBase
 from inbox.models.message import Message
+from inbox.sqlalchemy_ext.util import safer_yield_per
 
 # These are the top 15 most common Content-Type headers
 # in my personal mail archive. --mg
@@ -67,6 +68,9 @@ class Block(Blob, MailSyncBase, HasRevisions, HasPublicID):
             self.content_type = self._content_type_other
 
 
+Index('ix_block_data_sha256', Block.data_sha256)
+
+
 @event.listens_for(Block, 'before_insert', propagate=True)
 def serialize_before_insert(mapper, connection, target):
     if target.content_type in COMMON_CONTENT_TYPES:
@@ -118,3 +122,25 @@ class Part(MailSyncBase):
     def is_embedded(self):
         return (self.content_disposition is not None and
                 self.content_disposition.lower() == 'inline')
+
+
+def referenced_blob_hashes(db_session, among=None, batch_size=10000):
+    """
+    Return the set of sha256 hashes of blob data that is still referenced,
+    either by a block or (as its raw MIME) by a message. If `among` (a list
+    of hashes) is given, only those hashes are looked up.
+
+    """
+    hashes = set()
+    for cls in (Block, Message):
+        if among is None:
+            query = db_session.query(cls.id, cls.data_sha256)
+            for row in safer_yield_per(query, cls.id, 0, batch_size):
+                if row.data_sha256:
+                    hashes.add(row.data_sha256)
+            continue
+        for i in range(0, len(among), batch_size):
+            query = db_session.query(cls.data_sha256).filter(
+                cls.data_sha256.in_(among[i:i + batch_size])).distinct()
+            hashes.update(data_sha256 for data_sha256, in query)
+    return hashes
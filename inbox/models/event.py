@@ -365,9 +365,9 @@ class RecurringEvent(Event):
     def inflate(self, start=None, end=None):
         # Convert a RecurringEvent into a series of InflatedEvents
         # by expanding its RRULE into a series of start times.
-        from inbox.events.recurring import get_start_times
-        occurrences = get_start_times(self, start, end)
-        return [InflatedEvent(self, o) for o in occurrences]
+        from inbox.events.recurring import iter_start_times
+        return [InflatedEvent(self, o) for o in
+                iter_start_times(self, start, end)]
 
     def unwrap_rrule(self):
         # Unwraps the RRULE list of strings into RecurringEvent properties.
@@ -381,26 +381,44 @@ class RecurringEvent(Event):
             elif item.startswith('EXDATE'):
                 self.exdate = item
 
-    def all_events(self, start=None, end=None):
+    def all_events(self, start=None, end=None, overrides=None):
         # Returns all inflated events along with overrides that match the
         # provided time range.
-        overrides = self.overrides
-        if start:
-            overrides = overrides.filter(RecurringEventOverride.start > start)
-        if end:
-            overrides = overrides.filter(RecurringEventOverride.end < end)
-        events = list(overrides)
-        overridden_starts = [e.original_start_time for e in events]
+        return list(self.iter_events(start, end, overrides))
+
+    def iter_events(self, start=None, end=None, overrides=None,
+                    start_times=None):
+        # Like all_events, but only inflates events as they are consumed.
+        # `overrides` can be passed to avoid querying them for every event;
+        # it is then filtered by time range here. `start_times` can be
+        # passed to use materialised occurrences instead of expanding the
+        # RRULE (see inbox.events.occurrences).
+        from inbox.events.recurring import iter_start_times, merge_events
+        if overrides is None:
+            overrides = self.overrides
+            if start:
+                overrides = overrides.filter(
+                    RecurringEventOverride.start > start)
+            if end:
+                overrides = overrides.filter(
+                    RecurringEventOverride.end < end)
+            overrides = list(overrides)
+        else:
+            overrides = [o for o in overrides if (not start or o.start > start)
+                         and (not end or o.end < end)]
+        overridden_starts = [e.original_start_time for e in overrides]
         # Remove cancellations from the override set
-        events = filter(lambda e: not e.cancelled, events)
+        events = sorted((e for e in overrides if not e.cancelled),
+                        key=lambda e: e.start)
         # If an override has not changed the start time for an event, including
         # if the override is a cancellation, the RRULE doesn't include an
         # exception for it. Filter out unnecessary inflated events
         # to cover this case by checking the start time.
-        for e in self.inflate(start, end):
-            if e.start not in overridden_starts:
-                events.append(e)
-        return sorted(events, key=lambda e: e.start)
+        if start_times is None:
+            start_times = iter_start_times(self, start, end)
+        inflated = (InflatedEvent(self, o) for o in start_times
+                    if o.to('utc') not in overridden_starts)
+        return merge_events([events, inflated])
 
     def update(self, event):
         super(RecurringEvent, self).update(event)
@@ -474,3 +492,25 @@ def insert_warning(mapper, connection, target):
     raise Exception("InflatedEvent should not be committed")
 
 event.listen(InflatedEvent, 'before_insert', insert_warning)
+
+
+class EventOccurrence(MailSyncBase):
+    """ A start time of a recurring event within the window materialised by
+        inbox.events.occurrences. Derived from the event's RRULE; never
+        synced or exposed through the API itself.
+    """
+    event_id = Column(ForeignKey(Event.id, ondelete='CASCADE'),
+                      nullable=False)
+    start = Column(FlexibleDateTime, nullable=False)
+    end = Column(FlexibleDateTime, nullable=False)
+
+    __table_args__ = (Index('ix_eventoccurrence_event_id_start',
+                            'event_id', 'start'),)
+
+
+class EventOccurrenceWindow(MailSyncBase):
+    """ The time range for which the occurrences of all recurring events are
+        materialised. Is namespace-agnostic; there is at most one row.
+    """
+    start = Column(FlexibleDateTime, nullable=False)
+    end = Column(FlexibleDateTime, nullable=False)
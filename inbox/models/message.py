@@ -11,7 +11,7 @@ from sqlalchemy.orm import relationship, backref, validates, joinedload
 from sqlalchemy.sql.expression import false
 from sqlalchemy.ext.associationproxy import association_proxy
 
-from inbox.util.html import plaintext2html, strip_tags
+from inbox.util.html import plaintext2html, strip_tags, strip_quoted_html
 from inbox.sqlalchemy_ext.util import JSON, json_field_too_long, bakery
 from inbox.util.addr import parse_mimepart_address_header
 from inbox.util.misc import parse_references, get_internaldate
@@ -90,6 +90,12 @@ class Message(MailSyncBase, HasRevisions, HasPublicID):
             self.state = 'actions_committed'
 
     _compacted_body = Column(LONGBLOB, nullable=True)
+    # The body with the quoted text of earlier messages stripped, computed
+    # whenever the body is set (see `reply_text`). It's only stored if it
+    # differs from the body; has_quoted_text is NULL if it hasn't been
+    # computed yet.
+    _compacted_reply_text = Column(LONGBLOB, nullable=True)
+    has_quoted_text = Column(Boolean, nullable=True)
     snippet = Column(String(191), nullable=False)
     SNIPPET_LENGTH = 191
 
@@ -420,6 +426,33 @@ class Message(MailSyncBase, HasRevisions, HasPublicID):
             self._compacted_body = None
         else:
             self._compacted_body = encode_blob(value.encode('utf-8'))
+        self.update_reply_text(value)
+
+    @property
+    def reply_text(self):
+        if self.has_quoted_text is None:
+            body = self.body
+            return strip_quoted_html(body) if body is not None else None
+        if not self.has_quoted_text:
+            return self.body
+        return decode_blob(self._compacted_reply_text).decode('utf-8')
+
+    def update_reply_text(self, body):
+        self._compacted_reply_text = None
+        self.has_quoted_text = None
+        if body is None:
+            return
+        try:
+            reply_text = strip_quoted_html(body)
+        except Exception:
+            # Leave it to be computed when the message is encoded.
+            log.error('Error stripping quoted text', message_id=self.id,
+                      exc_info=True)
+            return
+        self.has_quoted_text = reply_text != body
+        if self.has_quoted_text:
+            self._compacted_reply_text = encode_blob(
+                reply_text.encode('utf-8'))
 
     @property
     def participants(self):
@@ -17,7 +17,8 @@ def load_models():
     from inbox.models.search import SearchIndexCursor
     from inbox.models.secret import Secret
     from inbox.models.thread import Thread
-    from inbox.models.transaction import Transaction
+    from inbox.models.transaction import (Transaction, TransactionLogHorizon,
+                                          CompactedTransaction)
     from inbox.models.when import When, Time, TimeSpan, Date, DateSpan
     from inbox.models.label import Label
     from inbox.models.category import Category
@@ -25,6 +26,7 @@ def load_models():
                MessageContactAssociation, Contact, Calendar,
                DataProcessingCache, Event, Folder,
                Message, Namespace, SearchIndexCursor, Secret,
-               Thread, Transaction, When, Time, TimeSpan, Date, DateSpan,
+               Thread, Transaction, TransactionLogHorizon,
+               CompactedTransaction, When, Time, TimeSpan, Date, DateSpan,
                Label, Category, MessageCategory]
     return exports
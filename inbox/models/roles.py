@@ -1,20 +1,26 @@
 import os
+from datetime import datetime
 from hashlib import sha256
 
 from sqlalchemy import Column, Integer, String
 
 from inbox.config import config
+from inbox.util.blockstore import BLOB_NAME, should_verify
+from inbox.util.stats import statsd_client
 from nylas.logging import get_logger
 log = get_logger()
 
 # TODO: store AWS credentials in a better way.
 STORE_MSG_ON_S3 = config.get('STORE_MESSAGES_ON_S3', None)
+CHUNK_SIZE = 64 * 1024
 
 if STORE_MSG_ON_S3:
-    from boto.s3.connection import S3Connection
-    from boto.s3.key import Key
+    from inbox.util.blockstore import (get_s3_client, get_blob_cache,
+                                       get_uploader)
 else:
     from inbox.util.file import mkdirp
+    from inbox.util.packfile import (get_pack_store, pack_directory,
+                                     pack_threshold)
 
     _data_file_directory = \
         lambda h: os.path.join(config.get_required('MSG_PARTS_DIRECTORY'),
@@ -48,8 +54,9 @@ class Blob(object):
             log.error('No data returned!')
             return value
 
-        assert self.data_sha256 == sha256(value).hexdigest(), \
-            "Returned data doesn't match stored hash!"
+        if should_verify() and self.data_sha256 != sha256(value).hexdigest():
+            statsd_client.incr('blockstore.verify.mismatch')
+            raise AssertionError("Returned data doesn't match stored hash!")
         return value
 
     @data.setter
@@ -74,46 +81,67 @@ class Blob(object):
             log.warning('Not saving 0-length {1} {0}'.format(
                 self.id, self.__class__.__name__))
 
-    def _save_to_s3(self, data):
-        assert 'AWS_ACCESS_KEY_ID' in config, 'Need AWS key!'
-        assert 'AWS_SECRET_ACCESS_KEY' in config, 'Need AWS secret!'
-        assert 'MESSAGE_STORE_BUCKET_NAME' in config, \
-            'Need bucket name to store message data!'
-
-        # Boto pools connections at the class level
-        conn = S3Connection(config.get('AWS_ACCESS_KEY_ID'),
-                            config.get('AWS_SECRET_ACCESS_KEY'))
-        bucket = conn.get_bucket(config.get('MESSAGE_STORE_BUCKET_NAME'),
-                                 validate=False)
-
-        # See if it already exists; if so, don't recreate.
-        key = bucket.get_key(self.data_sha256)
-        if key:
-            return
+    def iter_data(self, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """
+        Return an iterator over the blob's data (or over bytes start to
+        end - 1 of it) in chunks of up to chunk_size bytes, so that large
+        blobs don't have to be held in memory. Unlike `data`, the hash of the
+        data can only be checked once all of it has been read; a mismatch is
+        logged. As for `data`, whether it is checked depends on the
+        `BLOB_VERIFY` policy.
 
-        key = Key(bucket)
-        key.key = self.data_sha256
-        key.set_contents_from_string(data)
+        """
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return iter([])
+        if hasattr(self, '_data'):
+            data = self._data[start:end]
+            return (data[i:i + chunk_size]
+                    for i in range(0, len(data), chunk_size))
+        complete = start == 0 and end == self.size
+        if STORE_MSG_ON_S3:
+            chunks = _iter_from_s3(self.data_sha256, start, end, chunk_size,
+                                   complete)
+        else:
+            chunks = _iter_from_disk(self.data_sha256, start, end, chunk_size,
+                                     self.size)
+        if complete and should_verify():
+            return _verify_chunks(chunks, self.data_sha256)
+        return chunks
+
+    def _save_to_s3(self, data):
+        uploader = get_uploader()
+        if uploader is not None:
+            uploader.stage(self.data_sha256, data)
+        else:
+            get_s3_client().put(self.data_sha256, data)
 
     def _get_from_s3(self):
         if not self.data_sha256:
             return None
 
-        conn = S3Connection(config.get('AWS_ACCESS_KEY_ID'),
-                            config.get('AWS_SECRET_ACCESS_KEY'))
-        bucket = conn.get_bucket(config.get('MESSAGE_STORE_BUCKET_NAME'),
-                                 validate=False)
-
-        key = bucket.get_key(self.data_sha256)
+        uploader = get_uploader()
+        if uploader is not None:
+            value = uploader.get(self.data_sha256)
+            if value is not None:
+                return value
 
-        if not key:
-            log.error('No key with name: {} returned!'.
-                      format(self.data_sha256))
-            return
+        cache = get_blob_cache()
+        if cache is not None:
+            value = cache.get(self.data_sha256)
+            if value is not None:
+                return value
 
-        return key.get_contents_as_string()
+        value = get_s3_client().get(self.data_sha256)
+        if value is not None and cache is not None:
+            cache.put(self.data_sha256, value)
+        return value
 
     def _save_to_disk(self, data):
+        if len(data) < pack_threshold():
+            get_pack_store().put(self.data_sha256, data)
+            return
+
         directory = _data_file_directory(self.data_sha256)
         mkdirp(directory)
 
@@ -124,9 +152,154 @@ class Blob(object):
         if not self.data_sha256:
             return None
 
+        # Blobs written before packing was enabled are in the directory
+        # layout, unless they have been migrated since.
+        if self.size < pack_threshold():
+            value = get_pack_store().get(self.data_sha256)
+            if value is not None:
+                return value
+
         try:
             with open(_data_file_path(self.data_sha256), 'rb') as f:
                 return f.read()
         except IOError:
             log.error('No file with name: {}!'.format(self.data_sha256))
             return
+
+
+def _iter_from_s3(data_sha256, start, end, chunk_size, complete=False):
+    uploader = get_uploader()
+    if uploader is not None:
+        chunks = uploader.iter_range(data_sha256, start, end, chunk_size)
+        if chunks is not None:
+            return chunks
+    cache = get_blob_cache()
+    if cache is not None:
+        chunks = cache.iter_range(data_sha256, start, end, chunk_size)
+        if chunks is not None:
+            return chunks
+    chunks = get_s3_client().iter_range(data_sha256, start, end, chunk_size)
+    if cache is not None and complete:
+        # Only reads of the whole blob can fill the cache, so end is its size.
+        chunks = cache.filling(data_sha256, chunks, end)
+    return chunks
+
+
+def _iter_from_disk(data_sha256, start, end, chunk_size, size):
+    if size < pack_threshold():
+        chunks = get_pack_store().iter_range(data_sha256, start, end,
+                                             chunk_size)
+        if chunks is not None:
+            return chunks
+    return _iter_file(data_sha256, start, end, chunk_size)
+
+
+def _iter_file(data_sha256, start, end, chunk_size):
+    try:
+        f = open(_data_file_path(data_sha256), 'rb')
+    except IOError:
+        log.error('No file with name: {}!'.format(data_sha256))
+        return
+
+    with f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _verify_chunks(chunks, data_sha256):
+    digest = sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+    if digest.hexdigest() != data_sha256:
+        statsd_client.incr('blockstore.verify.mismatch')
+        log.error("Returned data doesn't match stored hash!",
+                  data_sha256=data_sha256)
+
+
+def iter_stored_data(data_sha256, size, chunk_size=CHUNK_SIZE):
+    """
+    Return an iterator over the data stored for data_sha256 in S3 or on
+    disk, bypassing the read-through cache.
+
+    """
+    if STORE_MSG_ON_S3:
+        uploader = get_uploader()
+        if uploader is not None:
+            chunks = uploader.iter_range(data_sha256, 0, size, chunk_size)
+            if chunks is not None:
+                return chunks
+        return get_s3_client().iter_range(data_sha256, 0, size, chunk_size)
+    return _iter_from_disk(data_sha256, 0, size, chunk_size, size)
+
+
+def list_stored_blobs():
+    """
+    Yield (sha256, size, last modified datetime) for all blobs stored in S3
+    or in the directory layout. Packed blobs aren't included; they are
+    reclaimed by `PackStore.compact`.
+
+    """
+    if STORE_MSG_ON_S3:
+        for name, size, last_modified in get_s3_client().list():
+            if BLOB_NAME.match(name):
+                yield name, size, last_modified
+        return
+
+    root = config.get_required('MSG_PARTS_DIRECTORY')
+    packs = os.path.abspath(pack_directory())
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.abspath(dirpath) == packs:
+            del dirnames[:]
+            continue
+        for filename in filenames:
+            if not BLOB_NAME.match(filename):
+                continue
+            try:
+                stat = os.stat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            yield (filename, stat.st_size,
+                   datetime.utcfromtimestamp(stat.st_mtime))
+
+
+def stored_blob_last_modified(data_sha256):
+    """
+    Return when the blob data_sha256 in S3 or in the directory layout was
+    last modified, or None if it isn't stored there.
+
+    """
+    if STORE_MSG_ON_S3:
+        return get_s3_client().last_modified(data_sha256)
+    try:
+        stat = os.stat(_data_file_path(data_sha256))
+    except OSError:
+        return None
+    return datetime.utcfromtimestamp(stat.st_mtime)
+
+
+def delete_stored_blobs(hashes):
+    """
+    Delete the blobs with the given hashes from S3 or the directory layout.
+    Returns the hashes of the blobs that were deleted.
+
+    """
+    if STORE_MSG_ON_S3:
+        return get_s3_client().delete_many(hashes)
+
+    deleted = []
+    for data_sha256 in hashes:
+        try:
+            os.remove(_data_file_path(data_sha256))
+        except OSError:
+            log.error('Error deleting blob', data_sha256=data_sha256,
+                      exc_info=True)
+            continue
+        deleted.append(data_sha256)
+    return deleted
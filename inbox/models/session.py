@@ -20,13 +20,21 @@ def new_session(engine, versioned=True):
     """Returns a session bound to the given engine."""
     session = Session(bind=engine, autoflush=True, autocommit=False)
     if versioned:
-        from inbox.models.transaction import (create_revisions,
+        from inbox.models.transaction import (track_revisions,
+                                              create_revisions,
                                               propagate_changes,
                                               increment_versions)
+        from inbox.models.thread import (update_thread_summaries,
+                                         update_pending_category_ids)
+        from inbox.events.occurrences import (track_occurrence_changes,
+                                              update_occurrences)
 
         @event.listens_for(session, 'before_flush')
         def before_flush(session, flush_context, instances):
             propagate_changes(session)
+            update_thread_summaries(session)
+            track_occurrence_changes(session)
+            track_revisions(session)
             increment_versions(session)
 
         @event.listens_for(session, 'after_flush')
@@ -36,6 +44,8 @@ def new_session(engine, versioned=True):
             grab object IDs on new objects.
 
             """
+            update_pending_category_ids(session)
+            update_occurrences(session)
             create_revisions(session)
 
         # Make statsd calls for transaction times
@@ -1,16 +1,24 @@
 import itertools
 from collections import defaultdict
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy import (Column, Integer, String, DateTime, Boolean,
+                        ForeignKey, Index)
+from sqlalchemy import inspect
 from sqlalchemy.orm import relationship, backref, validates, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.expression import false
 
 from nylas.logging import get_logger
 log = get_logger()
 from inbox.models.mixins import HasPublicID, HasRevisions
 from inbox.models.base import MailSyncBase
 from inbox.models.namespace import Namespace
+from inbox.sqlalchemy_ext.util import JSON, BigJSON
 from inbox.util.misc import cleanup_subject
 
+NEW_MESSAGES_KEY = 'new_thread_messages'
+PENDING_CATEGORIES_KEY = 'thread_summaries_with_pending_categories'
+
 
 class Thread(MailSyncBase, HasPublicID, HasRevisions):
     """
@@ -41,6 +49,20 @@ class Thread(MailSyncBase, HasPublicID, HasRevisions):
     snippet = Column(String(191), nullable=True, default='')
     version = Column(Integer, nullable=True, server_default='0')
 
+    # Summary of the thread's messages, so that API representations and
+    # filters don't have to load every message. Kept up to date on flush by
+    # `update_thread_summaries`; `_participants` is NULL for threads that
+    # haven't been summarized yet (see bin/backfill-thread-summaries), in
+    # which case the properties below fall back to computing from messages.
+    unread_count = Column(Integer, nullable=False, server_default='0')
+    starred_count = Column(Integer, nullable=False, server_default='0')
+    _has_attachments = Column('has_attachments', Boolean, nullable=False,
+                              server_default=false())
+    _receivedrecentdate = Column('receivedrecentdate', DateTime,
+                                 nullable=True)
+    _participants = Column('participants', BigJSON, nullable=True)
+    _category_ids = Column('category_ids', JSON, nullable=True)
+
     @validates('subject')
     def compute_cleaned_up_subject(self, key, value):
         self._cleaned_subject = cleanup_subject(value)
@@ -48,7 +70,12 @@ class Thread(MailSyncBase, HasPublicID, HasRevisions):
 
     @validates('messages')
     def update_from_message(self, k, message):
-        with object_session(self).no_autoflush:
+        session = object_session(self)
+        # The thread's summary columns are updated on flush, once the message
+        # is complete.
+        session.info.setdefault(NEW_MESSAGES_KEY, {}).setdefault(
+            id(self), (self, {}))[1][id(message)] = message
+        with session.no_autoflush:
             if message.is_draft:
                 # Don't change subjectdate, recentdate, or unread/unseen based
                 # on drafts
@@ -64,38 +91,70 @@ class Thread(MailSyncBase, HasPublicID, HasRevisions):
                 self.subjectdate = message.received_date
             return message
 
+    def compute_summary(self, exclude=()):
+        """
+        Compute the values of the summary columns from the thread's messages,
+        ignoring the messages in `exclude`.
+
+        """
+        messages = [m for m in self.messages if m not in exclude]
+        received = [m for m in messages if _is_received(m)]
+        if received:
+            received_recent_date = max(m.received_date for m in received)
+        elif messages:
+            received_recent_date = max(m.received_date for m in messages)
+        else:
+            received_recent_date = None
+
+        non_drafts = [m for m in messages if not m.is_draft]
+        category_ids = set()
+        for m in messages:
+            category_ids.update(category.id for category in m.categories)
+        category_ids.discard(None)
+        return {
+            'unread_count': sum(1 for m in non_drafts if not m.is_read),
+            'starred_count': sum(1 for m in non_drafts if m.is_starred),
+            '_has_attachments': any(m.attachments for m in non_drafts),
+            '_receivedrecentdate': received_recent_date,
+            '_participants': _dedupe_participants(
+                itertools.chain.from_iterable(_addresses(m)
+                                              for m in non_drafts)),
+            '_category_ids': sorted(category_ids)
+        }
+
+    def update_summary(self, exclude=()):
+        for key, value in self.compute_summary(exclude).iteritems():
+            if getattr(self, key) != value:
+                setattr(self, key, value)
+
     @property
-    def receivedrecentdate(self):
-        received_recent_date = None
-        for m in self.messages:
-            if all(category.name != "sent" for category in m.categories) and \
-                    not m.is_draft and not m.is_sent:
-                if not received_recent_date or \
-                        m.received_date > received_recent_date:
-                    received_recent_date = m.received_date
-
-        if not received_recent_date:
-            sorted_messages = sorted(self.messages,
-                                     key=lambda m: m.received_date)
-            if not sorted_messages:
-                log.warning('Thread does not have associated messages',
-                            thread_id=self.id)
-                return None
-            received_recent_date = sorted_messages[-1].received_date
+    def has_summary(self):
+        return self._participants is not None
+
+    def _summary_value(self, key):
+        if self.has_summary:
+            return getattr(self, key)
+        return self.compute_summary()[key]
 
+    @property
+    def receivedrecentdate(self):
+        received_recent_date = self._summary_value('_receivedrecentdate')
+        if received_recent_date is None:
+            log.warning('Thread does not have associated messages',
+                        thread_id=self.id)
         return received_recent_date
 
     @property
     def unread(self):
-        return not all(m.is_read for m in self.messages if not m.is_draft)
+        return self._summary_value('unread_count') > 0
 
     @property
     def starred(self):
-        return any(m.is_starred for m in self.messages if not m.is_draft)
+        return self._summary_value('starred_count') > 0
 
     @property
     def has_attachments(self):
-        return any(m.attachments for m in self.messages if not m.is_draft)
+        return self._summary_value('_has_attachments')
 
     @property
     def versioned_relationships(self):
@@ -103,27 +162,7 @@ class Thread(MailSyncBase, HasPublicID, HasRevisions):
 
     @property
     def participants(self):
-        """
-        Different messages in the thread may reference the same email
-        address with different phrases. We partially deduplicate: if the same
-        email address occurs with both empty and nonempty phrase, we don't
-        separately return the (empty phrase, address) pair.
-
-        """
-        deduped_participants = defaultdict(set)
-        for m in self.messages:
-            if m.is_draft:
-                # Don't use drafts to compute participants.
-                continue
-            for phrase, address in itertools.chain(m.from_addr, m.to_addr,
-                                                   m.cc_addr, m.bcc_addr):
-                    deduped_participants[address].add(phrase.strip())
-        p = []
-        for address, phrases in deduped_participants.iteritems():
-            for phrase in phrases:
-                if phrase != '' or len(phrases) == 1:
-                    p.append((phrase, address))
-        return p
+        return [tuple(p) for p in self._summary_value('_participants')]
 
     @property
     def drafts(self):
@@ -143,9 +182,20 @@ class Thread(MailSyncBase, HasPublicID, HasRevisions):
 
     @property
     def categories(self):
-        categories = set()
-        for m in self.messages:
-            categories.update(m.categories)
+        if not self.has_summary:
+            categories = set()
+            for m in self.messages:
+                categories.update(m.categories)
+            return categories
+
+        from inbox.models.category import Category
+        preloaded = self.__dict__.get('_preloaded_categories', {})
+        categories = {preloaded[id_] for id_ in self._category_ids
+                      if id_ in preloaded}
+        missing = [id_ for id_ in self._category_ids if id_ not in preloaded]
+        if missing:
+            categories.update(object_session(self).query(Category).filter(
+                Category.id.in_(missing)))
         return categories
 
     @property
@@ -166,6 +216,209 @@ class Thread(MailSyncBase, HasPublicID, HasRevisions):
     discriminator = Column('type', String(16))
     __mapper_args__ = {'polymorphic_on': discriminator}
 
+
+def _is_received(message):
+    return not message.is_draft and not message.is_sent and \
+        all(category.name != 'sent' for category in message.categories)
+
+
+def _addresses(message):
+    return itertools.chain(message.from_addr or [], message.to_addr or [],
+                           message.cc_addr or [], message.bcc_addr or [])
+
+
+def _dedupe_participants(addresses):
+    """
+    Different messages in the thread may reference the same email
+    address with different phrases. We partially deduplicate: if the same
+    email address occurs with both empty and nonempty phrase, we don't
+    separately return the (empty phrase, address) pair.
+
+    """
+    deduped_participants = defaultdict(set)
+    for phrase, address in addresses:
+        deduped_participants[address].add(phrase.strip())
+    p = []
+    for address, phrases in deduped_participants.iteritems():
+        for phrase in sorted(phrases):
+            if phrase != '' or len(phrases) == 1:
+                p.append([phrase, address])
+    return p
+
+
+def preload_categories(db_session, threads):
+    """
+    Load the categories of all of `threads` with a single query, so that
+    encoding them doesn't issue a query per thread.
+
+    """
+    from inbox.models.category import Category
+    category_ids = set()
+    for thread in threads:
+        category_ids.update(thread._category_ids or [])
+    categories = {}
+    if category_ids:
+        categories = {category.id: category for category in
+                      db_session.query(Category).filter(
+                          Category.id.in_(category_ids))}
+    for thread in threads:
+        thread.__dict__['_preloaded_categories'] = categories
+
+
+def _add_message(thread, message, pending_categories):
+    """ Fold a new message into an existing thread summary. """
+    if not message.is_draft:
+        if not message.is_read:
+            thread.unread_count += 1
+        if message.is_starred:
+            thread.starred_count += 1
+        if message.attachments:
+            thread._has_attachments = True
+        participants = _dedupe_participants(itertools.chain(
+            thread._participants, _addresses(message)))
+        if participants != thread._participants:
+            thread._participants = participants
+    if _is_received(message) or thread._receivedrecentdate is None:
+        if thread._receivedrecentdate is None or \
+                message.received_date > thread._receivedrecentdate:
+            thread._receivedrecentdate = message.received_date
+    _add_categories(thread, message.categories, pending_categories)
+
+
+def _add_categories(thread, categories, pending_categories):
+    category_ids = set(thread._category_ids)
+    for category in categories:
+        if category.id is None:
+            pending_categories[id(thread)] = thread
+        category_ids.add(category.id)
+    category_ids.discard(None)
+    if category_ids != set(thread._category_ids):
+        thread._category_ids = sorted(category_ids)
+
+
+def _apply_changes(thread, message, pending_categories):
+    """
+    Apply the flag and category changes of a modified message to its
+    thread's summary. Returns False if the summary has to be recomputed from
+    scratch instead.
+
+    """
+    attrs = inspect(message).attrs
+    if attrs.is_draft.history.has_changes() or \
+            attrs.is_sent.history.has_changes() or \
+            attrs.thread.history.has_changes():
+        return False
+    for attr, counter, value in (('is_read', 'unread_count', False),
+                                 ('is_starred', 'starred_count', True)):
+        history = getattr(attrs, attr).history
+        if not history.has_changes() or message.is_draft:
+            continue
+        if not history.deleted:
+            # The previous value wasn't loaded.
+            return False
+        before = history.deleted[0] == value
+        after = getattr(message, attr) == value
+        setattr(thread, counter, getattr(thread, counter) + after - before)
+
+    # Assigning to message.categories replaces all of the message's
+    # MessageCategory objects, so compare categories rather than those.
+    history = attrs.messagecategories.history
+    added = {mc.category for mc in history.added}
+    removed = {mc.category for mc in history.deleted} - added
+    added -= {mc.category for mc in history.deleted}
+    if removed or any(category.name == 'sent' for category in added):
+        return False
+    _add_categories(thread, added, pending_categories)
+    return True
+
+
+def update_thread_summaries(session):
+    """
+    Keep the summary columns of threads up to date with changes to their
+    messages. Must be called from the pre-flush hook.
+
+    New messages and flag changes are applied incrementally. Threads that
+    haven't been summarized yet, lose a message or a category, or where it's
+    otherwise not clear how the summary changes, are recomputed from all of
+    their messages.
+
+    Changes are applied at flush time rather than as they're made, because
+    sync adds a new message to its thread (see `Thread.update_from_message`)
+    before setting the message's flags and categories.
+
+    """
+    from inbox.models.message import Message
+    new = session.info.pop(NEW_MESSAGES_KEY, {})
+    pending_categories = session.info.setdefault(PENDING_CATEGORIES_KEY, {})
+    recompute = {}
+    deleted_messages = set()
+    for obj in session.deleted:
+        if isinstance(obj, Message):
+            deleted_messages.add(obj)
+            if obj.thread is not None:
+                recompute[id(obj.thread)] = obj.thread
+
+    for obj in session.new:
+        if isinstance(obj, Thread):
+            recompute[id(obj)] = obj
+
+    modified = defaultdict(list)
+    for obj in session.dirty:
+        if not isinstance(obj, Message) or obj.thread is None or \
+                obj in deleted_messages or not session.is_modified(obj):
+            continue
+        for thread in inspect(obj).attrs.thread.history.deleted:
+            # The message moved to a different thread.
+            if thread is not None:
+                recompute[id(thread)] = thread
+        modified[id(obj.thread)].append(obj)
+
+    threads = {}
+    for thread, messages in new.itervalues():
+        threads[id(thread)] = thread
+    for messages in modified.itervalues():
+        threads[id(messages[0].thread)] = messages[0].thread
+
+    for key, thread in threads.iteritems():
+        if key in recompute or not thread.has_summary or \
+                thread in session.new:
+            recompute[key] = thread
+            continue
+        for message in new.get(key, (thread, {}))[1].itervalues():
+            if message in session.new:
+                _add_message(thread, message, pending_categories)
+            else:
+                recompute[key] = thread
+        if not all(_apply_changes(thread, message, pending_categories)
+                   for message in modified[key]):
+            recompute[key] = thread
+
+    for thread in recompute.itervalues():
+        if thread in session.deleted:
+            continue
+        thread.update_summary(exclude=deleted_messages)
+        if any(category.id is None for m in thread.messages
+               for category in m.categories):
+            pending_categories[id(thread)] = thread
+
+
+def update_pending_category_ids(session):
+    """
+    Categories created in the same flush as a thread summary refers to them
+    only get their ids during the flush. Write those ids to the summary.
+    Must be called from the post-flush hook.
+
+    """
+    for thread in session.info.pop(PENDING_CATEGORIES_KEY, {}).itervalues():
+        category_ids = set()
+        for m in thread.messages:
+            category_ids.update(category.id for category in m.categories)
+        category_ids = sorted(category_ids)
+        session.execute(Thread.__table__.update().where(
+            Thread.id == thread.id).values(category_ids=category_ids))
+        set_committed_value(thread, '_category_ids', category_ids)
+
+
 # The /threads API endpoint filters on namespace_id and deleted_at, then orders
 # by recentdate; add an explicit index to persuade MySQL to do this in a
 # somewhat performant manner.
@@ -1,5 +1,5 @@
-from sqlalchemy import (Column, Integer, String, ForeignKey, Index, Enum,
-                        inspect)
+from sqlalchemy import (Column, Integer, String, DateTime, ForeignKey, Index,
+                        Enum, inspect)
 from sqlalchemy.orm import relationship
 
 from inbox.models.base import MailSyncBase
@@ -27,6 +27,41 @@ Index('namespace_id_created_at', Transaction.namespace_id,
       Transaction.created_at)
 
 
+class TransactionLogHorizon(MailSyncBase):
+    """
+    Record how far the transaction log has been trimmed by the retention
+    service: transactions with id <= `expired_through_id`, all of which were
+    created before `expired_before`, may have been deleted, and redundant
+    update transactions with id <= `compacted_through_id` may have been
+    removed. Is namespace-agnostic.
+
+    """
+    expired_through_id = Column(Integer, nullable=False, default=0)
+    expired_before = Column(DateTime, nullable=True)
+    compacted_through_id = Column(Integer, nullable=False, default=0)
+
+
+class CompactedTransaction(MailSyncBase, HasPublicID):
+    """
+    A transaction removed by compaction. Its public id may still be held by
+    a client as a delta cursor, so record the id it had to resume from.
+    `created_at` is that of the original transaction, so that these rows are
+    expired along with the rest of the log.
+
+    """
+    namespace_id = Column(Integer,
+                          ForeignKey(Namespace.id, ondelete='CASCADE'),
+                          nullable=False)
+    transaction_id = Column(Integer, nullable=False)
+
+Index('ix_compactedtransaction_namespace_id_public_id',
+      CompactedTransaction.namespace_id, CompactedTransaction.public_id)
+
+
+PENDING_REVISIONS_KEY = 'pending_revisions'
+MARKED_DIRTY_KEY = 'marked_dirty'
+
+
 def is_dirty(session, obj):
     if obj in session.dirty and obj.has_versioned_changes():
         return True
@@ -35,13 +70,45 @@ def is_dirty(session, obj):
     return False
 
 
-def create_revisions(session):
-    for obj in session:
+def mark_dirty(session, obj):
+    """
+    Mark obj as changed, so that an update revision is created for it on
+    the next flush even though none of its own attributes have changed.
+
+    """
+    obj.dirty = True
+    session.info.setdefault(MARKED_DIRTY_KEY, {})[id(obj)] = obj
+
+
+def track_revisions(session):
+    """
+    Record which versioned objects the upcoming flush inserts, updates or
+    deletes. Must be called from the pre-flush hook; the revisions are
+    written by `create_revisions` once the flush has assigned object ids.
+
+    Only objects that are new, deleted, modified or explicitly marked dirty
+    are examined, rather than every object in the session.
+
+    """
+    marked = session.info.pop(MARKED_DIRTY_KEY, {})
+    new = session.new
+    deleted = session.deleted
+    candidates = list(new)
+    candidates.extend(session.dirty)
+    candidates.extend(marked.itervalues())
+    candidates.extend(deleted)
+
+    revisions = []
+    seen = set()
+    for obj in candidates:
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
         if (not isinstance(obj, HasRevisions) or
                 obj.should_suppress_transaction_creation):
             continue
-        if obj in session.new:
-            create_revision(obj, session, 'insert')
+        if obj in new:
+            revisions.append((obj, 'insert'))
         elif is_dirty(session, obj):
             # Need to unmark the object as 'dirty' to prevent an infinite loop
             # (the pre-flush hook may be called again before a commit
@@ -49,18 +116,37 @@ def create_revisions(session):
             # in that they are no longer present in the set during the next
             # invocation of the pre-flush hook.
             obj.dirty = False
-            create_revision(obj, session, 'update')
-        elif obj in session.deleted:
-            create_revision(obj, session, 'delete')
+            revisions.append((obj, 'update'))
+        elif obj in deleted:
+            revisions.append((obj, 'delete'))
+    session.info[PENDING_REVISIONS_KEY] = revisions
+
+
+def create_revisions(session):
+    """
+    Write the revisions recorded by `track_revisions` to the transaction log
+    with a single multi-row insert. Must be called post-flush in order to
+    grab object ids of new objects.
+
+    """
+    revisions = session.info.pop(PENDING_REVISIONS_KEY, None)
+    if not revisions:
+        return
+    session.execute(Transaction.__table__.insert(),
+                    [revision_params(obj, revision_type)
+                     for obj, revision_type in revisions])
 
 
-def create_revision(obj, session, revision_type):
+def revision_params(obj, revision_type):
     assert revision_type in ('insert', 'update', 'delete')
-    revision = Transaction(command=revision_type, record_id=obj.id,
-                           object_type=obj.API_OBJECT_NAME,
-                           object_public_id=obj.public_id,
-                           namespace_id=obj.namespace.id)
-    session.add(revision)
+    namespace_id = getattr(obj, 'namespace_id', None)
+    if namespace_id is None:
+        namespace_id = obj.namespace.id
+    return {'command': revision_type,
+            'record_id': obj.id,
+            'object_type': obj.API_OBJECT_NAME,
+            'object_public_id': obj.public_id,
+            'namespace_id': namespace_id}
 
 
 def propagate_changes(session):
@@ -78,12 +164,13 @@ def propagate_changes(session):
             obj_state = inspect(obj)
             for attr in obj.propagated_attributes:
                 if getattr(obj_state.attrs, attr).history.has_changes():
-                    obj.thread.dirty = True
+                    mark_dirty(session, obj.thread)
 
 
 def increment_versions(session):
+    """ Must be called after `track_revisions`. """
     from inbox.models.thread import Thread
-    for obj in session:
-        if isinstance(obj, Thread) and is_dirty(session, obj):
+    for obj, revision_type in session.info.get(PENDING_REVISIONS_KEY, []):
+        if isinstance(obj, Thread) and revision_type == 'update':
             # This issues SQL for an atomic increment.
             obj.version = Thread.version + 1
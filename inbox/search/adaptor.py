@@ -0,0 +1,370 @@
+"""
+Local full-text search index of messages and threads.
+
+Each namespace gets its own SQLite database in `SEARCH_INDEX_DIRECTORY`, with
+an FTS4 table per object type over the subject, participants, snippet and
+(for messages) body text. The index is fed from the transaction log by
+`SearchIndexService` (see inbox/transactions/search.py), or built in one go
+with `bin/backfill-search-index`, and served by `LocalSearchClient`.
+
+`SearchIndexService` creates the index of a namespace as soon as it sees one
+of its transactions, so the index only covers all of the namespace's mail
+once `bin/backfill-search-index` has run and marked it as complete (see
+`index_complete`). Until then, searches go to the provider.
+
+Queries are sequences of terms that all have to match, the way IMAP SEARCH
+TEXT works. Each term can be restricted to a field, as in `subject:invoice`
+or `from:ben`; quoted terms match phrases, and the last word of a term
+matches as a prefix.
+
+"""
+import calendar
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+from inbox.config import config
+from inbox.models import Message, Thread
+from inbox.util.file import mkdirp
+from inbox.util.html import strip_tags
+from nylas.logging import get_logger
+log = get_logger()
+
+FIELDS = {
+    'subject': 'subject',
+    'from': 'participants',
+    'to': 'participants',
+    'cc': 'participants',
+    'bcc': 'participants',
+    'participants': 'participants',
+    'snippet': 'snippet',
+    'body': 'body',
+}
+TERM = re.compile(r'(?:(\w+):)?("[^"]*"?|\S+)', re.U)
+WORD = re.compile(r'\w+', re.U)
+
+
+def index_directory():
+    return config.get('SEARCH_INDEX_DIRECTORY')
+
+
+def _index_path(namespace_public_id):
+    return os.path.join(index_directory(), '{}.db'.format(namespace_public_id))
+
+
+def _complete_marker_path(namespace_public_id):
+    return os.path.join(index_directory(),
+                        '{}.complete'.format(namespace_public_id))
+
+
+def index_exists(namespace_public_id):
+    return bool(index_directory()) and \
+        os.path.exists(_index_path(namespace_public_id))
+
+
+def index_complete(namespace_public_id):
+    """
+    Whether the namespace's index has been backfilled. This is checked on
+    every search, so rather than opening the index, it looks for the marker
+    file that `NamespaceSearchEngine.mark_complete` writes next to it.
+
+    """
+    return index_exists(namespace_public_id) and \
+        os.path.exists(_complete_marker_path(namespace_public_id))
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple())
+    return value or 0
+
+
+def _participants(addresses):
+    return u' '.join(u'{} {}'.format(address.get('name') or u'',
+                                     address.get('email') or u'')
+                     for address in addresses or [])
+
+
+def match_expression(query, columns):
+    """
+    Translate a search query to an FTS4 MATCH expression over the given
+    columns, or return None if the query can't match anything.
+
+    """
+    terms = []
+    for field, value in TERM.findall(query):
+        column = FIELDS.get(field.lower()) if field else None
+        if field and column is None:
+            # Not a field we know, so search for it as text.
+            value = u'{}:{}'.format(field, value)
+        elif column is not None and column not in columns:
+            return None
+        words = WORD.findall(value)
+        if not words:
+            continue
+        if column is not None:
+            # Column filters only apply to single words in FTS4.
+            terms.extend(u'{}:{}'.format(column, word) for word in words[:-1])
+            terms.append(u'{}:{}*'.format(column, words[-1]))
+        elif value.startswith('"'):
+            terms.append(u'"{}"'.format(u' '.join(words)))
+        else:
+            terms.extend(words[:-1])
+            terms.append(u'{}*'.format(words[-1]))
+    return u' '.join(terms) or None
+
+
+class SearchIndex(object):
+    """
+    Full-text index of one type of object, keyed by public id and ordered by
+    a timestamp.
+
+    """
+    name = None
+    columns = ()
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def create(self):
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS {}_docs ('
+            'docid INTEGER PRIMARY KEY, public_id TEXT UNIQUE NOT NULL, '
+            'thread_id TEXT, timestamp INTEGER)'.format(self.name))
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS {0}_docs_timestamp '
+            'ON {0}_docs (timestamp)'.format(self.name))
+        try:
+            self.conn.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS {}_fts USING fts4({}, '
+                'tokenize=unicode61)'.format(self.name,
+                                             ', '.join(self.columns)))
+        except sqlite3.OperationalError:
+            # SQLite older than 3.7.13
+            self.conn.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS {}_fts USING fts4({})'.
+                format(self.name, ', '.join(self.columns)))
+
+    def document(self, api_repr):
+        """ Return (thread public id, timestamp, column values). """
+        raise NotImplementedError
+
+    def bulk_index(self, operations):
+        """
+        Apply a list of (operation, API representation) pairs, where
+        operation is 'index' or 'delete' (in which case only the 'id' of the
+        representation is used). Returns the number of operations applied.
+
+        """
+        with self.conn:
+            for operation, api_repr in operations:
+                self._delete(api_repr['id'])
+                if operation == 'index':
+                    self._insert(api_repr)
+        return len(operations)
+
+    def _delete(self, public_id):
+        row = self.conn.execute(
+            'SELECT docid FROM {}_docs WHERE public_id = ?'.format(self.name),
+            (public_id,)).fetchone()
+        if row is None:
+            return
+        self.conn.execute('DELETE FROM {}_fts WHERE docid = ?'.format(
+            self.name), row)
+        self.conn.execute('DELETE FROM {}_docs WHERE docid = ?'.format(
+            self.name), row)
+
+    def _insert(self, api_repr):
+        thread_id, timestamp, values = self.document(api_repr)
+        cursor = self.conn.execute(
+            'INSERT INTO {}_docs (public_id, thread_id, timestamp) '
+            'VALUES (?, ?, ?)'.format(self.name),
+            (api_repr['id'], thread_id, timestamp))
+        self.conn.execute(
+            'INSERT INTO {}_fts (docid, {}) VALUES (?, {})'.format(
+                self.name, ', '.join(self.columns),
+                ', '.join('?' for _ in self.columns)),
+            [cursor.lastrowid] + [value or u'' for value in values])
+
+    def _matches(self, column):
+        return ('SELECT d.{column} AS public_id, d.timestamp AS timestamp '
+                'FROM {name}_fts JOIN {name}_docs d '
+                'ON d.docid = {name}_fts.docid '
+                'WHERE {name}_fts MATCH ?').format(name=self.name,
+                                                    column=column)
+
+    def search(self, query, offset=0, limit=40):
+        """ Return the public ids of matching objects, most recent first. """
+        expression = match_expression(query, self.columns)
+        if expression is None:
+            return []
+        sql = self._matches('public_id') + \
+            ' ORDER BY d.timestamp DESC LIMIT ? OFFSET ?'
+        return [public_id for public_id, _ in
+                self.conn.execute(sql, (expression, limit or -1, offset))]
+
+
+class MessageSearchIndex(SearchIndex):
+    name = 'message'
+    columns = ('subject', 'participants', 'snippet', 'body')
+
+    def document(self, api_repr):
+        participants = u' '.join(_participants(api_repr.get(field))
+                                 for field in ('from', 'to', 'cc', 'bcc'))
+        return (api_repr.get('thread_id'), _timestamp(api_repr.get('date')),
+                (api_repr.get('subject'), participants,
+                 api_repr.get('snippet'),
+                 strip_tags(api_repr.get('body') or u'')))
+
+
+class ThreadSearchIndex(SearchIndex):
+    name = 'thread'
+    columns = ('subject', 'participants', 'snippet')
+
+    def document(self, api_repr):
+        return (api_repr['id'],
+                _timestamp(api_repr.get('last_message_timestamp')),
+                (api_repr.get('subject'),
+                 _participants(api_repr.get('participants')),
+                 api_repr.get('snippet')))
+
+
+def _remove_complete_marker(namespace_public_id):
+    try:
+        os.remove(_complete_marker_path(namespace_public_id))
+    except OSError:
+        pass
+
+
+class NamespaceSearchEngine(object):
+    """
+    The search index of a namespace.
+
+    Parameters
+    ----------
+    namespace_public_id: str
+    create_index: bool
+        Whether to create the index if it doesn't exist yet.
+
+    """
+    def __init__(self, namespace_public_id, create_index=False):
+        assert index_directory(), 'SEARCH_INDEX_DIRECTORY is not set'
+        path = _index_path(namespace_public_id)
+        self.namespace_public_id = namespace_public_id
+        if create_index:
+            mkdirp(index_directory())
+            if not os.path.exists(path):
+                # Left behind by an index that was deleted.
+                _remove_complete_marker(namespace_public_id)
+        elif not os.path.exists(path):
+            raise ValueError('No search index for namespace {}'.format(
+                namespace_public_id))
+        self.conn = sqlite3.connect(path, timeout=30)
+        # Let the API read while the index is being written to.
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.messages = MessageSearchIndex(self.conn)
+        self.threads = ThreadSearchIndex(self.conn)
+        if create_index:
+            with self.conn:
+                self.conn.execute(
+                    'CREATE TABLE IF NOT EXISTS meta ('
+                    'key TEXT PRIMARY KEY, value TEXT)')
+                self.messages.create()
+                self.threads.create()
+
+    def close(self):
+        self.conn.close()
+
+    def mark_complete(self):
+        """
+        Record that the index covers all of the namespace's messages and
+        threads, rather than only the ones changed since it was created.
+
+        """
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) "
+                "VALUES ('complete', '1')")
+        open(_complete_marker_path(self.namespace_public_id), 'w').close()
+
+    def is_complete(self):
+        try:
+            row = self.conn.execute(
+                "SELECT value FROM meta WHERE key = 'complete'").fetchone()
+        except sqlite3.OperationalError:
+            # Created before completeness was recorded.
+            return False
+        return row is not None and row[0] == '1'
+
+    def search_threads(self, query, offset=0, limit=40):
+        """
+        Return the public ids of threads that match, or that have a message
+        that matches, most recently active first.
+
+        """
+        message_expression = match_expression(query, self.messages.columns)
+        thread_expression = match_expression(query, self.threads.columns)
+        queries = []
+        params = []
+        if message_expression is not None:
+            queries.append(self.messages._matches('thread_id'))
+            params.append(message_expression)
+        if thread_expression is not None:
+            queries.append(self.threads._matches('public_id'))
+            params.append(thread_expression)
+        if not queries:
+            return []
+        sql = ('SELECT public_id FROM ({}) GROUP BY public_id '
+               'ORDER BY max(timestamp) DESC LIMIT ? OFFSET ?').format(
+                   ' UNION ALL '.join(queries))
+        return [public_id for public_id, in
+                self.conn.execute(sql, params + [limit or -1, offset])]
+
+
+def _in_order(objects, public_ids):
+    by_public_id = {obj.public_id: obj for obj in objects}
+    return [by_public_id[public_id] for public_id in public_ids
+            if public_id in by_public_id]
+
+
+class LocalSearchClient(object):
+    """
+    Search client (see inbox.search.base.get_search_client) backed by the
+    namespace's local search index.
+
+    """
+    def __init__(self, account):
+        self.namespace_id = account.namespace.id
+        self.namespace_public_id = account.namespace.public_id
+        self.log = log.new(account_id=account.id, component='search')
+
+    def search_messages(self, db_session, search_query, offset=0, limit=40):
+        self.log.info('Searching local index for messages',
+                      query=search_query, offset=offset, limit=limit)
+        engine = NamespaceSearchEngine(self.namespace_public_id)
+        try:
+            public_ids = engine.messages.search(search_query, offset, limit)
+        finally:
+            engine.close()
+        if not public_ids:
+            return []
+        messages = db_session.query(Message).filter(
+            Message.namespace_id == self.namespace_id,
+            Message.public_id.in_(public_ids))
+        return _in_order(messages, public_ids)
+
+    def search_threads(self, db_session, search_query, offset=0, limit=40):
+        self.log.info('Searching local index for threads',
+                      query=search_query, offset=offset, limit=limit)
+        engine = NamespaceSearchEngine(self.namespace_public_id)
+        try:
+            public_ids = engine.search_threads(search_query, offset, limit)
+        finally:
+            engine.close()
+        if not public_ids:
+            return []
+        threads = db_session.query(Thread).filter(
+            Thread.namespace_id == self.namespace_id,
+            Thread.public_id.in_(public_ids))
+        return _in_order(threads, public_ids)
@@ -1,10 +1,25 @@
+"""
+Search an account by running IMAP SEARCH in each of its folders.
+
+Folders are searched concurrently over connections borrowed from the
+account's `CrispinConnectionPool`, so at most as many folders are searched at
+once as the pool has connections. The matching UIDs of a query are cached
+for `SEARCH_CACHE_TTL` seconds, so that paginating through the results
+doesn't search every folder again.
+
+"""
+import time
+
+from gevent.pool import Group
+from gevent.queue import Queue
+
 from nylas.logging import get_logger
-from inbox.crispin import CrispinClient
-from inbox.providers import provider_info
-from inbox.basicauth import NotSupportedError
-from inbox.models import Message, Folder, Account, Thread
+from inbox.config import config
+from inbox.crispin import search_connection_pool, CONN_DISCARD_EXC_CLASSES
+from inbox.models import Message, Folder, Thread
 from inbox.models.backends.imap import ImapUid
 from inbox.mailsync.backends.imap.generic import uidvalidity_cb
+from inbox.util.lru import LRUCache
 
 import re
 from sqlalchemy import desc
@@ -12,34 +27,42 @@ from imaplib import IMAP4
 
 PROVIDER = 'imap'
 
+DEFAULT_CACHE_TTL = 30
+DEFAULT_CACHE_MAX_ENTRIES = 1000
+
 
 def format_key(match):
     return "{} ".format(match.group(0).strip()[:-1].upper())
 
 
+class SearchResultCache(LRUCache):
+    """
+    Bounded cache of (account id, query) -> matching UIDs, whose entries
+    expire after `ttl` seconds. Caching is disabled if `ttl` is 0.
+
+    """
+    def __init__(self, max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+                 ttl=DEFAULT_CACHE_TTL):
+        LRUCache.__init__(self, max_entries, ttl)
+
+    def set(self, key, value):
+        if self.ttl > 0:
+            LRUCache.set(self, key, value)
+
+
+search_cache = SearchResultCache(
+    int(config.get('SEARCH_CACHE_MAX_ENTRIES', DEFAULT_CACHE_MAX_ENTRIES)),
+    int(config.get('SEARCH_CACHE_TTL', DEFAULT_CACHE_TTL)))
+
+
 class IMAPSearchClient(object):
     def __init__(self, account):
         self.account_id = account.id
         self.log = get_logger().new(account_id=account.id,
                                     component='search')
 
-    def _open_crispin_connection(self, db_session):
-        account = db_session.query(Account).get(self.account_id)
-        conn = account.auth_handler.connect_account(account)
-        try:
-            acct_provider_info = provider_info(account.provider)
-        except NotSupportedError:
-            self.log.warn('Account provider not supported',
-                          provider=account.provider)
-            raise
-        self.crispin_client = CrispinClient(self.account_id,
-                                            acct_provider_info,
-                                            account.email_address,
-                                            conn,
-                                            readonly=True)
-
-    def _close_crispin_connection(self):
-        self.crispin_client.logout()
+    def _connection_pool(self):
+        return search_connection_pool(self.account_id)
 
     def search_messages(self, db_session, search_query, offset=0, limit=40):
         self.log.info('Searching account for messages',
@@ -87,43 +110,94 @@ class IMAPSearchClient(object):
 
         return query.all()
 
-    def _search(self, db_session, search_query):
-        self._open_crispin_connection(db_session)
+    def _criteria(self, search_query):
         if ':' not in search_query:
             try:
                 query = search_query.encode('ascii')
-                criteria = 'TEXT {}'.format(query)
+                return 'TEXT {}'.format(query)
             except UnicodeEncodeError:
-                criteria = u'TEXT {}'.format(search_query)
-        else:
-            criteria = re.sub('(\w+:[ ]?)', format_key, search_query)
+                return u'TEXT {}'.format(search_query)
+        return re.sub('(\w+:[ ]?)', format_key, search_query)
 
-        folders = db_session.query(Folder).filter(
-            Folder.account_id == self.account_id).all()
+    def _search(self, db_session, search_query):
+        key = (self.account_id, search_query)
+        imap_uids = search_cache.get(key)
+        if imap_uids is not None:
+            return imap_uids
+
+        imap_uids = self._search_folders(db_session,
+                                         self._criteria(search_query))
+        search_cache.set(key, imap_uids)
+        return imap_uids
 
-        imap_uids = set()
+    def _search_folders(self, db_session, criteria):
+        """
+        Search all folders of the account concurrently, and return the set
+        of matching UIDs. Raises the error of the first folder search that
+        fails.
 
-        for folder in folders:
-            imap_uids.update(self._search_folder(db_session,
-                                                  folder, criteria))
-        self._close_crispin_connection()
+        """
+        folder_names = [name for name, in db_session.query(Folder.name).
+                        filter(Folder.account_id == self.account_id)]
+        if not folder_names:
+            return set()
+
+        pool = self._connection_pool()
+        results = Queue()
+
+        def search(folder_name, retry=True):
+            try:
+                # Blocks until one of the pool's connections is free.
+                with pool.get() as crispin_client:
+                    results.put(self._search_folder(
+                        crispin_client, folder_name, criteria))
+            except CONN_DISCARD_EXC_CLASSES as e:
+                # The pool has discarded the connection, which may just have
+                # been closed by the server after sitting idle: try once
+                # more on a new one.
+                if not retry:
+                    results.put(e)
+                    return
+                self.log.info('Search connection error; retrying',
+                              folder_name=folder_name, error=e)
+                search(folder_name, retry=False)
+            except Exception as e:
+                results.put(e)
+
+        searches = Group()
+        start = time.time()
+        for folder_name in folder_names:
+            searches.spawn(search, folder_name)
+        imap_uids = set()
+        try:
+            for _ in folder_names:
+                matching_uids = results.get()
+                if isinstance(matching_uids, Exception):
+                    raise matching_uids
+                imap_uids.update(matching_uids)
+        finally:
+            # Don't keep searching the other folders if one failed. The pool
+            # discards the connections of searches killed mid-command.
+            searches.kill(block=False)
+        self.log.info('Searched folders', folder_count=len(folder_names),
+                      search_time=time.time() - start)
         return imap_uids
 
-    def _search_folder(self, db_session, folder, criteria):
-        self.crispin_client.select_folder(folder.name, uidvalidity_cb)
+    def _search_folder(self, crispin_client, folder_name, criteria):
+        crispin_client.select_folder(folder_name, uidvalidity_cb)
         try:
             if isinstance(criteria, unicode):
-                matching_uids = self.crispin_client.conn. \
+                matching_uids = crispin_client.conn. \
                     search(criteria=criteria, charset="UTF-8")
             else:
-                matching_uids = self.crispin_client.conn. \
+                matching_uids = crispin_client.conn. \
                     search(criteria=criteria)
         except IMAP4.error as e:
             self.log.warn('Search error', error=e)
             raise
 
         self.log.debug('Search found message for folder',
-                        folder_name=folder.name,
+                        folder_name=folder_name,
                         matching_uids=len(matching_uids))
 
         return matching_uids
@@ -1,4 +1,11 @@
 def get_search_client(account):
+    from inbox.search.adaptor import index_complete, LocalSearchClient
+
+    # Use the local search index once it has been backfilled for the
+    # namespace.
+    if index_complete(account.namespace.public_id):
+        return LocalSearchClient(account)
+
     from inbox.search.backends import module_registry
 
     search_mod = module_registry.get(account.provider)
@@ -14,7 +14,8 @@ always just null bytes.)
 """
 import struct
 import zlib
-from inbox.security.oracles import get_encryption_oracle, get_decryption_oracle
+from inbox.security.oracles import (EncryptionScheme, get_encryption_oracle,
+                                    get_decryption_oracle)
 
 
 KEY_VERSION = 0
@@ -42,8 +43,12 @@ def encode_blob(plaintext):
 
 def decode_blob(blob):
     header = blob[:HEADER_WIDTH]
-    body = blob[HEADER_WIDTH:]
     scheme = _unpack_header(header)
+    if scheme == EncryptionScheme.NULL.value:
+        # Don't copy the (possibly large) body just to decompress it.
+        body = buffer(blob, HEADER_WIDTH)
+    else:
+        body = blob[HEADER_WIDTH:]
     decryption_oracle = get_decryption_oracle('BLOCK_ENCRYPTION_KEY')
     compressed_plaintext = decryption_oracle.decrypt(body, scheme)
     result = zlib.decompress(compressed_plaintext)
@@ -15,6 +15,22 @@ class EncryptionScheme(enum.Enum):
     SECRETBOX_WITH_STATIC_KEY = 1
 
 
+# SecretBox objects are keyed by secret name and key, so that rotating a key
+# in the config gets a new one. encode_blob() and decode_blob() need one for
+# every message body and part they handle.
+_secret_boxes = {}
+
+
+def _get_secret_box(secret_name):
+    key = config.get_required(secret_name)
+    secret_box = _secret_boxes.get((secret_name, key))
+    if secret_box is None:
+        secret_box = nacl.secret.SecretBox(key=key,
+                                           encoder=nacl.encoding.HexEncoder)
+        _secret_boxes[(secret_name, key)] = secret_box
+    return secret_box
+
+
 def get_encryption_oracle(secret_name):
     """
     Return an encryption oracle for the given secret.
@@ -50,9 +66,7 @@ class _EncryptionOracle(object):
             return
 
         self.default_scheme = EncryptionScheme.SECRETBOX_WITH_STATIC_KEY
-        self._secret_box = nacl.secret.SecretBox(
-            key=config.get_required(secret_name),
-            encoder=nacl.encoding.HexEncoder)
+        self._secret_box = _get_secret_box(secret_name)
 
     def __enter__(self):
         return self
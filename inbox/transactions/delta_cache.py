@@ -0,0 +1,146 @@
+"""
+Cache of encoded delta entries, shared by all clients of a process.
+
+Several devices of the same user typically poll the delta API with the same
+cursor, so the same transactions get turned into the same API
+representations over and over. Entries are keyed by transaction id (plus the
+encoding options), which makes invalidation unnecessary: the transaction log
+is append-only, and the representation cached for a transaction is always at
+least as recent as the transaction itself. Any later change to the object
+produces a new transaction, and therefore a new key.
+
+By default entries are kept in a bounded in-process LRU. If `DELTA_CACHE_REDIS`
+is set, a Redis instance is used as a second, shared tier.
+
+"""
+import json
+
+from inbox.config import config
+from inbox.util.lru import LRUCache
+from inbox.util.stats import statsd_client
+from nylas.logging import get_logger
+log = get_logger()
+
+DELTA_CACHE_DATABASE = 3
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 3600
+
+
+def cache_key(transaction_id, object_type, expand, legacy_nsid):
+    return (transaction_id, object_type, bool(expand), bool(legacy_nsid))
+
+
+def _redis_key(key):
+    return 'delta:{}:{}:{}:{}'.format(*[int(k) if isinstance(k, bool) else k
+                                        for k in key])
+
+
+class DeltaCache(object):
+    """
+    Bounded LRU mapping cache keys (see `cache_key`) to the encoded
+    `attributes` of a delta.
+
+    Parameters
+    ----------
+    max_entries: int
+        Maximum number of entries kept in process.
+    redis_client: redis.StrictRedis, optional
+        If given, entries are also written to (and read from) Redis, with a
+        time-to-live of `ttl` seconds.
+
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, redis_client=None,
+                 ttl=DEFAULT_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self._entries = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def get_many(self, keys):
+        """ Return a dict {key: attributes} for the keys that are cached. """
+        found = {}
+        for key in keys:
+            value = self._entries.get(key)
+            if value is not None:
+                found[key] = value
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.redis_client is not None:
+            try:
+                values = self.redis_client.mget(
+                    [_redis_key(key) for key in missing])
+            except Exception:
+                log.error('Error reading from delta cache', exc_info=True)
+                values = [None] * len(missing)
+            for key, value in zip(missing, values):
+                if value is not None:
+                    found[key] = json.loads(value)
+                    self._entries.set(key, found[key])
+
+        self._record(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def set_many(self, mapping, encoder=None):
+        """
+        Cache the given {key: attributes} entries. `encoder` (an
+        `APIEncoder`) is needed to serialize entries if Redis is used.
+
+        """
+        for key, value in mapping.iteritems():
+            self._entries.set(key, value)
+
+        if mapping and self.redis_client is not None and encoder is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key, value in mapping.iteritems():
+                    pipe.setex(_redis_key(key), self.ttl,
+                               encoder.cereal(value))
+                pipe.execute()
+            except Exception:
+                log.error('Error writing to delta cache', exc_info=True)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def _record(self, hits, misses):
+        self.hits += hits
+        self.misses += misses
+        if hits:
+            statsd_client.incr('delta_cache.hit', hits)
+        if misses:
+            statsd_client.incr('delta_cache.miss', misses)
+
+
+_cache = None
+
+
+def get_delta_cache():
+    """
+    Return the process-wide `DeltaCache`, or None if caching is disabled
+    (`DELTA_CACHE_MAX_ENTRIES` set to 0).
+
+    """
+    global _cache
+    if _cache is None:
+        max_entries = int(config.get('DELTA_CACHE_MAX_ENTRIES',
+                                     DEFAULT_MAX_ENTRIES))
+        if not max_entries:
+            return None
+        redis_client = None
+        if config.get('DELTA_CACHE_REDIS'):
+            from inbox.heartbeat.config import get_redis_client
+            redis_client = get_redis_client(db=DELTA_CACHE_DATABASE)
+        _cache = DeltaCache(max_entries, redis_client,
+                            int(config.get('DELTA_CACHE_TTL', DEFAULT_TTL)))
+    return _cache
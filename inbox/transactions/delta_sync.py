@@ -9,6 +9,7 @@ from inbox.api.kellogs import APIEncoder, encode
 from inbox.models import Transaction, Message, Thread
 from inbox.models.session import session_scope
 from inbox.models.util import transaction_objects
+from inbox.transactions.delta_cache import get_delta_cache, cache_key
 from inbox.sqlalchemy_ext.util import bakery
 
 
@@ -104,7 +105,7 @@ def format_transactions_after_pointer(namespace, pointer, db_session,
                                       result_limit, exclude_types=None,
                                       include_types=None,
                                       exclude_folders=True,
-                                      legacy_nsid=False):
+                                      legacy_nsid=False, expand=False):
     """
     Return a pair (deltas, new_pointer), where deltas is a list of change
     events, represented as dictionaries:
@@ -132,6 +133,8 @@ def format_transactions_after_pointer(namespace, pointer, db_session,
         Function that defines how to format the transactions.
     exclude_types: list, optional
         If given, don't include transactions for these types of objects.
+    expand: bool, optional
+        Whether to encode objects in their expanded form.
 
     """
     exclude_types = set(exclude_types) if exclude_types else set()
@@ -146,6 +149,9 @@ def format_transactions_after_pointer(namespace, pointer, db_session,
     if last_trx == pointer:
         return ([], pointer)
 
+    delta_cache = get_delta_cache()
+    encoder = APIEncoder(namespace.public_id, expand, legacy_nsid=legacy_nsid)
+
     while True:
         # deleted_at condition included to allow this query to be satisfied via
         # the legacy index on (namespace_id, deleted_at) for performance.
@@ -191,18 +197,28 @@ def format_transactions_after_pointer(namespace, pointer, db_session,
             # one (which is what we want).
             latest_trxs = {(trx.record_id, trx.command): trx for trx in
                            sorted(trxs, key=lambda t: t.id)}.values()
-            # Load all referenced not-deleted objects.
+            # Encoded representations of some objects may already be cached
+            # by transaction id. Only load the remaining not-deleted objects.
+            keys = {trx.id: cache_key(trx.id, obj_type, expand, legacy_nsid)
+                    for trx in latest_trxs if trx.command != 'delete'}
+            cached = {}
+            if delta_cache is not None:
+                cached = delta_cache.get_many(keys.values())
             ids_to_query = [trx.record_id for trx in latest_trxs
-                            if trx.command != 'delete']
-
-            object_cls = transaction_objects()[obj_type]
-            query = db_session.query(object_cls).filter(
-                object_cls.id.in_(ids_to_query),
-                object_cls.namespace_id == namespace.id)
-            if object_cls in QUERY_OPTIONS:
-                query = query.options(*QUERY_OPTIONS[object_cls])
-            objects = {obj.id: obj for obj in query}
-
+                            if trx.command != 'delete' and
+                            keys[trx.id] not in cached]
+
+            objects = {}
+            if ids_to_query:
+                object_cls = transaction_objects()[obj_type]
+                query = db_session.query(object_cls).filter(
+                    object_cls.id.in_(ids_to_query),
+                    object_cls.namespace_id == namespace.id)
+                if object_cls in QUERY_OPTIONS:
+                    query = query.options(*QUERY_OPTIONS[object_cls])
+                objects = {obj.id: obj for obj in query}
+
+            to_cache = {}
             for trx in latest_trxs:
                 delta = {
                     'object': trx.object_type,
@@ -211,16 +227,23 @@ def format_transactions_after_pointer(namespace, pointer, db_session,
                     'cursor': trx.public_id
                 }
                 if trx.command != 'delete':
-                    obj = objects.get(trx.record_id)
-                    if obj is None:
-                        continue
-                    repr_ = encode(
-                        obj, namespace_public_id=namespace.public_id,
-                        legacy_nsid=legacy_nsid)
+                    key = keys[trx.id]
+                    repr_ = cached.get(key)
+                    if repr_ is None:
+                        obj = objects.get(trx.record_id)
+                        if obj is None:
+                            continue
+                        repr_ = encode(
+                            obj, namespace_public_id=namespace.public_id,
+                            expand=expand, legacy_nsid=legacy_nsid)
+                        to_cache[key] = repr_
                     delta['attributes'] = repr_
 
                 results.append((trx.id, delta))
 
+            if delta_cache is not None:
+                delta_cache.set_many(to_cache, encoder)
+
         if results:
             # Sort deltas by id of the underlying transactions.
             results.sort()
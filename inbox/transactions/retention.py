@@ -0,0 +1,240 @@
+"""
+Trim the transaction log so that it (and its indexes) stop growing forever.
+
+Two passes are run periodically, both in small batches keyed on the primary
+key, committing after each batch so that no long-running transaction holds
+InnoDB locks:
+
+* compaction: for transactions older than `compaction_days`, redundant
+  update transactions (ones followed by a later update of the same object in
+  the same batch) are deleted. Clients syncing from before such a row still
+  get the object's latest state from the later update. The public id of
+  each deleted row is kept as a `CompactedTransaction`, so that a delta
+  cursor pointing at it still resolves (see `compacted_cursor`).
+* expiry: transactions older than `retention_days` are deleted outright,
+  along with the `CompactedTransaction` rows of the same age.
+
+Once the log has been expired, a delta cursor that no longer resolves is
+reported to API clients as expired if it may have pointed into the expired
+part of the namespace's log (see `log_trimmed`), and the client has to
+resync from a fresh cursor.
+
+"""
+from datetime import datetime, timedelta
+from itertools import takewhile
+
+import gevent
+from gevent import Greenlet
+from sqlalchemy import asc
+
+from nylas.logging import get_logger
+log = get_logger()
+from inbox.config import config
+from inbox.models import Transaction, SearchIndexCursor
+from inbox.models.transaction import (TransactionLogHorizon,
+                                      CompactedTransaction)
+from inbox.models.session import session_scope
+from inbox.util.stats import statsd_client
+
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_COMPACTION_DAYS = 7
+
+
+def compacted_cursor(db_session, namespace_id, cursor):
+    """
+    Return the id of the transaction `cursor` pointed to if it was removed
+    by compaction, or None. Syncing from that id is equivalent to syncing
+    from the removed transaction.
+
+    """
+    row = db_session.query(CompactedTransaction.transaction_id).filter(
+        CompactedTransaction.namespace_id == namespace_id,
+        CompactedTransaction.public_id == cursor).first()
+    return row[0] if row is not None else None
+
+
+def log_trimmed(db_session, namespace, cursor):
+    """
+    Return True if `cursor`, which can't be found, may have pointed to a
+    transaction of `namespace` that has since been expired. Cursors that
+    aren't well-formed ids, or that belong to namespaces created after the
+    expired part of the log, were never valid.
+
+    """
+    try:
+        if not 0 <= int(cursor, 36) < 2 ** 128:
+            return False
+    except (TypeError, ValueError):
+        return False
+    horizon = db_session.query(TransactionLogHorizon).first()
+    return horizon is not None and horizon.expired_before is not None and \
+        namespace.created_at < horizon.expired_before
+
+
+def _get_horizon(db_session):
+    horizon = db_session.query(TransactionLogHorizon).first()
+    if horizon is None:
+        horizon = TransactionLogHorizon(expired_through_id=0,
+                                        compacted_through_id=0)
+        db_session.add(horizon)
+    return horizon
+
+
+def _protected_ids(db_session):
+    # Transactions referenced by a foreign key can't be deleted.
+    return {id_ for id_, in
+            db_session.query(SearchIndexCursor.transaction_id)
+            if id_ is not None}
+
+
+class TransactionRetentionService(Greenlet):
+    """
+    Periodically compact and expire old transactions for all namespaces.
+
+    Parameters
+    ----------
+    retention_days: int
+        Transactions older than this are deleted.
+    compaction_days: int
+        Redundant update transactions older than this are deleted.
+    batch_size: int
+        Number of transactions examined per database transaction.
+    batch_interval: float
+        Seconds to sleep between batches, to throttle load on the database.
+    poll_interval: float
+        Seconds to sleep between runs.
+
+    """
+    def __init__(self, retention_days=None, compaction_days=None,
+                 batch_size=1000, batch_interval=0.5, poll_interval=3600):
+        if retention_days is None:
+            retention_days = config.get('TRANSACTION_RETENTION_DAYS',
+                                        DEFAULT_RETENTION_DAYS)
+        if compaction_days is None:
+            compaction_days = config.get('TRANSACTION_COMPACTION_DAYS',
+                                         DEFAULT_COMPACTION_DAYS)
+        assert compaction_days <= retention_days
+        self.retention = timedelta(days=retention_days)
+        self.compaction = timedelta(days=compaction_days)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.poll_interval = poll_interval
+        self.log = log.new(component='transaction-retention')
+        Greenlet.__init__(self)
+
+    def _run(self):
+        self.log.info('Starting transaction retention service',
+                      retention_days=self.retention.days,
+                      compaction_days=self.compaction.days)
+        while True:
+            self.run_once()
+            gevent.sleep(self.poll_interval)
+
+    def run_once(self, current_time=None):
+        """ Run both passes. Returns the number of rows reclaimed. """
+        current_time = current_time or datetime.utcnow()
+        compacted = self.compact(current_time - self.compaction)
+        expired = self.expire(current_time - self.retention)
+        self.log.info('Trimmed transaction log', compacted=compacted,
+                      expired=expired)
+        return compacted + expired
+
+    def compact(self, cutoff):
+        """
+        Delete update transactions created before `cutoff` that are
+        superseded by a later update to the same object within the same
+        batch. Resumes from `TransactionLogHorizon.compacted_through_id`.
+
+        """
+        total = 0
+        while True:
+            with session_scope() as db_session:
+                horizon = _get_horizon(db_session)
+                rows = db_session.query(
+                    Transaction.id, Transaction.public_id,
+                    Transaction.namespace_id, Transaction.object_type,
+                    Transaction.record_id, Transaction.command,
+                    Transaction.created_at). \
+                    filter(Transaction.id > horizon.compacted_through_id). \
+                    order_by(asc(Transaction.id)). \
+                    limit(self.batch_size).all()
+                rows = list(takewhile(lambda row: row.created_at < cutoff,
+                                      rows))
+                if not rows:
+                    db_session.commit()
+                    return total
+
+                protected = _protected_ids(db_session)
+                latest_update = {}
+                redundant = []
+                for row in rows:
+                    if row.command != 'update':
+                        continue
+                    key = (row.object_type, row.record_id)
+                    if key in latest_update and \
+                            latest_update[key].id not in protected:
+                        redundant.append(latest_update[key])
+                    latest_update[key] = row
+
+                if redundant:
+                    table = CompactedTransaction.__table__
+                    db_session.execute(table.insert(), [
+                        {'public_id': row.public_id,
+                         'namespace_id': row.namespace_id,
+                         'transaction_id': row.id,
+                         'created_at': row.created_at,
+                         'updated_at': row.created_at}
+                        for row in redundant])
+                    db_session.query(Transaction).filter(
+                        Transaction.id.in_([row.id for row in redundant])). \
+                        delete(synchronize_session=False)
+                horizon.compacted_through_id = rows[-1].id
+                db_session.commit()
+
+            total += len(redundant)
+            statsd_client.incr('transaction_retention.compacted',
+                               len(redundant))
+            gevent.sleep(self.batch_interval)
+
+    def expire(self, cutoff):
+        """
+        Delete all transactions, and records of compacted transactions,
+        created before `cutoff`.
+
+        """
+        total = 0
+        while True:
+            with session_scope() as db_session:
+                horizon = _get_horizon(db_session)
+                protected = _protected_ids(db_session)
+                query = db_session.query(Transaction.id). \
+                    filter(Transaction.created_at < cutoff)
+                if protected:
+                    query = query.filter(~Transaction.id.in_(protected))
+                ids = [id_ for id_, in query.limit(self.batch_size)]
+                compacted_ids = [
+                    id_ for id_, in db_session.query(CompactedTransaction.id).
+                    filter(CompactedTransaction.created_at < cutoff).
+                    limit(self.batch_size)]
+                if not ids and not compacted_ids:
+                    db_session.commit()
+                    return total
+
+                if ids:
+                    db_session.query(Transaction).filter(
+                        Transaction.id.in_(ids)).delete(
+                            synchronize_session=False)
+                    horizon.expired_through_id = max(
+                        horizon.expired_through_id, max(ids))
+                    if horizon.expired_before is None or \
+                            horizon.expired_before < cutoff:
+                        horizon.expired_before = cutoff
+                if compacted_ids:
+                    db_session.query(CompactedTransaction).filter(
+                        CompactedTransaction.id.in_(compacted_ids)).delete(
+                            synchronize_session=False)
+                db_session.commit()
+
+            total += len(ids)
+            statsd_client.incr('transaction_retention.expired', len(ids))
+            gevent.sleep(self.batch_interval)
@@ -11,13 +11,15 @@ from inbox.models.session import session_scope
 from inbox.models.util import transaction_objects
 from inbox.models.search import SearchIndexCursor
 from inbox.search.adaptor import NamespaceSearchEngine
+from inbox.transactions.delta_sync import QUERY_OPTIONS
 
 
 class SearchIndexService(Greenlet):
     """
     Poll the transaction log for message, thread operations
     (inserts, updates, deletes) for all namespaces and perform the
-    corresponding Elasticsearch index operations.
+    corresponding operations on their local search index (see
+    inbox.search.adaptor).
 
     """
     def __init__(self, poll_interval=30, chunk_size=100):
@@ -30,7 +32,7 @@ class SearchIndexService(Greenlet):
 
     def _run(self):
         """
-        Index into Elasticsearch the threads, messages of all namespaces.
+        Index the threads, messages of all namespaces.
 
         """
         with session_scope() as db_session:
@@ -41,35 +43,66 @@ class SearchIndexService(Greenlet):
                       transaction_pointer=self.transaction_pointer)
 
         while True:
-            with session_scope() as db_session:
-                transactions = db_session.query(Transaction). \
-                    filter(Transaction.id > self.transaction_pointer,
-                           or_(Transaction.object_type == 'message',
-                               Transaction.object_type == 'thread')). \
-                    order_by(asc(Transaction.id)). \
-                    limit(self.chunk_size). \
-                    options(joinedload(Transaction.namespace)).all()
-
-                # TODO[k]: We ideally want to index chunk_size at a time.
-                # This currently indexes <= chunk_size, and it varies each
-                # time.
-                if transactions:
-                    self.index(transactions, db_session)
-                    new_pointer = transactions[-1].id
-                    self.update_pointer(new_pointer, db_session)
-                else:
-                    sleep(self.poll_interval)
-                db_session.commit()
+            if not self.index_batch():
+                sleep(self.poll_interval)
 
-    def index(self, transactions, db_session):
+    def index_batch(self):
         """
-        Translate database operations to Elasticsearch index operations
-        and perform them.
+        Index the objects of the next chunk_size message, thread transactions
+        and advance the pointer past them, committing the new pointer in one
+        database transaction. Returns the number of transactions processed.
+
+        Indexing is idempotent, so if the pointer can't be committed the same
+        transactions are simply indexed again.
 
         """
-        namespace_map = defaultdict(lambda: defaultdict(list))
+        with session_scope() as db_session:
+            transactions = db_session.query(Transaction). \
+                filter(Transaction.id > self.transaction_pointer,
+                       or_(Transaction.object_type == 'message',
+                           Transaction.object_type == 'thread')). \
+                order_by(asc(Transaction.id)). \
+                limit(self.chunk_size). \
+                options(joinedload(Transaction.namespace)).all()
+            if not transactions:
+                return 0
+
+            self.index(transactions, db_session)
+            new_pointer = transactions[-1].id
+            self.update_pointer(new_pointer, db_session)
+            db_session.commit()
+        self.transaction_pointer = new_pointer
+        return len(transactions)
 
+    def index(self, transactions, db_session):
+        """
+        Translate database operations to search index operations and perform
+        them.
+
+        """
+        # Only the latest transaction for each object matters, since it's
+        # the object's current state that gets indexed.
+        latest = {}
         for trx in transactions:
+            latest[(trx.object_type, trx.record_id)] = trx
+        latest = sorted(latest.values(), key=lambda trx: trx.id)
+
+        # Load the objects to index with one query per type.
+        ids_by_type = defaultdict(list)
+        for trx in latest:
+            if trx.command != 'delete':
+                ids_by_type[trx.object_type].append(trx.record_id)
+        objects = {}
+        for type_, ids in ids_by_type.iteritems():
+            object_cls = transaction_objects()[type_]
+            query = db_session.query(object_cls).filter(
+                object_cls.id.in_(ids))
+            if object_cls in QUERY_OPTIONS:
+                query = query.options(*QUERY_OPTIONS[object_cls])
+            objects[type_] = {obj.id: obj for obj in query}
+
+        namespace_map = defaultdict(lambda: defaultdict(list))
+        for trx in latest:
             namespace_id = trx.namespace.public_id
             type_ = trx.object_type
             if trx.command == 'delete':
@@ -77,8 +110,7 @@ class SearchIndexService(Greenlet):
                 api_repr = {'id': trx.object_public_id}
             else:
                 operation = 'index'
-                object_cls = transaction_objects()[trx.object_type]
-                obj = db_session.query(object_cls).get(trx.record_id)
+                obj = objects[type_].get(trx.record_id)
                 if obj is None:
                     continue
                 api_repr = encode(obj, namespace_public_id=namespace_id)
@@ -89,14 +121,16 @@ class SearchIndexService(Greenlet):
 
         for namespace_id in namespace_map:
             engine = NamespaceSearchEngine(namespace_id, create_index=True)
+            try:
+                messages = namespace_map[namespace_id]['message']
+                message_count = engine.messages.bulk_index(messages) \
+                    if messages else 0
 
-            messages = namespace_map[namespace_id]['message']
-            message_count = engine.messages.bulk_index(messages) if messages \
-                else 0
-
-            threads = namespace_map[namespace_id]['thread']
-            thread_count = engine.threads.bulk_index(threads) if threads \
-                else 0
+                threads = namespace_map[namespace_id]['thread']
+                thread_count = engine.threads.bulk_index(threads) \
+                    if threads else 0
+            finally:
+                engine.close()
 
             self.log.info('per-namespace index counts',
                           namespace_id=namespace_id,
@@ -105,8 +139,8 @@ class SearchIndexService(Greenlet):
 
     def update_pointer(self, new_pointer, db_session):
         """
-        Persist transaction pointer to support restarts, update
-        self.transaction_pointer.
+        Persist transaction pointer to support restarts. The caller commits
+        it and updates self.transaction_pointer.
 
         """
         pointer = db_session.query(SearchIndexCursor).first()
@@ -114,4 +148,3 @@ class SearchIndexService(Greenlet):
             pointer = SearchIndexCursor()
             db_session.add(pointer)
         pointer.transaction_id = new_pointer
-        self.transaction_pointer = new_pointer
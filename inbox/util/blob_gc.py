@@ -0,0 +1,118 @@
+"""
+Reclaim storage of blobs that no block or message refers to anymore.
+
+Blobs are content-addressed and shared between all namespaces, so deleting a
+block can't delete its data. Instead, garbage is collected by mark and
+sweep:
+
+* mark: load the hashes referenced by `block.data_sha256` and
+  `message.data_sha256`.
+* sweep: list the blobs in S3 or in the directory layout, and delete the
+  unreferenced ones in batches. Packfile segments that are mostly garbage
+  are compacted.
+
+Blob data is written before the row referring to it is committed, and an
+unreferenced blob can be picked up again by a new block with the same
+content. So only blobs that haven't been modified for `grace_period` are
+collected, and each batch is checked against the database again, then each
+blob's last modified time is looked up again, right before it is deleted.
+Writing a blob that already exists bumps its last modified time, and S3
+clients only skip writes of blobs they wrote within `S3_KNOWN_KEY_TTL`,
+which must be well below the grace period; so a blob that a new block
+refers to has been modified too recently to be collected, even if it was
+listed before the block was written.
+
+"""
+from datetime import datetime, timedelta
+
+from nylas.logging import get_logger
+log = get_logger()
+from inbox.models.block import referenced_blob_hashes
+from inbox.models.roles import (STORE_MSG_ON_S3, list_stored_blobs,
+                                stored_blob_last_modified,
+                                delete_stored_blobs)
+from inbox.models.session import session_scope
+from inbox.util.packfile import get_pack_store, pack_threshold
+from inbox.util.stats import statsd_client
+
+DEFAULT_GRACE_PERIOD = timedelta(days=1)
+
+
+class BlobCollector(object):
+    """
+    Parameters
+    ----------
+    grace_period: datetime.timedelta
+        Blobs modified more recently than this are never deleted.
+    batch_size: int
+        Number of blobs deleted at a time.
+    dry_run: bool
+        If set, only report what would be deleted.
+
+    """
+    def __init__(self, grace_period=DEFAULT_GRACE_PERIOD, batch_size=1000,
+                 dry_run=False):
+        self.grace_period = grace_period
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.log = log.new(component='blob-gc', dry_run=dry_run)
+
+    def run(self):
+        """ Collect garbage once. Returns (blobs deleted, bytes reclaimed).
+        """
+        cutoff = datetime.utcnow() - self.grace_period
+        with session_scope() as db_session:
+            referenced = referenced_blob_hashes(db_session)
+        self.log.info('Loaded referenced blob hashes', count=len(referenced))
+
+        deleted = reclaimed = 0
+        batch = {}
+        for data_sha256, size, last_modified in list_stored_blobs():
+            if data_sha256 in referenced or last_modified > cutoff:
+                continue
+            batch[data_sha256] = size
+            if len(batch) == self.batch_size:
+                count, nbytes = self._delete(batch, cutoff)
+                deleted += count
+                reclaimed += nbytes
+                batch = {}
+        count, nbytes = self._delete(batch, cutoff)
+        deleted += count
+        reclaimed += nbytes
+
+        if not STORE_MSG_ON_S3 and pack_threshold():
+            reclaimed += get_pack_store().compact(
+                self._referenced_among, grace_period=self.grace_period,
+                dry_run=self.dry_run)
+
+        self.log.info('Collected unreferenced blobs', deleted=deleted,
+                      reclaimed_bytes=reclaimed)
+        return deleted, reclaimed
+
+    def _modified_since(self, data_sha256, cutoff):
+        last_modified = stored_blob_last_modified(data_sha256)
+        return last_modified is not None and last_modified > cutoff
+
+    def _referenced_among(self, hashes):
+        with session_scope() as db_session:
+            return referenced_blob_hashes(db_session, among=list(hashes))
+
+    def _delete(self, batch, cutoff):
+        if not batch:
+            return 0, 0
+        # Blocks created since the mark phase may refer to some of them,
+        # and blobs may have been written again since they were listed.
+        candidates = set(batch) - self._referenced_among(batch)
+        candidates = {data_sha256 for data_sha256 in candidates
+                      if not self._modified_since(data_sha256, cutoff)}
+        if self.dry_run:
+            deleted = candidates
+        else:
+            deleted = delete_stored_blobs(sorted(candidates))
+        nbytes = sum(batch[data_sha256] for data_sha256 in deleted)
+        self.log.info('Deleted unreferenced blobs', count=len(deleted),
+                      reclaimed_bytes=nbytes)
+        if not self.dry_run:
+            statsd_client.incr('blob_gc.deleted', len(deleted))
+            statsd_client.incr('blob_gc.reclaimed_bytes', nbytes)
+        return len(deleted), nbytes
@@ -0,0 +1,116 @@
+"""
+Check stored blob data against its sha256 in the background.
+
+Unless `BLOB_VERIFY` is 'always', corrupted blob data can be served without
+anybody noticing. The scrubber walks all blocks in id order, reads their data
+from S3 or disk (never from the read-through cache) and reports blocks whose
+data is missing or doesn't match its hash. Reads are throttled to
+`BLOB_SCRUB_BYTES_PER_SECOND`, so that scrubbing doesn't compete with sync and
+the API for I/O.
+
+"""
+from collections import Counter
+from hashlib import sha256
+
+import gevent
+from gevent import Greenlet
+
+from nylas.logging import get_logger
+log = get_logger()
+from inbox.config import config
+from inbox.models.block import Block
+from inbox.models.roles import iter_stored_data
+from inbox.models.session import session_scope
+from inbox.util.stats import statsd_client
+
+DEFAULT_BYTES_PER_SECOND = 1024 * 1024
+
+
+class BlobScrubber(Greenlet):
+    """
+    Periodically verify the data of all blocks.
+
+    Parameters
+    ----------
+    bytes_per_second: int
+        Maximum rate at which blob data is read.
+    batch_size: int
+        Number of blocks loaded per database query.
+    poll_interval: float
+        Seconds to sleep between runs.
+
+    """
+    def __init__(self, bytes_per_second=None, batch_size=100,
+                 poll_interval=24 * 3600):
+        if bytes_per_second is None:
+            bytes_per_second = config.get('BLOB_SCRUB_BYTES_PER_SECOND',
+                                          DEFAULT_BYTES_PER_SECOND)
+        self.bytes_per_second = bytes_per_second
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.log = log.new(component='blob-scrubber')
+        Greenlet.__init__(self)
+
+    def _run(self):
+        self.log.info('Starting blob scrubber',
+                      bytes_per_second=self.bytes_per_second)
+        while True:
+            self.run_once()
+            gevent.sleep(self.poll_interval)
+
+    def run_once(self, start_id=0):
+        """
+        Verify the data of all blocks with an id greater than `start_id`.
+        Returns a Counter of the results of `scrub`.
+
+        """
+        results = Counter()
+        cursor = start_id
+        while True:
+            with session_scope() as db_session:
+                rows = db_session.query(
+                    Block.id, Block.data_sha256, Block.size). \
+                    filter(Block.id > cursor, Block.size > 0). \
+                    order_by(Block.id).limit(self.batch_size).all()
+            if not rows:
+                break
+            cursor = rows[-1].id
+
+            # Blocks with the same hash share their stored data.
+            scrubbed = {}
+            for row in rows:
+                if row.data_sha256 not in scrubbed:
+                    scrubbed[row.data_sha256] = self.scrub(row.data_sha256,
+                                                           row.size)
+                result = scrubbed[row.data_sha256]
+                results[result] += 1
+                if result != 'ok':
+                    self.log.error('Blob data is {}'.format(result),
+                                   block_id=row.id,
+                                   data_sha256=row.data_sha256)
+
+        self.log.info('Scrubbed blobs', **results)
+        return results
+
+    def scrub(self, data_sha256, size):
+        """
+        Read the stored data for data_sha256 and return 'ok', 'missing' or
+        'corrupted'.
+
+        """
+        digest = sha256()
+        read = 0
+        for chunk in iter_stored_data(data_sha256, size):
+            digest.update(chunk)
+            read += len(chunk)
+            gevent.sleep(float(len(chunk)) / self.bytes_per_second)
+        statsd_client.incr('blob_scrubber.bytes', read)
+
+        if read == 0:
+            result = 'missing'
+        elif read != size or digest.hexdigest() != data_sha256:
+            result = 'corrupted'
+        else:
+            result = 'ok'
+        statsd_client.incr('blob_scrubber.{}'.format(result))
+        return result
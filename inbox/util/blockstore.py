@@ -0,0 +1,727 @@
+"""
+Process-wide client for the S3 bucket that blob data (message parts and raw
+messages) is stored in, keyed by sha256.
+
+A single `S3Connection` is created per process and reused, so that boto's
+connection pool keeps TLS connections to S3 open between calls. Requests are
+limited to `S3_MAX_CONCURRENCY` at a time, and failed uploads are retried up
+to `S3_UPLOAD_RETRIES` times.
+
+Because blobs are content-addressed, a key that exists never has to be
+written again. The client remembers (in a bounded LRU) the hashes it has
+uploaded in this process, and skips both the existence check and the upload
+for them for `S3_KNOWN_KEY_TTL` seconds. A key that already exists is copied
+onto itself, which bumps its last modified time: garbage collection (see
+inbox/util/blob_gc.py) only deletes keys that haven't been modified for its
+grace period, so it never deletes a key that a process has just written or
+still skips writing. The TTL must be well below the grace period.
+
+`S3_HOST`, `S3_PORT` and `S3_IS_SECURE` can be set to point the client at a
+local S3-compatible server instead of AWS.
+
+If `BLOB_CACHE_DIRECTORY` is set, blobs read from S3 are also kept in a
+size-bounded on-disk cache (see `DiskBlobCache`) that all processes on a host
+share, and later reads are served from there.
+
+`BLOB_VERIFY` sets how often blob data is checked against its sha256 when it
+is read (see `should_verify`).
+
+If `BLOB_STAGING_DIRECTORY` is set, blobs are written to S3 asynchronously
+(see `WriteBehindUploader`).
+
+"""
+import os
+import re
+import random
+import tempfile
+import time
+from collections import OrderedDict
+from datetime import datetime
+from email.utils import parsedate
+from hashlib import sha256
+
+import gevent
+from gevent.coros import BoundedSemaphore
+from gevent.queue import Queue
+
+from inbox.config import config
+from inbox.util.file import Lock, mkdirp
+from inbox.util.stats import statsd_client
+from nylas.logging import get_logger
+log = get_logger()
+
+DEFAULT_MAX_CONCURRENCY = 20
+DEFAULT_UPLOAD_RETRIES = 3
+DEFAULT_RETRY_DELAY = 0.5
+DEFAULT_MAX_KNOWN_KEYS = 100000
+DEFAULT_KNOWN_KEY_TTL = 3600
+DEFAULT_CACHE_SIZE_MB = 1024
+DEFAULT_VERIFY_SAMPLE_PERCENT = 1
+DEFAULT_UPLOAD_QUEUE_SIZE = 1000
+DEFAULT_UPLOAD_WORKERS = 10
+DEFAULT_UPLOAD_RETRY_DELAY = 30
+
+BLOB_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+VERIFY_POLICIES = ('always', 'sampled', 'fill', 'never')
+
+
+def should_verify(fill=False):
+    """
+    Whether blob data that is being read should be checked against its
+    sha256, according to the `BLOB_VERIFY` policy:
+
+    * always: on every read (the default).
+    * sampled: on `BLOB_VERIFY_SAMPLE_PERCENT` percent of reads.
+    * fill: only when the data is added to the read-through cache, which
+      is what `fill` says. Data served from the cache, or from local disk,
+      isn't checked.
+    * never.
+
+    Stored data is still checked over time by the blob scrubber.
+
+    """
+    policy = config.get('BLOB_VERIFY', 'always')
+    assert policy in VERIFY_POLICIES, \
+        'Unknown BLOB_VERIFY policy {}'.format(policy)
+    if policy == 'always':
+        return True
+    if policy == 'sampled':
+        percent = float(config.get('BLOB_VERIFY_SAMPLE_PERCENT',
+                                   DEFAULT_VERIFY_SAMPLE_PERCENT))
+        return random.random() * 100 < percent
+    if policy == 'fill':
+        return fill
+    return False
+
+
+class S3BlobClient(object):
+    """
+    Parameters
+    ----------
+    bucket_name: str
+        The bucket blobs are stored in.
+    max_concurrency: int
+        Maximum number of S3 requests in flight at a time in this process.
+    upload_retries: int
+        Number of times a failed upload is retried before giving up.
+    retry_delay: float
+        Seconds to wait before the first retry; doubled for each later one.
+    max_known_keys: int
+        Number of hashes remembered as present in the bucket.
+    known_key_ttl: float
+        Seconds for which a hash is remembered after its key was written.
+    connection_kwargs:
+        Passed on to `boto.s3.connection.S3Connection`.
+
+    """
+    def __init__(self, bucket_name, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 upload_retries=DEFAULT_UPLOAD_RETRIES,
+                 retry_delay=DEFAULT_RETRY_DELAY,
+                 max_known_keys=DEFAULT_MAX_KNOWN_KEYS,
+                 known_key_ttl=DEFAULT_KNOWN_KEY_TTL, **connection_kwargs):
+        self.bucket_name = bucket_name
+        self.upload_retries = upload_retries
+        self.retry_delay = retry_delay
+        self.max_known_keys = max_known_keys
+        self.known_key_ttl = known_key_ttl
+        self.connection_kwargs = connection_kwargs
+        self._semaphore = BoundedSemaphore(max_concurrency)
+        self._known_keys = OrderedDict()
+        self._bucket = None
+        self._pid = None
+
+    @property
+    def bucket(self):
+        # Connections can't be shared with a forked child process.
+        if self._bucket is None or self._pid != os.getpid():
+            from boto.s3.connection import S3Connection
+            conn = S3Connection(**self.connection_kwargs)
+            self._bucket = conn.get_bucket(self.bucket_name, validate=False)
+            self._pid = os.getpid()
+        return self._bucket
+
+    def is_known(self, data_sha256):
+        written_at = self._known_keys.pop(data_sha256, None)
+        if written_at is None or \
+                time.time() - written_at > self.known_key_ttl:
+            return False
+        # Re-insert to mark as most recently used.
+        self._known_keys[data_sha256] = written_at
+        return True
+
+    def _remember(self, data_sha256):
+        """ Remember that the key data_sha256 has just been written. """
+        self._known_keys.pop(data_sha256, None)
+        self._known_keys[data_sha256] = time.time()
+        while len(self._known_keys) > self.max_known_keys:
+            self._known_keys.popitem(last=False)
+
+    def forget(self, data_sha256):
+        self._known_keys.pop(data_sha256, None)
+
+    def put(self, data_sha256, data):
+        """ Store data under the key data_sha256, unless it's already there.
+        """
+        if self.is_known(data_sha256):
+            statsd_client.incr('blockstore.s3.put.skipped')
+            return
+
+        with self._semaphore:
+            # See if it already exists; if so, don't recreate, but mark it
+            # as recently written so that it isn't garbage-collected.
+            if self.bucket.get_key(data_sha256) is None:
+                self._upload(data_sha256, data)
+            else:
+                self._touch(data_sha256)
+                statsd_client.incr('blockstore.s3.put.exists')
+        self._remember(data_sha256)
+
+    def _touch(self, data_sha256):
+        # S3 only allows copying a key onto itself if its metadata is
+        # replaced.
+        self.bucket.copy_key(data_sha256, self.bucket_name, data_sha256,
+                             metadata={'touched': str(int(time.time()))})
+
+    def _upload(self, data_sha256, data):
+        from boto.s3.key import Key
+        delay = self.retry_delay
+        for attempt in range(self.upload_retries + 1):
+            try:
+                key = Key(self.bucket)
+                key.key = data_sha256
+                key.set_contents_from_string(data)
+                return
+            except Exception:
+                if attempt == self.upload_retries:
+                    statsd_client.incr('blockstore.s3.put.failed')
+                    raise
+                log.warning('Error uploading blob, retrying',
+                            data_sha256=data_sha256, attempt=attempt + 1,
+                            exc_info=True)
+                statsd_client.incr('blockstore.s3.put.retried')
+                gevent.sleep(delay)
+                delay *= 2
+
+    def get(self, data_sha256):
+        """ Return the data stored under data_sha256, or None. """
+        from boto.exception import S3ResponseError
+        with self._semaphore:
+            # Don't check that the key exists first: that's a HEAD request
+            # for every GET, and a missing key makes the GET fail anyway.
+            key = self.bucket.get_key(data_sha256, validate=False)
+            try:
+                data = key.get_contents_as_string()
+            except S3ResponseError as e:
+                if e.status != 404:
+                    raise
+                self._missing(data_sha256)
+                return None
+        return data
+
+    def _missing(self, data_sha256):
+        self.forget(data_sha256)
+        log.error('No key with name: {} returned!'.format(data_sha256))
+
+    def last_modified(self, data_sha256):
+        """
+        Return the last modified datetime of the key data_sha256, or None if
+        there's no such key.
+
+        """
+        with self._semaphore:
+            key = self.bucket.get_key(data_sha256)
+        if key is None:
+            return None
+        return datetime(*parsedate(key.last_modified)[:6])
+
+    def list(self):
+        """ Yield (key name, size, last modified datetime) for all keys. """
+        from boto.utils import parse_ts
+        for key in self.bucket.list():
+            yield key.name, key.size, parse_ts(key.last_modified)
+
+    def delete_many(self, names):
+        """ Delete the given keys. Returns the names of those deleted. """
+        for name in names:
+            self.forget(name)
+        with self._semaphore:
+            result = self.bucket.delete_keys(names, quiet=False)
+        for error in result.errors:
+            log.error('Error deleting blob', data_sha256=error.key,
+                      code=error.code, message=error.message)
+        return [deleted.key for deleted in result.deleted]
+
+    def iter_range(self, data_sha256, start, end, chunk_size):
+        """
+        Yield bytes start to end - 1 of the data stored under data_sha256 in
+        chunks of up to chunk_size bytes. Yields nothing if there's no such
+        key.
+
+        """
+        from boto.exception import S3ResponseError
+        # Only opening the key counts against the concurrency limit, so that
+        # slow consumers of the iterator can't starve everybody else.
+        with self._semaphore:
+            key = self.bucket.get_key(data_sha256, validate=False)
+            try:
+                key.open_read(
+                    headers={'Range': 'bytes={}-{}'.format(start, end - 1)})
+            except S3ResponseError as e:
+                if e.status != 404:
+                    raise
+                self._missing(data_sha256)
+                return
+
+        try:
+            while True:
+                chunk = key.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            key.close()
+
+
+_s3_client = None
+
+
+def get_s3_client():
+    """ Return the process-wide `S3BlobClient`. """
+    global _s3_client
+    if _s3_client is None:
+        assert 'AWS_ACCESS_KEY_ID' in config, 'Need AWS key!'
+        assert 'AWS_SECRET_ACCESS_KEY' in config, 'Need AWS secret!'
+        assert 'MESSAGE_STORE_BUCKET_NAME' in config, \
+            'Need bucket name to store message data!'
+
+        connection_kwargs = {
+            'aws_access_key_id': config.get('AWS_ACCESS_KEY_ID'),
+            'aws_secret_access_key': config.get('AWS_SECRET_ACCESS_KEY')}
+        if config.get('S3_HOST'):
+            from boto.s3.connection import OrdinaryCallingFormat
+            connection_kwargs.update(
+                host=config.get('S3_HOST'),
+                port=config.get('S3_PORT'),
+                is_secure=config.get('S3_IS_SECURE', True),
+                calling_format=OrdinaryCallingFormat())
+
+        _s3_client = S3BlobClient(
+            config.get('MESSAGE_STORE_BUCKET_NAME'),
+            max_concurrency=int(config.get('S3_MAX_CONCURRENCY',
+                                           DEFAULT_MAX_CONCURRENCY)),
+            upload_retries=int(config.get('S3_UPLOAD_RETRIES',
+                                          DEFAULT_UPLOAD_RETRIES)),
+            known_key_ttl=float(config.get('S3_KNOWN_KEY_TTL',
+                                           DEFAULT_KNOWN_KEY_TTL)),
+            **connection_kwargs)
+    return _s3_client
+
+
+class DiskBlobCache(object):
+    """
+    Size-bounded LRU cache of blob data on local disk, keyed by sha256.
+
+    Each blob is stored in its own file. Fills write to a temporary file
+    that is then renamed into place, so that concurrent fills of the same
+    blob (from any process) are safe and readers never see partial data.
+    A hit bumps the file's modification time, which eviction uses as the
+    recency order.
+
+    Eviction runs whenever about a tenth of the capacity has been filled by
+    this process since the last run. It takes a non-blocking lock on the
+    cache directory, so only one process evicts at a time, and removes the
+    least recently used files until the cache is down to 90% of capacity.
+
+    Parameters
+    ----------
+    directory: str
+        Where to keep cached blobs.
+    capacity: int
+        Maximum size of the cache in bytes.
+
+    """
+    def __init__(self, directory, capacity):
+        self.directory = directory
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._filled_since_eviction = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def _path(self, data_sha256):
+        return os.path.join(self.directory, data_sha256[:2], data_sha256)
+
+    def _open(self, data_sha256):
+        try:
+            f = open(self._path(data_sha256), 'rb')
+        except IOError:
+            self._record(hit=False)
+            return None
+        try:
+            os.utime(f.name, None)
+        except OSError:
+            pass
+        self._record(hit=True)
+        return f
+
+    def get(self, data_sha256):
+        """ Return the cached data for data_sha256, or None. """
+        f = self._open(data_sha256)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def iter_range(self, data_sha256, start, end, chunk_size):
+        """
+        Return an iterator over bytes start to end - 1 of the cached data for
+        data_sha256, or None if it isn't cached.
+
+        """
+        f = self._open(data_sha256)
+        if f is None:
+            return None
+        return iter_file(f, start, end, chunk_size)
+
+    def put(self, data_sha256, data):
+        """
+        Add data to the cache, unless it doesn't match data_sha256 (we don't
+        want to keep serving corrupted data). Whether that is checked depends
+        on the `BLOB_VERIFY` policy.
+
+        """
+        for _ in self.filling(data_sha256, [data], len(data)):
+            pass
+
+    def filling(self, data_sha256, chunks, expected_size):
+        """
+        Pass through the given iterator over all of the data for
+        data_sha256, adding the data to the cache once it has been read
+        completely (and only if it matches data_sha256, see `put`). Data
+        that isn't `expected_size` bytes long is never cached, so a missing
+        or truncated blob can't be cached even when hashes aren't checked.
+
+        """
+        verify = should_verify(fill=True)
+        path = self._path(data_sha256)
+        directory = os.path.dirname(path)
+        try:
+            mkdirp(directory)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+            f = os.fdopen(fd, 'wb')
+        except (IOError, OSError):
+            log.error('Error filling blob cache', data_sha256=data_sha256,
+                      exc_info=True)
+            for chunk in chunks:
+                yield chunk
+            return
+
+        digest = sha256()
+        size = 0
+        complete = False
+        try:
+            for chunk in chunks:
+                if verify:
+                    digest.update(chunk)
+                size += len(chunk)
+                if f is not None:
+                    try:
+                        f.write(chunk)
+                    except (IOError, OSError):
+                        # A full cache disk mustn't break reads.
+                        log.error('Error filling blob cache',
+                                  data_sha256=data_sha256, exc_info=True)
+                        f.close()
+                        f = None
+                yield chunk
+            if f is None:
+                return
+            f.close()
+            if size == 0 or size != expected_size:
+                log.error("Not caching blob that doesn't have the expected "
+                          "size", data_sha256=data_sha256, size=size,
+                          expected_size=expected_size)
+                statsd_client.incr('blockstore.cache.size_mismatch')
+                return
+            if verify and digest.hexdigest() != data_sha256:
+                log.error("Not caching blob that doesn't match its hash",
+                          data_sha256=data_sha256)
+                statsd_client.incr('blockstore.verify.mismatch')
+                return
+            os.rename(tmp_path, path)
+            complete = True
+        finally:
+            if f is not None:
+                f.close()
+            if not complete:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+        self._filled_since_eviction += size
+        if self._filled_since_eviction > self.capacity // 10:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used blobs until the cache is down to 90% of
+        its capacity. Returns the number of blobs removed.
+
+        """
+        self._filled_since_eviction = 0
+        try:
+            lock = Lock(os.path.join(self.directory, '.lock'), block=False)
+            lock.acquire()
+        except IOError:
+            # Some other process is already evicting.
+            return 0
+
+        try:
+            entries = []
+            total = 0
+            for dirpath, _, filenames in os.walk(self.directory):
+                for filename in filenames:
+                    if filename.startswith('.'):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            if total <= self.capacity:
+                return 0
+            target = self.capacity * 9 // 10
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        finally:
+            lock.release()
+
+        self.evictions += removed
+        statsd_client.incr('blockstore.cache.evicted', removed)
+        return removed
+
+    def _record(self, hit):
+        if hit:
+            self.hits += 1
+            statsd_client.incr('blockstore.cache.hit')
+        else:
+            self.misses += 1
+            statsd_client.incr('blockstore.cache.miss')
+
+
+def iter_file(f, start, end, chunk_size):
+    """
+    Yield bytes start to end - 1 of the open file f in chunks of up to
+    chunk_size bytes, and close it.
+
+    """
+    with f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+_blob_cache = None
+
+
+def get_blob_cache():
+    """
+    Return the process-wide `DiskBlobCache`, or None if caching is disabled
+    (`BLOB_CACHE_DIRECTORY` not set).
+
+    """
+    global _blob_cache
+    if _blob_cache is None and config.get('BLOB_CACHE_DIRECTORY'):
+        capacity_mb = int(config.get('BLOB_CACHE_SIZE_MB',
+                                     DEFAULT_CACHE_SIZE_MB))
+        _blob_cache = DiskBlobCache(config.get('BLOB_CACHE_DIRECTORY'),
+                                    capacity_mb * 1024 * 1024)
+    return _blob_cache
+
+
+class WriteBehindUploader(object):
+    """
+    Asynchronous uploads of blobs to S3.
+
+    `stage` writes a blob to the staging directory and queues its upload,
+    without waiting for S3. A pool of worker greenlets uploads queued blobs
+    and removes them from staging once they're in S3; failed uploads are
+    retried after `retry_delay` seconds. Until then, reads of the blob on
+    this host are served from staging (other hosts don't see it, though).
+
+    The queue is bounded: once `max_pending` uploads are queued, `stage`
+    blocks until there's room, so that a slow S3 slows down sync rather than
+    filling the disk. Blobs that are still staged when a process starts
+    (because an earlier one exited before uploading them) are queued again.
+
+    The staging directory must be on persistent storage, since the database
+    rows referring to staged blobs are committed before they're uploaded.
+
+    Parameters
+    ----------
+    client: S3BlobClient
+    directory: str
+        Where blobs are staged.
+    max_pending: int
+        Maximum number of queued uploads.
+    workers: int
+        Number of concurrent uploads.
+    retry_delay: float
+        Seconds to wait before queueing a failed upload again.
+
+    """
+    def __init__(self, client, directory,
+                 max_pending=DEFAULT_UPLOAD_QUEUE_SIZE,
+                 workers=DEFAULT_UPLOAD_WORKERS,
+                 retry_delay=DEFAULT_UPLOAD_RETRY_DELAY):
+        self.client = client
+        self.directory = directory
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.queue = Queue(maxsize=max_pending)
+        # Hashes of blobs that are queued or being uploaded.
+        self._pending = set()
+        self._greenlets = []
+        mkdirp(directory)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _path(self, data_sha256):
+        return os.path.join(self.directory, data_sha256)
+
+    def start(self):
+        """
+        Start the upload workers, and queue the uploads of blobs staged by
+        earlier processes.
+
+        """
+        if self._greenlets:
+            return
+        self._greenlets = [gevent.spawn(self._work)
+                           for _ in range(self.workers)]
+        # Queueing may block, so don't make the caller wait for it.
+        self._greenlets.append(gevent.spawn(self.recover))
+
+    def stop(self):
+        gevent.killall(self._greenlets)
+        self._greenlets = []
+
+    def recover(self):
+        names = [name for name in os.listdir(self.directory)
+                 if BLOB_NAME.match(name)]
+        if names:
+            log.info('Re-driving staged blob uploads', count=len(names))
+        for name in names:
+            self._enqueue(name)
+
+    def stage(self, data_sha256, data):
+        """ Stage data for uploading under the key data_sha256. """
+        self.start()
+        if data_sha256 in self._pending or self.client.is_known(data_sha256):
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, self._path(data_sha256))
+        statsd_client.incr('blockstore.staging.staged')
+        self._enqueue(data_sha256)
+
+    def _enqueue(self, data_sha256):
+        if data_sha256 in self._pending:
+            return
+        self._pending.add(data_sha256)
+        self.queue.put(data_sha256)
+        statsd_client.gauge('blockstore.staging.pending', self.pending)
+
+    def _work(self):
+        while True:
+            data_sha256 = self.queue.get()
+            try:
+                self._upload(data_sha256)
+            except Exception:
+                log.error('Error uploading staged blob, will retry',
+                          data_sha256=data_sha256, exc_info=True)
+                statsd_client.incr('blockstore.staging.failed')
+                gevent.spawn_later(self.retry_delay, self.queue.put,
+                                   data_sha256)
+            else:
+                self._pending.discard(data_sha256)
+
+    def _upload(self, data_sha256):
+        try:
+            with open(self._path(data_sha256), 'rb') as f:
+                data = f.read()
+        except IOError:
+            # Another process sharing the directory uploaded it already.
+            return
+        self.client.put(data_sha256, data)
+        try:
+            os.remove(self._path(data_sha256))
+        except OSError:
+            pass
+        statsd_client.incr('blockstore.staging.uploaded')
+
+    def get(self, data_sha256):
+        """ Return the staged data for data_sha256, or None. """
+        try:
+            with open(self._path(data_sha256), 'rb') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def iter_range(self, data_sha256, start, end, chunk_size):
+        """
+        Return an iterator over bytes start to end - 1 of the staged data for
+        data_sha256, or None if it isn't staged.
+
+        """
+        try:
+            f = open(self._path(data_sha256), 'rb')
+        except IOError:
+            return None
+        return iter_file(f, start, end, chunk_size)
+
+
+_uploader = None
+
+
+def get_uploader():
+    """
+    Return the process-wide `WriteBehindUploader`, or None if uploads are
+    synchronous (`BLOB_STAGING_DIRECTORY` not set).
+
+    """
+    global _uploader
+    if _uploader is None and config.get('BLOB_STAGING_DIRECTORY'):
+        _uploader = WriteBehindUploader(
+            get_s3_client(), config.get('BLOB_STAGING_DIRECTORY'),
+            max_pending=int(config.get('BLOB_UPLOAD_QUEUE_SIZE',
+                                       DEFAULT_UPLOAD_QUEUE_SIZE)),
+            workers=int(config.get('BLOB_UPLOAD_WORKERS',
+                                   DEFAULT_UPLOAD_WORKERS)))
+    return _uploader
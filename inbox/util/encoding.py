@@ -1,3 +1,6 @@
+import base64
+
+
 def base36encode(number):
     if not isinstance(number, (int, long)):
         raise TypeError('number must be an integer')
@@ -16,3 +19,21 @@ def base36encode(number):
 
 def base36decode(number):
     return int(number, 36)
+
+
+def iter_base64(chunks):
+    """
+    Base64-encode a stream of byte strings. Input is re-split on multiples of
+    3 bytes, so that the concatenated output equals the encoding of the
+    concatenated input.
+
+    """
+    remainder = ''
+    for chunk in chunks:
+        data = remainder + chunk
+        cut = len(data) - len(data) % 3
+        remainder = data[cut:]
+        if cut:
+            yield base64.b64encode(data[:cut])
+    if remainder:
+        yield base64.b64encode(remainder)
@@ -4,6 +4,7 @@ import cgi
 import htmlentitydefs
 from HTMLParser import HTMLParser, HTMLParseError
 
+from talon import quotations
 from nylas.logging import get_logger
 
 
@@ -63,6 +64,15 @@ def strip_tags(html):
         get_logger().error('error stripping tags', raw_html=html)
     return s.get_data()
 
+
+def strip_quoted_html(html):
+    """ Return `html` with the quoted text of earlier messages removed. """
+    reply = quotations.extract_from_html(
+        quotations.extract_from(html, 'text/html'))
+    if isinstance(reply, str):
+        reply = reply.decode('utf-8')
+    return reply
+
 # https://djangosnippets.org/snippets/19/
 re_string = re.compile(ur'(?P<htmlchars>[<&>])|(?P<space>^[ \t]+)|(?P<lineend>\n)|(?P<protocol>(^|\s)((http|ftp)://.*?))(\s|$)', re.S|re.M|re.I|re.U)  # noqa
 
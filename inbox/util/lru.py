@@ -0,0 +1,65 @@
+"""
+Bounded in-process LRU cache whose entries can expire, shared by the
+process-wide caches (namespaces, search results, deltas, recurrence rule
+expansions).
+
+"""
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Parameters
+    ----------
+    max_entries: int
+        Least recently used entries are evicted once there are more than
+        this many.
+    ttl: float, optional
+        If set, entries expire this many seconds after they were set.
+
+    """
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (expiry time or None, value), least recently used first.
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """ Return the value cached for key, or default if there's none or
+        it has expired.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        expiry, value = entry
+        if expiry is not None and expiry <= time.time():
+            return default
+        # Re-insert to mark as most recently used.
+        self._entries[key] = entry
+        return value
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        expiry = time.time() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (expiry, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def evict(self):
+        """ Remove the least recently used entry and return its value. """
+        _, (_, value) = self._entries.popitem(last=False)
+        return value
+
+    def values(self):
+        """ Return the cached values, including expired ones. """
+        return [value for _, value in self._entries.itervalues()]
+
+    def clear(self):
+        self._entries.clear()
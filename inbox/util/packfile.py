@@ -0,0 +1,483 @@
+"""
+Append-only packfile storage for small blobs on local disk.
+
+Storing every message part in its own file under `MSG_PARTS_DIRECTORY` makes
+millions of tiny files, which exhausts inodes and makes backups slow. Blobs
+smaller than `PACKFILE_BLOB_SIZE_THRESHOLD` bytes are instead appended to
+large segment files in `PACKFILE_DIRECTORY` (by default the `packs`
+subdirectory of `MSG_PARTS_DIRECTORY`). Packing is disabled if the threshold
+is 0, which is the default.
+
+Each segment `segment-NNNNNN.pack` is paired with an index file
+`segment-NNNNNN.idx` of fixed-size (sha256, offset, length) records. Data is
+always appended to the segment before its index record, so an index record
+never points to incomplete data. Writers from all processes serialize on a
+lock file, and only ever append to the newest segment. Readers keep the
+index of the newest segment in memory, and pick up records appended by other
+processes when they look up a hash they don't know yet. Older segments are
+sealed: the first reader that needs one writes a copy of its index sorted by
+hash, `segment-NNNNNN.sidx`, which is binary searched from disk, so memory
+use doesn't grow with the number of blobs. If the same hash is indexed more
+than once, the record in the newest segment wins.
+
+`PackStore.compact` rewrites segments that are mostly made of unreferenced
+blobs. A blob that is written again is only deduplicated against the current
+segment, which is never compacted (hashes found in older segments are
+appended again), and segments that were written to or deduplicated against
+within a grace period are left alone: the block referring to a blob is
+committed some time after the blob is written, and until then the blob looks
+unreferenced. `bin/compact-blob-packs` and `bin/migrate-blobs-to-packs` run
+compaction and move existing blobs from the directory layout into packs.
+
+"""
+import os
+import re
+import struct
+import tempfile
+import time
+from binascii import hexlify, unhexlify
+from datetime import timedelta
+
+from inbox.config import config
+from inbox.util.file import Lock, mkdirp
+from inbox.util.stats import statsd_client
+from nylas.logging import get_logger
+log = get_logger()
+
+DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+# Compaction rewrites a segment once this fraction of it is unreferenced.
+DEFAULT_COMPACTION_RATIO = 0.5
+# Segments used more recently than this aren't compacted.
+DEFAULT_COMPACTION_GRACE_PERIOD = timedelta(days=1)
+
+INDEX_RECORD = struct.Struct('<32sQQ')
+SEGMENT_NAME = re.compile(r'^segment-(\d{6})\.pack$')
+SORTED_INDEX_NAME = re.compile(r'^segment-(\d{6})\.sidx$')
+
+
+def _segment_path(directory, segment):
+    return os.path.join(directory, 'segment-{:06d}.pack'.format(segment))
+
+
+def _index_path(directory, segment):
+    return os.path.join(directory, 'segment-{:06d}.idx'.format(segment))
+
+
+def _sorted_index_path(directory, segment):
+    return os.path.join(directory, 'segment-{:06d}.sidx'.format(segment))
+
+
+def _read_index(path, start=0):
+    """
+    Return the complete (digest, offset, length) records of the index file at
+    path from byte start on, and the number of bytes they take up. Raises
+    IOError if the file doesn't exist.
+
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read()
+    # Ignore a trailing partial record that is still being written.
+    usable = len(data) - len(data) % INDEX_RECORD.size
+    return ([INDEX_RECORD.unpack_from(data, pos)
+             for pos in range(0, usable, INDEX_RECORD.size)], usable)
+
+
+# Only one Lock may be created per lock file in a process, so stores of the
+# same directory share it.
+_locks = {}
+
+
+def _get_lock(path):
+    path = os.path.abspath(path)
+    if path not in _locks:
+        _locks[path] = Lock(path)
+    return _locks[path]
+
+
+class PackStore(object):
+    """
+    Parameters
+    ----------
+    directory: str
+        Where segment and index files are kept.
+    segment_size: int
+        A new segment is started once the current one is this large.
+
+    """
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        mkdirp(directory)
+        # Records of the newest segment, self._current; self._sealed are the
+        # numbers of the older ones, newest first.
+        self._current = None
+        self._sealed = []
+        self._index = {}
+        # Number of bytes of the current index file loaded into self._index.
+        self._loaded = 0
+        self._lock = _get_lock(os.path.join(directory, '.lock'))
+
+    def __len__(self):
+        # Reads every index file; meant for tests and diagnostics.
+        digests = set()
+        for segment in self.segments():
+            try:
+                records, _ = _read_index(_index_path(self.directory, segment))
+            except IOError:
+                continue
+            digests.update(digest for digest, _, _ in records)
+        return len(digests)
+
+    def __contains__(self, data_sha256):
+        return self._lookup(data_sha256) is not None
+
+    def segments(self):
+        """ Return the numbers of all segments, oldest first. """
+        return sorted(int(match.group(1)) for match in
+                      (SEGMENT_NAME.match(name)
+                       for name in os.listdir(self.directory)) if match)
+
+    def _refresh(self, reload=False):
+        """
+        Load index records added to the current segment since the last
+        refresh. The segment directory is only listed again if a new segment
+        was started, or if reload is set. Returns the numbers of the segments
+        that were sealed since the last refresh.
+
+        """
+        if (reload or self._current is None or os.path.exists(
+                _segment_path(self.directory, self._current + 1))):
+            segments = self.segments()
+            if not segments:
+                return []
+            previous = self._current
+            self._sealed = segments[-2::-1]
+            if segments[-1] != self._current:
+                self._current = segments[-1]
+                self._index = {}
+                self._loaded = 0
+            if previous is None or reload:
+                sealed = self._sealed
+            else:
+                sealed = [segment for segment in self._sealed
+                          if segment >= previous]
+        else:
+            sealed = []
+
+        try:
+            records, usable = _read_index(
+                _index_path(self.directory, self._current), self._loaded)
+        except IOError:
+            return sealed
+        for digest, offset, length in records:
+            self._index[digest] = (self._current, offset, length)
+        self._loaded += usable
+        return sealed
+
+    def _lookup(self, data_sha256):
+        digest = unhexlify(data_sha256)
+        location = self._index.get(digest)
+        if location is None:
+            location = self._find_sealed(digest, self._sealed)
+        if location is None:
+            sealed = self._refresh()
+            location = self._index.get(digest)
+            if location is None:
+                location = self._find_sealed(digest, sealed)
+        return location
+
+    def _find_sealed(self, digest, segments):
+        """
+        Return the location of digest in the newest of the given sealed
+        segments that has it, or None.
+
+        """
+        for segment in segments:
+            location = self._search_sorted_index(segment, digest)
+            if location is not None:
+                return location
+        return None
+
+    def _search_sorted_index(self, segment, digest):
+        try:
+            f = open(_sorted_index_path(self.directory, segment), 'rb')
+        except IOError:
+            f = self._write_sorted_index(segment)
+            if f is None:
+                return None
+        with f:
+            lo = 0
+            hi = os.fstat(f.fileno()).st_size // INDEX_RECORD.size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                f.seek(mid * INDEX_RECORD.size)
+                found, offset, length = INDEX_RECORD.unpack(
+                    f.read(INDEX_RECORD.size))
+                if found < digest:
+                    lo = mid + 1
+                elif found > digest:
+                    hi = mid
+                else:
+                    return segment, offset, length
+        return None
+
+    def _write_sorted_index(self, segment):
+        """
+        Write the sorted index of a sealed segment and return it opened, or
+        return None if the segment was compacted away.
+
+        """
+        try:
+            records, _ = _read_index(_index_path(self.directory, segment))
+        except IOError:
+            return None
+        records.sort()
+        path = _sorted_index_path(self.directory, segment)
+        # Readers in other processes may be writing it too; whichever rename
+        # comes last wins, and both copies are the same.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(''.join(INDEX_RECORD.pack(*record)
+                            for record in records))
+        os.rename(tmp_path, path)
+        statsd_client.incr('blockstore.packs.sorted_index_written')
+        return open(path, 'rb')
+
+    def put(self, data_sha256, data):
+        """ Append data to the current segment, unless it's already packed.
+        """
+        self.put_many([(data_sha256, data)])
+
+    def put_many(self, blobs):
+        """
+        Append a list of (sha256, data) pairs to the current segment, skipping
+        the ones that are already in it. Returns the number of blobs added.
+
+        """
+        with self._lock:
+            self._refresh()
+            current = self._current
+            added = {}
+            found = False
+            for data_sha256, data in blobs:
+                location = self._index.get(unhexlify(data_sha256))
+                if location is not None and location[0] == current:
+                    found = True
+                else:
+                    # Blobs in older segments may be compacted away before
+                    # the caller commits its reference to them.
+                    added[data_sha256] = data
+            if found:
+                # Start the segment's compaction grace period over.
+                os.utime(_segment_path(self.directory, current), None)
+            if added:
+                self._append(added.items())
+                statsd_client.incr('blockstore.packs.put', len(added))
+        return len(added)
+
+    def _append(self, blobs):
+        # Must be called with the lock held.
+        segments = self.segments()
+        segment = segments[-1] if segments else 1
+        segment_path = _segment_path(self.directory, segment)
+        if os.path.exists(segment_path) and \
+                os.path.getsize(segment_path) >= self.segment_size:
+            segment += 1
+            segment_path = _segment_path(self.directory, segment)
+
+        index_path = _index_path(self.directory, segment)
+        with open(segment_path, 'ab') as segment_file, \
+                open(index_path, 'ab') as index_file:
+            # Drop a partial record left by a writer that crashed.
+            index_file.seek(0, os.SEEK_END)
+            index_file.truncate(index_file.tell() -
+                                index_file.tell() % INDEX_RECORD.size)
+            records = []
+            segment_file.seek(0, os.SEEK_END)
+            offset = segment_file.tell()
+            for data_sha256, data in blobs:
+                segment_file.write(data)
+                records.append((unhexlify(data_sha256), offset, len(data)))
+                offset += len(data)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+            index_file.write(''.join(INDEX_RECORD.pack(*record)
+                                     for record in records))
+        self._refresh()
+
+    def _open(self, data_sha256):
+        """
+        Return (file, offset, length) for the packed blob data_sha256, or
+        None if it isn't packed.
+
+        """
+        location = self._lookup(data_sha256)
+        if location is None:
+            return None
+        segment, offset, length = location
+        try:
+            f = open(_segment_path(self.directory, segment), 'rb')
+        except IOError:
+            # The segment was compacted away by another process.
+            self._refresh(reload=True)
+            location = self._lookup(data_sha256)
+            if location is None:
+                return None
+            segment, offset, length = location
+            f = open(_segment_path(self.directory, segment), 'rb')
+        return f, offset, length
+
+    def get(self, data_sha256):
+        """ Return the data of the packed blob data_sha256, or None. """
+        opened = self._open(data_sha256)
+        if opened is None:
+            return None
+        f, offset, length = opened
+        with f:
+            f.seek(offset)
+            return f.read(length)
+
+    def iter_range(self, data_sha256, start, end, chunk_size):
+        """
+        Return an iterator over bytes start to end - 1 of the packed blob
+        data_sha256 in chunks of up to chunk_size bytes, or None if it isn't
+        packed.
+
+        """
+        opened = self._open(data_sha256)
+        if opened is None:
+            return None
+        f, offset, length = opened
+        return _iter_segment(f, offset + start, offset + min(end, length),
+                             chunk_size)
+
+    def compact(self, is_referenced, ratio=DEFAULT_COMPACTION_RATIO,
+                grace_period=DEFAULT_COMPACTION_GRACE_PERIOD, dry_run=False):
+        """
+        Rewrite segments in which at least `ratio` of the bytes belong to
+        unreferenced blobs: referenced blobs are appended to the current
+        segment, then the old segment is deleted. The current segment, and
+        segments used within `grace_period`, are never compacted.
+
+        Parameters
+        ----------
+        is_referenced: callable
+            Takes a list of sha256 hex digests, and returns the set of those
+            still referenced. Called with the lock held, once per segment.
+
+        Returns the number of bytes reclaimed (or that would be, if
+        `dry_run` is set).
+
+        """
+        reclaimed = 0
+        cutoff = time.time() - grace_period.total_seconds()
+        with self._lock:
+            self._refresh(reload=True)
+            segments = self.segments()
+            self._remove_stray_sorted_indexes(segments)
+
+            for i, segment in enumerate(segments[:-1]):
+                segment_path = _segment_path(self.directory, segment)
+                if os.path.getmtime(segment_path) > cutoff:
+                    continue
+                records, _ = _read_index(_index_path(self.directory,
+                                                     segment))
+                # Records that a newer segment overrides are dead here.
+                overridden = self._indexed_in(
+                    {digest for digest, _, _ in records}, segments[i + 1:])
+                entries = sorted({(offset, length, hexlify(digest))
+                                  for digest, offset, length in records
+                                  if digest not in overridden})
+                referenced = is_referenced([h for _, _, h in entries])
+                live = [entry for entry in entries if entry[2] in referenced]
+                size = os.path.getsize(segment_path)
+                dead = size - sum(length for _, length, _ in live)
+                if not size or float(dead) / size < ratio:
+                    continue
+
+                log.info('Compacting blob segment', segment=segment,
+                         size=size, reclaimed=dead, dry_run=dry_run)
+                reclaimed += dead
+                if dry_run:
+                    continue
+                with open(segment_path, 'rb') as f:
+                    blobs = []
+                    for offset, length, data_sha256 in live:
+                        f.seek(offset)
+                        blobs.append((data_sha256, f.read(length)))
+                if blobs:
+                    self._append(blobs)
+                for path in (_sorted_index_path(self.directory, segment),
+                             _index_path(self.directory, segment)):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                os.remove(segment_path)
+                statsd_client.incr('blockstore.packs.compacted')
+
+            if not dry_run:
+                self._refresh(reload=True)
+        return reclaimed
+
+    def _indexed_in(self, digests, segments):
+        """ Return those of digests that the given segments have records of.
+        """
+        found = set()
+        for segment in segments:
+            try:
+                records, _ = _read_index(_index_path(self.directory, segment))
+            except IOError:
+                continue
+            found.update(digest for digest, _, _ in records
+                         if digest in digests)
+        return found
+
+    def _remove_stray_sorted_indexes(self, segments):
+        # A reader can write the sorted index of a segment that is being
+        # compacted away.
+        segments = set(segments)
+        for name in os.listdir(self.directory):
+            match = SORTED_INDEX_NAME.match(name)
+            if match and int(match.group(1)) not in segments:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+def _iter_segment(f, start, end, chunk_size):
+    with f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def pack_threshold():
+    """ Blobs smaller than this many bytes are packed; 0 disables packing.
+    """
+    return int(config.get('PACKFILE_BLOB_SIZE_THRESHOLD', 0))
+
+
+def pack_directory():
+    return config.get('PACKFILE_DIRECTORY') or os.path.join(
+        config.get_required('MSG_PARTS_DIRECTORY'), 'packs')
+
+
+_pack_store = None
+
+
+def get_pack_store():
+    """ Return the process-wide `PackStore`. """
+    global _pack_store
+    if _pack_store is None:
+        _pack_store = PackStore(
+            pack_directory(), int(config.get('PACKFILE_SEGMENT_SIZE',
+                                             DEFAULT_SEGMENT_SIZE)))
+    return _pack_store
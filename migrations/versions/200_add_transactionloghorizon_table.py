@@ -0,0 +1,37 @@
+"""add transactionloghorizon table
+
+Revision ID: 1b0b4e6fdf96
+Revises: 3583211a4838
+Create Date: 2026-10-19 10:12:31.118402
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1b0b4e6fdf96'
+down_revision = '3583211a4838'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'transactionloghorizon',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.Column('expired_through_id', sa.Integer(), nullable=False),
+        sa.Column('compacted_through_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_transactionloghorizon_created_at',
+                    'transactionloghorizon', ['created_at'], unique=False)
+    op.create_index('ix_transactionloghorizon_updated_at',
+                    'transactionloghorizon', ['updated_at'], unique=False)
+    op.create_index('ix_transactionloghorizon_deleted_at',
+                    'transactionloghorizon', ['deleted_at'], unique=False)
+
+
+def downgrade():
+    op.drop_table('transactionloghorizon')
@@ -0,0 +1,41 @@
+"""add thread summary columns
+
+Revision ID: 4b2a7e61c3f0
+Revises: 1b0b4e6fdf96
+Create Date: 2026-10-19 14:02:47.532106
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b2a7e61c3f0'
+down_revision = '1b0b4e6fdf96'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+def upgrade():
+    # Existing rows are populated by bin/backfill-thread-summaries.
+    op.add_column('thread', sa.Column('unread_count', sa.Integer(),
+                                      server_default='0', nullable=False))
+    op.add_column('thread', sa.Column('starred_count', sa.Integer(),
+                                      server_default='0', nullable=False))
+    op.add_column('thread', sa.Column('has_attachments', sa.Boolean(),
+                                      server_default=sa.sql.expression.false(),
+                                      nullable=False))
+    op.add_column('thread', sa.Column('receivedrecentdate', sa.DateTime(),
+                                      nullable=True))
+    op.add_column('thread', sa.Column('participants', mysql.LONGTEXT(),
+                                      nullable=True))
+    op.add_column('thread', sa.Column('category_ids', sa.Text(),
+                                      nullable=True))
+
+
+def downgrade():
+    op.drop_column('thread', 'category_ids')
+    op.drop_column('thread', 'participants')
+    op.drop_column('thread', 'receivedrecentdate')
+    op.drop_column('thread', 'has_attachments')
+    op.drop_column('thread', 'starred_count')
+    op.drop_column('thread', 'unread_count')
@@ -0,0 +1,28 @@
+"""add message reply text
+
+Revision ID: 2c7d5a1e9b34
+Revises: 4b2a7e61c3f0
+Create Date: 2026-10-19 15:21:09.804215
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2c7d5a1e9b34'
+down_revision = '4b2a7e61c3f0'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+
+def upgrade():
+    # Existing rows are populated by bin/backfill-reply-text.
+    op.add_column('message', sa.Column('_compacted_reply_text',
+                                       mysql.LONGBLOB(), nullable=True))
+    op.add_column('message', sa.Column('has_quoted_text', sa.Boolean(),
+                                       nullable=True))
+
+
+def downgrade():
+    op.drop_column('message', 'has_quoted_text')
+    op.drop_column('message', '_compacted_reply_text')
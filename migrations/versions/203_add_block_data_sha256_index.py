@@ -0,0 +1,23 @@
+"""add block data_sha256 index
+
+Revision ID: 5e3a8b2d7c41
+Revises: 2c7d5a1e9b34
+Create Date: 2026-10-19 18:02:47.116390
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e3a8b2d7c41'
+down_revision = '2c7d5a1e9b34'
+
+from alembic import op
+
+
+def upgrade():
+    # Lets blob garbage collection check whether a hash is still referenced.
+    op.create_index('ix_block_data_sha256', 'block', ['data_sha256'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_block_data_sha256', table_name='block')
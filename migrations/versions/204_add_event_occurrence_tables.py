@@ -0,0 +1,60 @@
+"""add event occurrence tables
+
+Revision ID: 6f1c2d9a4e87
+Revises: 5e3a8b2d7c41
+Create Date: 2026-10-19 21:14:05.503127
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6f1c2d9a4e87'
+down_revision = '5e3a8b2d7c41'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'eventoccurrence',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.Column('event_id', sa.Integer(), nullable=False),
+        sa.Column('start', sa.DateTime(), nullable=False),
+        sa.Column('end', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['event_id'], ['event.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_eventoccurrence_created_at', 'eventoccurrence',
+                    ['created_at'], unique=False)
+    op.create_index('ix_eventoccurrence_updated_at', 'eventoccurrence',
+                    ['updated_at'], unique=False)
+    op.create_index('ix_eventoccurrence_deleted_at', 'eventoccurrence',
+                    ['deleted_at'], unique=False)
+    op.create_index('ix_eventoccurrence_event_id_start', 'eventoccurrence',
+                    ['event_id', 'start'], unique=False)
+
+    op.create_table(
+        'eventoccurrencewindow',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.Column('start', sa.DateTime(), nullable=False),
+        sa.Column('end', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_eventoccurrencewindow_created_at',
+                    'eventoccurrencewindow', ['created_at'], unique=False)
+    op.create_index('ix_eventoccurrencewindow_updated_at',
+                    'eventoccurrencewindow', ['updated_at'], unique=False)
+    op.create_index('ix_eventoccurrencewindow_deleted_at',
+                    'eventoccurrencewindow', ['deleted_at'], unique=False)
+
+
+def downgrade():
+    op.drop_table('eventoccurrencewindow')
+    op.drop_table('eventoccurrence')
@@ -0,0 +1,49 @@
+"""add compactedtransaction table
+
+Revision ID: 2d8e5c0b9a14
+Revises: 6f1c2d9a4e87
+Create Date: 2026-10-19 23:02:47.380915
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2d8e5c0b9a14'
+down_revision = '6f1c2d9a4e87'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'compactedtransaction',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=True),
+        sa.Column('public_id', sa.BINARY(16), nullable=False),
+        sa.Column('namespace_id', sa.Integer(), nullable=False),
+        sa.Column('transaction_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['namespace_id'], ['namespace.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_compactedtransaction_created_at',
+                    'compactedtransaction', ['created_at'], unique=False)
+    op.create_index('ix_compactedtransaction_updated_at',
+                    'compactedtransaction', ['updated_at'], unique=False)
+    op.create_index('ix_compactedtransaction_deleted_at',
+                    'compactedtransaction', ['deleted_at'], unique=False)
+    op.create_index('ix_compactedtransaction_public_id',
+                    'compactedtransaction', ['public_id'], unique=False)
+    op.create_index('ix_compactedtransaction_namespace_id_public_id',
+                    'compactedtransaction', ['namespace_id', 'public_id'],
+                    unique=False)
+
+    op.add_column('transactionloghorizon',
+                  sa.Column('expired_before', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('transactionloghorizon', 'expired_before')
+    op.drop_table('compactedtransaction')
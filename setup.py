@@ -76,8 +76,16 @@ setup(
              'bin/get-id',
              'bin/get-object',
              'bin/syncback-service',
+             'bin/transaction-retention-service',
+             'bin/blob-scrubber-service',
+             'bin/collect-blob-garbage',
+             'bin/search-index-service',
+             'bin/backfill-search-index',
+             'bin/event-occurrence-service',
              'bin/test_contact_groups',
-             'bin/migrate-tags'],
+             'bin/migrate-tags',
+             'bin/migrate-blobs-to-packs',
+             'bin/compact-blob-packs'],
 
     # See:
     # https://pythonhosted.org/setuptools/setuptools.html#dynamic-discovery-of-services-and-plugins
@@ -146,3 +146,18 @@ def test_api_override_serialization(db, api_client, default_namespace,
     assert events[0].get('recurrence') is not None
     assert events[1].get('object') == 'event'
     assert events[1].get('status') == 'cancelled'
+
+
+def test_api_expand_recurring_pagination(db, api_client, recurring_event):
+    event = recurring_event
+    recur = 'expand_recurring=true&starts_after={}&ends_before={}'.format(
+        urlsafe(event.start.replace(days=-1)),
+        urlsafe(event.start.replace(weeks=+30)))
+    all_events = api_client.get_data('/events?' + recur)
+    assert len(all_events) > 15
+
+    page = api_client.get_data('/events?{}&offset=5&limit=10'.format(recur))
+    assert [e['id'] for e in page] == [e['id'] for e in all_events[5:15]]
+
+    count = api_client.get_data('/events?{}&view=count'.format(recur))
+    assert count['count'] == len(all_events)
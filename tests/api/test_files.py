@@ -176,3 +176,43 @@ def test_download(api_client, uploaded_file_ids, filename):
     local_md5 = md5.new(local_data).digest()
     dl_md5 = md5.new(data).digest()
     assert local_md5 == dl_md5
+
+
+def test_download_range_and_etag(api_client, uploaded_file_ids):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'data', 'muir.jpg')
+    local_data = open(path, 'rb').read()
+    download_path = '/files/{}/download'.format(uploaded_file_ids[0])
+
+    r = api_client.get_raw(download_path)
+    assert r.status_code == 200
+    assert r.headers['Accept-Ranges'] == 'bytes'
+    etag = r.headers['ETag']
+
+    r = api_client.get_raw(download_path, headers={'Range': 'bytes=10-99'})
+    assert r.status_code == 206
+    assert r.data == local_data[10:100]
+    assert r.headers['Content-Range'] == \
+        'bytes 10-99/{}'.format(len(local_data))
+
+    r = api_client.get_raw(download_path, headers={'Range': 'bytes=-10'})
+    assert r.status_code == 206
+    assert r.data == local_data[-10:]
+
+    r = api_client.get_raw(download_path, headers={
+        'Range': 'bytes={}-'.format(len(local_data))})
+    assert r.status_code == 416
+
+    r = api_client.get_raw(download_path, headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.data == ''
+
+
+def test_download_missing_data(api_client, uploaded_file_ids):
+    from inbox.models.roles import _data_file_path
+    download_path = '/files/{}/download'.format(uploaded_file_ids[0])
+    etag = api_client.get_raw(download_path).headers['ETag']
+    os.remove(_data_file_path(etag.strip('"')))
+
+    r = api_client.get_raw(download_path)
+    assert r.status_code == 404
@@ -0,0 +1,32 @@
+import pytest
+from flask import Flask
+
+from inbox.api.kellogs import APIEncoder
+
+
+class Unencodable(object):
+    pass
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    encoder = APIEncoder()
+
+    @app.route('/<int:count>')
+    def objects(count):
+        return encoder.jsonify([{}] * count + [Unencodable()], stream=True)
+
+    return app.test_client()
+
+
+def test_streamed_json_fails_early_if_first_chunk_fails(client):
+    assert client.get('/0').status_code == 500
+
+
+def test_streamed_json_is_aborted_if_later_chunk_fails(client):
+    response = client.get('/100')
+    assert response.status_code == 200
+    # The error propagates to the server, which drops the connection.
+    with pytest.raises(TypeError):
+        response.data
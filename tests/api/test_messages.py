@@ -1,5 +1,7 @@
+import base64
 import pytest
 import json
+from inbox.util.encoding import iter_base64
 from tests.util.base import (add_fake_message, default_namespace,
                              new_message_from_synced, mime_message, thread,
                              add_fake_thread, generic_account, gmail_account)
@@ -71,6 +73,26 @@ def test_rfc822_format(stub_message_from_raw, api_client, mime_message):
     assert results.data == mime_message.to_string()
 
 
+def test_raw_message_endpoint(stub_message_from_raw, api_client,
+                              mime_message):
+    path = '/messages/{}/rfc2822'.format(stub_message_from_raw.public_id)
+
+    resp = api_client.get_data(path)
+    assert base64.b64decode(resp['rfc2822']) == mime_message.to_string()
+
+    resp = api_client.get_raw(path, headers={'Accept': 'message/rfc822'})
+    assert resp.headers['Content-Type'] == 'message/rfc822'
+    assert resp.data == mime_message.to_string()
+
+
+def test_iter_base64():
+    data = ''.join(chr(i % 256) for i in range(1000))
+    for chunk_size in (1, 2, 3, 7, 64, 1000):
+        chunks = [data[i:i + chunk_size]
+                  for i in range(0, len(data), chunk_size)]
+        assert ''.join(iter_base64(chunks)) == base64.b64encode(data)
+
+
 def test_sender_and_participants(stub_message, api_client):
     resp = api_client.get_raw('/threads/{}'
                                      .format(stub_message.thread.public_id))
@@ -204,3 +226,22 @@ def test_folders_labels(db, api_client, generic_account, gmail_account):
     assert resp_data['id'] == gmail_message.public_id
     assert resp_data['object'] == 'message'
     assert 'labels' in resp_data and 'folders' not in resp_data
+
+
+def test_quoted_text_is_stripped_once(db, api_client, default_namespace,
+                                      thread, monkeypatch):
+    message = add_fake_message(db.session, default_namespace.id, thread)
+    message.body = (u'<div>Sounds good!</div><div class="gmail_quote">'
+                    u'On Mon, Alice wrote:<blockquote>Lunch?</blockquote>'
+                    u'</div>')
+    db.session.commit()
+    assert message.has_quoted_text
+
+    def fail(html):
+        raise AssertionError('quoted text stripped on encode')
+    monkeypatch.setattr('inbox.models.message.strip_quoted_html', fail)
+
+    resp = api_client.get_data('/messages/{}'.format(message.public_id))
+    assert 'Sounds good!' in resp['text']
+    assert 'Lunch?' not in resp['text']
+    assert 'Lunch?' in resp['body']
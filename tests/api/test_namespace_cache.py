@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from inbox.api.namespace_cache import (NamespaceCache, CachedNamespace,
+                                       namespace_cache)
+from tests.api.base import api_client, new_api_client
+
+__all__ = ['api_client']
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def namespace_queries(statements):
+    return [s for s in statements if s.lstrip().startswith('SELECT') and
+            'FROM namespace' in s]
+
+
+def test_cache_expiry():
+    cache = NamespaceCache(ttl=-1)
+    cache.set('abc', CachedNamespace(1, 1))
+    assert cache.get('abc') is None
+
+
+def test_cache_is_bounded():
+    cache = NamespaceCache(max_entries=2)
+    for i in range(3):
+        cache.set(str(i), CachedNamespace(i, i))
+    assert len(cache) == 2
+    assert cache.get('0') is None
+    assert cache.get('2') == CachedNamespace(2, 2)
+
+
+def test_one_namespace_query_per_request(api_client, default_namespace):
+    namespace_cache.clear()
+    # Cold cache: the auth hook loads the namespace, and the request reuses
+    # it.
+    with count_queries() as statements:
+        api_client.get_data('/threads')
+    assert len(namespace_queries(statements)) == 1
+    assert namespace_cache.get(default_namespace.public_id).id == \
+        default_namespace.id
+
+    # Warm cache: neither auth nor the request query the namespace.
+    with count_queries() as statements:
+        api_client.get_data('/threads')
+    assert len(namespace_queries(statements)) == 0
+
+
+def test_deleted_namespace_is_invalidated(db, new_account):
+    namespace_cache.clear()
+    namespace = new_account.namespace
+    public_id = namespace.public_id
+    api_client = new_api_client(db, namespace)
+    api_client.get_data('/threads')
+    assert namespace_cache.get(public_id) is not None
+
+    db.session.delete(namespace)
+    db.session.commit()
+    assert namespace_cache.get(public_id) is None
+    resp = api_client.get_raw('/threads')
+    assert resp.status_code == 401
@@ -0,0 +1,59 @@
+import json
+from datetime import datetime, timedelta
+
+from tests.util.base import add_fake_message, add_fake_thread, add_fake_event
+from tests.api.base import api_client
+
+__all__ = ['api_client']
+
+
+def page_through(api_client, path, limit):
+    """ Fetch every page of `path` by following X-Next-Cursor headers. """
+    ids = []
+    cursor = None
+    while True:
+        url = '{}?limit={}'.format(path, limit)
+        if cursor is not None:
+            url += '&cursor={}'.format(cursor)
+        resp = api_client.get_raw(url)
+        assert resp.status_code == 200
+        ids.extend(item['id'] for item in json.loads(resp.data))
+        cursor = resp.headers.get('X-Next-Cursor')
+        if cursor is None:
+            return ids
+
+
+def test_thread_and_message_cursors(db, api_client, default_namespace):
+    now = datetime.utcnow().replace(microsecond=0)
+    for i in range(7):
+        # Some threads share their recentdate, to exercise the id tiebreaker.
+        thread = add_fake_thread(db.session, default_namespace.id)
+        thread.recentdate = now - timedelta(minutes=i // 2)
+        add_fake_message(db.session, default_namespace.id, thread,
+                         received_date=now - timedelta(minutes=i // 2))
+    db.session.commit()
+
+    for path in ('/threads', '/messages'):
+        all_ids = [item['id'] for item in api_client.get_data(path)]
+        assert page_through(api_client, path, limit=3) == all_ids
+        # Offset pagination keeps working, with the same order.
+        offset_page = api_client.get_data('{}?limit=3&offset=3'.format(path))
+        assert [item['id'] for item in offset_page] == all_ids[3:6]
+
+
+def test_event_cursor(db, api_client, default_namespace):
+    start = datetime.utcnow().replace(microsecond=0)
+    for i in range(5):
+        add_fake_event(db.session, default_namespace.id,
+                       start=start + timedelta(hours=i // 2),
+                       end=start + timedelta(hours=i // 2 + 1))
+    all_ids = [item['id'] for item in api_client.get_data('/events')]
+    assert page_through(api_client, '/events', limit=2) == all_ids
+
+
+def test_invalid_cursor(api_client):
+    resp = api_client.get_raw('/threads?cursor=notacursor')
+    assert resp.status_code == 400
+    resp = api_client.get_raw('/events?expand_recurring=true&cursor={}'
+                              .format('MjAxNTAxMDEwMDAwMDAwMDAwMDA6MQ=='))
+    assert resp.status_code == 400
@@ -1,3 +1,4 @@
+import json
 import pytest
 from tests.api.base import api_client
 
@@ -23,3 +24,18 @@ def test_resource_views(resource_name, db, api_client,
         assert isinstance(ids[i], basestring), \
             "&views=ids should return string"
         assert elem["id"] == ids[i], "view=ids should preserve order"
+
+
+def test_json_output_modes(db, api_client, message, thread):
+    compact = api_client.get_raw('/messages').data
+    assert '\n' not in compact
+
+    pretty = api_client.get_raw('/messages?pretty=true').data
+    assert '\n    ' in pretty
+    assert json.loads(pretty) == json.loads(compact)
+
+    browser = api_client.get_raw('/messages',
+                                 headers={'Accept': 'text/html'}).data
+    assert browser == pretty
+
+    assert api_client.get_raw('/messages?pretty=maybe').status_code == 400
@@ -1,8 +1,11 @@
 import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 from tests.util.base import (contact_sync, contacts_provider,
                              ContactsProviderStub)
 
+from inbox.contacts import remote_sync
 from inbox.models import Contact
 
 __all__ = ['contact_sync', 'contacts_provider']
@@ -66,6 +69,51 @@ def test_deletes(contacts_provider, contact_sync, db):
     assert num_current_contacts == num_original_contacts
 
 
+def test_contact_added_and_deleted_in_one_page(contacts_provider,
+                                              contact_sync, db):
+    num_original_contacts = db.session.query(Contact).count()
+    contacts_provider.supply_contact('Name', 'name@email.address')
+    contacts_provider.supply_contact(None, None, deleted=True)
+    # The deletion is of the contact that was just added.
+    contacts_provider._contacts[1].uid = contacts_provider._contacts[0].uid
+    contact_sync.provider = contacts_provider
+    contact_sync.sync()
+
+    assert db.session.query(Contact).count() == num_original_contacts
+
+
+def test_contacts_are_synced_in_pages(contact_sync, db, default_namespace,
+                                     monkeypatch):
+    monkeypatch.setattr(remote_sync, 'CONTACT_SYNC_PAGE_SIZE', 2)
+    contacts_provider = ContactsProviderStub('paged_provider')
+    contact_sync.provider = contacts_provider
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        statements.append(statement)
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        for name in ('Old', 'New'):
+            contacts_provider.__init__('paged_provider')
+            for i in range(5):
+                contacts_provider.supply_contact(
+                    '{} {}'.format(name, i), 'contact{}@email.address'.format(i))
+            contact_sync.sync()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+    # Existing contacts are loaded with one query per page, of which there
+    # are three per sync.
+    assert len([s for s in statements if 'contact.uid IN' in s]) == 6
+    contacts = db.session.query(Contact).filter(
+        Contact.namespace_id == default_namespace.id,
+        Contact.provider_name == contacts_provider.PROVIDER_NAME).all()
+    assert sorted(c.name for c in contacts) == \
+        ['New {}'.format(i) for i in range(5)]
+
+
 def test_auth_error_handling(contact_sync, default_account, db):
     """Test that the contact sync greenlet stops if account credentials are
     invalid."""
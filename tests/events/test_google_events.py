@@ -327,8 +327,10 @@ def test_pagination():
         'items': ['D', 'E']
     })
 
-    requests.get = mock.Mock(side_effect=[first_response, second_response])
+    session = mock.Mock()
+    session.get = mock.Mock(side_effect=[first_response, second_response])
     provider = GoogleEventsProvider(1, 1)
+    provider.session = session
     provider._get_access_token = mock.Mock(return_value='token')
     items = provider._get_resource_list('https://googleapis.com/testurl')
     assert items == ['A', 'B', 'C', 'D', 'E']
@@ -344,8 +346,10 @@ def test_handle_http_401():
         'items': ['A', 'B', 'C']
     })
 
-    requests.get = mock.Mock(side_effect=[first_response, second_response])
+    session = mock.Mock()
+    session.get = mock.Mock(side_effect=[first_response, second_response])
     provider = GoogleEventsProvider(1, 1)
+    provider.session = session
     provider._get_access_token = mock.Mock(return_value='token')
     items = provider._get_resource_list('https://googleapis.com/testurl')
     assert items == ['A', 'B', 'C']
@@ -374,9 +378,11 @@ def test_handle_quota_exceeded():
         'items': ['A', 'B', 'C']
     })
 
-    requests.get = mock.Mock(side_effect=[first_response, second_response])
+    session = mock.Mock()
+    session.get = mock.Mock(side_effect=[first_response, second_response])
     gevent.sleep = mock.Mock()
     provider = GoogleEventsProvider(1, 1)
+    provider.session = session
     provider._get_access_token = mock.Mock(return_value='token')
     items = provider._get_resource_list('https://googleapis.com/testurl')
     # Check that we slept, then retried.
@@ -394,9 +400,11 @@ def test_handle_internal_server_error():
         'items': ['A', 'B', 'C']
     })
 
-    requests.get = mock.Mock(side_effect=[first_response, second_response])
+    session = mock.Mock()
+    session.get = mock.Mock(side_effect=[first_response, second_response])
     gevent.sleep = mock.Mock()
     provider = GoogleEventsProvider(1, 1)
+    provider.session = session
     provider._get_access_token = mock.Mock(return_value='token')
     items = provider._get_resource_list('https://googleapis.com/testurl')
     # Check that we slept, then retried.
@@ -419,8 +427,10 @@ def test_handle_api_not_enabled():
         }
     })
 
-    requests.get = mock.Mock(return_value=response)
+    session = mock.Mock()
+    session.get = mock.Mock(return_value=response)
     provider = GoogleEventsProvider(1, 1)
+    provider.session = session
     provider._get_access_token = mock.Mock(return_value='token')
     with pytest.raises(AccessNotEnabledError):
         provider._get_resource_list('https://googleapis.com/testurl')
@@ -430,16 +440,20 @@ def test_handle_other_errors():
     response = requests.Response()
     response.status_code = 403
     response._content = "This is not the JSON you're looking for"
-    requests.get = mock.Mock(return_value=response)
+    session = mock.Mock()
+    session.get = mock.Mock(return_value=response)
     provider = GoogleEventsProvider(1, 1)
+    provider.session = session
     provider._get_access_token = mock.Mock(return_value='token')
     with pytest.raises(requests.exceptions.HTTPError):
         provider._get_resource_list('https://googleapis.com/testurl')
 
     response = requests.Response()
     response.status_code = 404
-    requests.get = mock.Mock(return_value=response)
+    session = mock.Mock()
+    session.get = mock.Mock(return_value=response)
     provider = GoogleEventsProvider(1, 1)
+    provider.session = session
     provider._get_access_token = mock.Mock(return_value='token')
     with pytest.raises(requests.exceptions.HTTPError):
         provider._get_resource_list('https://googleapis.com/testurl')
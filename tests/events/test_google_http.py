@@ -0,0 +1,119 @@
+"""
+Test calendar sync against a local stand-in for the Google Calendar API.
+
+"""
+import gzip
+import json
+import re
+from StringIO import StringIO
+
+import gevent
+import mock
+from gevent.pywsgi import WSGIServer
+from pytest import yield_fixture
+
+from inbox.events import google
+from inbox.events.remote_sync import EventSync
+
+EVENTS_PATH = re.compile(r'^/calendars/([^/]+)/events$')
+
+
+def raw_event(calendar_uid, i):
+    return {'id': '{}-{}'.format(calendar_uid, i),
+            'status': 'confirmed',
+            'summary': 'Event {}'.format(i),
+            'start': {'dateTime': '2015-03-17T01:30:00Z'},
+            'end': {'dateTime': '2015-03-17T02:00:00Z'},
+            'updated': '2015-03-10T00:00:00.000Z'}
+
+
+class CalendarAPI(object):
+    """ Serves two pages of events for every calendar except 'missing'. """
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __call__(self, environ, start_response):
+        self.requests.append(environ)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            # Give concurrent requests a chance to overlap.
+            gevent.sleep(0.05)
+            match = EVENTS_PATH.match(environ['PATH_INFO'])
+            if match is None or match.group(1) == 'missing':
+                start_response('404 Not Found',
+                               [('Content-Type', 'text/plain'),
+                                ('Content-Length', '0')])
+                return ['']
+
+            calendar_uid = match.group(1)
+            if 'pageToken=2' in environ['QUERY_STRING']:
+                data = {'items': [raw_event(calendar_uid, 2),
+                                  raw_event(calendar_uid, 3)]}
+            else:
+                data = {'items': [raw_event(calendar_uid, 0),
+                                  raw_event(calendar_uid, 1)],
+                        'nextPageToken': '2'}
+            body = StringIO()
+            with gzip.GzipFile(fileobj=body, mode='wb') as f:
+                f.write(json.dumps(data))
+            body = body.getvalue()
+            start_response('200 OK', [('Content-Type', 'application/json'),
+                                      ('Content-Encoding', 'gzip'),
+                                      ('Content-Length', str(len(body)))])
+            return [body]
+        finally:
+            self.in_flight -= 1
+
+    @property
+    def connections(self):
+        return {environ['REMOTE_PORT'] for environ in self.requests}
+
+
+@yield_fixture
+def calendar_api(monkeypatch):
+    api = CalendarAPI()
+    server = WSGIServer(('127.0.0.1', 0), api, log=None)
+    server.start()
+    monkeypatch.setattr(google, 'EVENTS_URL',
+                        'http://127.0.0.1:{}/calendars/{{}}/events'.format(
+                            server.server_port))
+    # Don't reuse sessions from other tests.
+    monkeypatch.setattr(google, '_sessions', {})
+    yield api
+    server.stop()
+
+
+def test_pages_share_a_connection(calendar_api):
+    provider = google.GoogleEventsProvider(1, 1)
+    provider._get_access_token = mock.Mock(return_value='token')
+    events = provider.sync_events('primary')
+    assert [e.uid for e in events] == \
+        ['primary-{}'.format(i) for i in range(4)]
+    assert len(calendar_api.requests) == 2
+    assert len(calendar_api.connections) == 1
+    for environ in calendar_api.requests:
+        assert environ['HTTP_ACCEPT_ENCODING'] == 'gzip'
+        assert 'gzip' in environ['HTTP_USER_AGENT']
+
+
+def test_calendars_are_fetched_concurrently(calendar_api, db,
+                                            default_account):
+    event_sync = EventSync(default_account.email_address, 'google',
+                           default_account.id, default_account.namespace.id,
+                           fetch_concurrency=3)
+    event_sync.provider._get_access_token = mock.Mock(return_value='token')
+    calendars = [(i, 'calendar{}'.format(i), None) for i in range(6)]
+    calendars.append((6, 'missing', None))
+
+    results = {id_: events for id_, _, events in
+               event_sync._fetch_events(calendars)}
+    assert sorted(results) == range(7)
+    assert results[6] is None
+    for i in range(6):
+        assert len(results[i]) == 4
+    assert calendar_api.max_in_flight == 3
+    # Connections are kept alive across calendars.
+    assert len(calendar_api.connections) <= 3
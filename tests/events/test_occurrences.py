@@ -0,0 +1,114 @@
+import arrow
+from pytest import yield_fixture
+
+from inbox.api.filtering import expanded_recurring_events
+from inbox.config import config
+from inbox.events import recurring
+from inbox.events.occurrences import (EventOccurrenceService, current_window,
+                                      materialised_window)
+from inbox.models import Calendar, Event
+from inbox.models.event import EventOccurrence, EventOccurrenceWindow
+
+
+@yield_fixture
+def occurrences_enabled(db, monkeypatch):
+    monkeypatch.setitem(config, 'EVENT_OCCURRENCE_TABLE', True)
+    yield
+    # Don't leak the materialised window into other tests.
+    db.session.query(EventOccurrenceWindow).delete()
+    db.session.commit()
+
+
+def add_recurring_event(db, namespace, rrule):
+    start = arrow.utcnow().floor('hour').replace(weeks=-2)
+    cal = db.session.query(Calendar).filter_by(
+        namespace_id=namespace.id).order_by('id').first()
+    ev = Event(namespace_id=namespace.id,
+               calendar=cal,
+               title='recurring-occurrences',
+               description='',
+               uid='occurrencetest',
+               location='',
+               busy=False,
+               read_only=False,
+               reminders='',
+               recurrence=rrule,
+               start=start,
+               end=start.replace(minutes=+30),
+               all_day=False,
+               is_owner=True,
+               participants=[],
+               provider_name='inbox',
+               raw_data='',
+               original_start_tz='America/Los_Angeles',
+               original_start_time=None,
+               master_event_uid=None,
+               source='local')
+    db.session.add(ev)
+    db.session.commit()
+    return ev
+
+
+def occurrence_starts(db, event_id):
+    return [o.start for o in db.session.query(EventOccurrence).filter(
+        EventOccurrence.event_id == event_id).order_by(EventOccurrence.start)]
+
+
+def expanded_starts(db, namespace, starts_after=None, starts_before=None):
+    filters = [namespace.id, None, None, 'recurring-occurrences', None, None,
+               None]
+    streams = expanded_recurring_events(filters, starts_before, starts_after,
+                                        None, None, db.session)
+    return [e.start for stream in streams for e in stream]
+
+
+def test_occurrences_follow_rrule_changes(db, default_namespace,
+                                          occurrences_enabled):
+    event = add_recurring_event(db, default_namespace, ['RRULE:FREQ=WEEKLY'])
+    event_id = event.id
+    weekly = occurrence_starts(db, event_id)
+    assert weekly == recurring.get_start_times(event, *current_window())
+    assert all(o.end == o.start.replace(minutes=+30) for o in
+               db.session.query(EventOccurrence).filter(
+                   EventOccurrence.event_id == event.id))
+
+    event.rrule = 'RRULE:FREQ=DAILY'
+    db.session.commit()
+    daily = occurrence_starts(db, event_id)
+    assert len(daily) > len(weekly)
+    assert daily == recurring.get_start_times(event, *current_window())
+
+    db.session.delete(event)
+    db.session.commit()
+    assert occurrence_starts(db, event_id) == []
+
+
+def test_materialised_occurrences_are_read(db, default_namespace,
+                                           occurrences_enabled, monkeypatch):
+    add_recurring_event(db, default_namespace, ['RRULE:FREQ=DAILY;INTERVAL=3'])
+    starts_after = arrow.utcnow().replace(days=-7)
+    starts_before = arrow.utcnow().replace(months=+2)
+    expected = expanded_starts(db, default_namespace, starts_after,
+                               starts_before)
+    assert expected
+    default_expected = expanded_starts(db, default_namespace)
+
+    # Without a materialised window, events are still expanded.
+    assert materialised_window(db.session) is None
+    written = EventOccurrenceService().run_once()
+    assert written >= len(expected)
+    assert materialised_window(db.session) is not None
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Recurring event was expanded')
+    monkeypatch.setattr(recurring, 'iter_start_times', fail)
+    assert expanded_starts(db, default_namespace, starts_after,
+                           starts_before) == expected
+    assert expanded_starts(db, default_namespace) == default_expected
+
+    # Ranges beyond the window fall back to expansion.
+    monkeypatch.undo()
+    monkeypatch.setitem(config, 'EVENT_OCCURRENCE_TABLE', True)
+    far = arrow.utcnow().replace(years=+3)
+    assert expanded_starts(db, default_namespace,
+                           far, far.replace(weeks=+1))
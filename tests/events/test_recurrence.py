@@ -6,8 +6,10 @@ from datetime import timedelta
 from inbox.models.event import Event, RecurringEvent, RecurringEventOverride
 from inbox.models.when import Date, Time, DateSpan, TimeSpan
 from inbox.events.remote_sync import handle_event_updates
+from inbox.events import recurring
 from inbox.events.recurring import (link_events, get_start_times,
-                                    parse_exdate, rrule_to_json)
+                                    iter_start_times, parse_exdate,
+                                    rrule_to_json, rrule_cache)
 
 from nylas.logging import get_logger
 log = get_logger()
@@ -137,6 +139,51 @@ def test_rrule_parsing(db, default_account, calendar):
     assert len(g) == 6
 
 
+def test_start_times_follow_rrule_changes(db, default_account, calendar):
+    event = recurring_event(db, default_account, calendar, TEST_RRULE)
+    assert len(get_start_times(event)) == 7
+    # Expansions are cached, but not across changes to the rule.
+    event.rrule = 'RRULE:FREQ=WEEKLY;UNTIL=20140904T203000Z;BYDAY=TH'
+    assert len(get_start_times(event)) == 5
+
+
+def test_start_times_are_expanded_lazily(db, default_account, calendar):
+    event = recurring_event(db, default_account, calendar,
+                            ["RRULE:FREQ=DAILY"])
+    start_times = iter_start_times(event, end=arrow.get(2100, 1, 1))
+    assert [next(start_times) for _ in range(3)] == \
+        get_start_times(event, end=event.start.replace(days=+2))
+
+
+def test_cached_expansions_are_capped(db, default_account, calendar,
+                                     monkeypatch):
+    monkeypatch.setattr(recurring, 'MAX_CACHED_START_TIMES', 10)
+    event = recurring_event(db, default_account, calendar,
+                            ["RRULE:FREQ=DAILY"])
+    end = event.start.replace(days=+29)
+    start_times = get_start_times(event, end=end)
+    assert len(start_times) == 30
+    assert len(rrule_cache.get(event)._times) == 10
+    # Start times past the cap are expanded again, from anywhere.
+    assert get_start_times(event, end=end) == start_times
+    assert get_start_times(event, start=start_times[20], end=end) == \
+        start_times[20:]
+    assert len(rrule_cache.get(event)._times) == 10
+
+
+def test_rrule_cache_bounds_total_start_times(db, default_account, calendar,
+                                               monkeypatch):
+    monkeypatch.setattr(rrule_cache, 'max_start_times', 25)
+    rrule_cache.clear()
+    for _ in range(5):
+        event = recurring_event(db, default_account, calendar,
+                                ["RRULE:FREQ=DAILY"])
+        get_start_times(event, end=event.start.replace(days=+9))
+    # Each expansion keeps about ten start times; the least recently used
+    # ones were evicted once there were more than 25 in all.
+    assert len(rrule_cache) == 3
+
+
 def test_all_day_rrule_parsing(db, default_account, calendar):
     event = recurring_event(db, default_account, calendar, ALL_DAY_RRULE,
                             start=arrow.get(2014, 8, 7),
@@ -1,8 +1,15 @@
 from datetime import datetime
-from inbox.events.remote_sync import EventSync
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from inbox.events import remote_sync
+from inbox.events.remote_sync import EventSync, handle_event_updates
 from inbox.events.util import CalendarSyncResponse
 from inbox.models import Calendar, Event, Transaction
 from tests.util.base import new_account
+from nylas.logging import get_logger
+log = get_logger()
 
 
 # Placeholder values for non-nullable attributes
@@ -169,3 +176,39 @@ def test_handle_changes(db, new_account):
     # calendar still survive.
     assert db.session.query(Event).filter(
         Event.namespace_id == namespace_id).count() == 2
+
+
+def test_event_updates_are_paged(db, default_namespace, monkeypatch):
+    monkeypatch.setattr(remote_sync, 'EVENT_SYNC_PAGE_SIZE', 2)
+    calendar = Calendar(namespace_id=default_namespace.id, uid='paged',
+                        name='Paged', read_only=False)
+    db.session.add(calendar)
+    db.session.commit()
+
+    def sync(titles):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters,
+                                  context, executemany):
+            statements.append(statement)
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            handle_event_updates(default_namespace.id, calendar.id,
+                                 [Event(uid=uid, title=title,
+                                        **default_params)
+                                  for uid, title in titles],
+                                 log, db.session)
+        finally:
+            event.remove(Engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        # Existing events are loaded with one query per page.
+        return len([s for s in statements if 'event.uid IN' in s])
+
+    assert sync([('a', 'A'), ('b', 'B'), ('c', 'C')]) == 2
+    # Updates, including a repeated event within a page, and an addition.
+    assert sync([('a', 'A1'), ('a', 'A2'), ('c', 'C1'), ('d', 'D')]) == 2
+
+    events = db.session.query(Event).filter(
+        Event.calendar_id == calendar.id).order_by(Event.uid).all()
+    assert [(e.uid, e.title) for e in events] == \
+        [('a', 'A2'), ('b', 'B'), ('c', 'C1'), ('d', 'D')]
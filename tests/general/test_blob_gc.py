@@ -0,0 +1,81 @@
+import os
+import time
+from hashlib import sha256
+
+from inbox.models import Block
+from inbox.models.roles import _data_file_directory, _data_file_path
+from inbox.util.blob_gc import BlobCollector
+from inbox.util.file import mkdirp
+
+
+def store_orphan(data, age):
+    data_sha256 = sha256(data).hexdigest()
+    mkdirp(_data_file_directory(data_sha256))
+    path = _data_file_path(data_sha256)
+    with open(path, 'wb') as f:
+        f.write(data)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_unreferenced_blobs_are_collected(db, default_namespace, config,
+                                          monkeypatch, tmpdir):
+    monkeypatch.setitem(config, 'MSG_PARTS_DIRECTORY', str(tmpdir))
+    block = Block(namespace_id=default_namespace.id, filename='kept')
+    block.data = 'referenced'
+    db.session.add(block)
+    db.session.commit()
+    referenced = _data_file_path(block.data_sha256)
+    os.utime(referenced, (0, 0))
+    old_orphan = store_orphan('old orphan', age=3 * 86400)
+    new_orphan = store_orphan('new orphan', age=0)
+
+    assert BlobCollector(dry_run=True).run() == (1, len('old orphan'))
+    assert os.path.exists(old_orphan)
+
+    assert BlobCollector().run() == (1, len('old orphan'))
+    assert not os.path.exists(old_orphan)
+    assert os.path.exists(new_orphan)
+    assert os.path.exists(referenced)
+
+
+def test_blobs_referenced_after_mark_are_kept(db, default_namespace, config,
+                                              monkeypatch, tmpdir):
+    monkeypatch.setitem(config, 'MSG_PARTS_DIRECTORY', str(tmpdir))
+    orphan = store_orphan('orphan', age=3 * 86400)
+
+    # Simulate a block referring to the blob being created while the
+    # collector is running.
+    def mark(db_session, among=None):
+        if among is None:
+            return set()
+        block = Block(namespace_id=default_namespace.id, filename='new')
+        block.data = 'orphan'
+        db.session.add(block)
+        db.session.commit()
+        return original(db_session, among)
+    from inbox.util import blob_gc
+    original = blob_gc.referenced_blob_hashes
+    monkeypatch.setattr(blob_gc, 'referenced_blob_hashes', mark)
+
+    assert BlobCollector().run() == (0, 0)
+    assert os.path.exists(orphan)
+
+
+def test_blobs_written_after_listing_are_kept(db, config, monkeypatch,
+                                             tmpdir):
+    monkeypatch.setitem(config, 'MSG_PARTS_DIRECTORY', str(tmpdir))
+    orphan = store_orphan('orphan', age=3 * 86400)
+
+    # Simulate a writer storing the same blob again after it was listed, but
+    # before the block referring to it is committed.
+    def mark(db_session, among=None):
+        if among is not None:
+            os.utime(orphan, None)
+        return set()
+    from inbox.util import blob_gc
+    monkeypatch.setattr(blob_gc, 'referenced_blob_hashes', mark)
+
+    assert BlobCollector().run() == (0, 0)
+    assert os.path.exists(orphan)
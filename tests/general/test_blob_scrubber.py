@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from inbox.models import Block
+from inbox.models.roles import _data_file_path
+from inbox.util.blob_scrubber import BlobScrubber
+
+
+@pytest.fixture
+def blocks(db, default_namespace):
+    blocks = []
+    for name in ('ok', 'corrupted', 'missing'):
+        block = Block(namespace_id=default_namespace.id, filename=name)
+        block.data = '{} {}'.format(name, os.urandom(16).encode('hex'))
+        db.session.add(block)
+        blocks.append(block)
+    db.session.commit()
+
+    ok, corrupted, missing = blocks
+    with open(_data_file_path(corrupted.data_sha256), 'r+b') as f:
+        f.write('X')
+    os.remove(_data_file_path(missing.data_sha256))
+    for block in blocks:
+        del block._data
+    return blocks
+
+
+def test_scrubber_reports_bad_blobs(blocks):
+    ok, corrupted, missing = blocks
+    scrubber = BlobScrubber(bytes_per_second=10 ** 9)
+    assert scrubber.scrub(ok.data_sha256, ok.size) == 'ok'
+    assert scrubber.scrub(corrupted.data_sha256, corrupted.size) == \
+        'corrupted'
+    assert scrubber.scrub(missing.data_sha256, missing.size) == 'missing'
+
+    results = scrubber.run_once(start_id=ok.id - 1)
+    assert results == {'ok': 1, 'corrupted': 1, 'missing': 1}
+
+
+def test_verification_policy(blocks, config, monkeypatch):
+    ok, corrupted, _ = blocks
+    with pytest.raises(AssertionError):
+        corrupted.data
+
+    monkeypatch.setitem(config, 'BLOB_VERIFY', 'never')
+    assert corrupted.data.startswith('X')
+    assert ''.join(corrupted.iter_data()).startswith('X')
+
+    monkeypatch.setitem(config, 'BLOB_VERIFY', 'sampled')
+    monkeypatch.setitem(config, 'BLOB_VERIFY_SAMPLE_PERCENT', 100)
+    with pytest.raises(AssertionError):
+        corrupted.data
+    assert ok.data.startswith('ok')
@@ -0,0 +1,278 @@
+import os
+from hashlib import sha256
+
+import gevent
+import mock
+import pytest
+from boto.exception import S3ResponseError
+
+from inbox.util.blockstore import (S3BlobClient, DiskBlobCache,
+                                    WriteBehindUploader)
+
+
+class FakeKey(object):
+    def __init__(self, bucket, name=None):
+        self.bucket = bucket
+        self.key = name
+
+    def set_contents_from_string(self, data):
+        self.bucket.put_attempts += 1
+        if self.bucket.failures:
+            self.bucket.failures -= 1
+            raise IOError('Connection reset by peer')
+        self.bucket.keys[self.key] = data
+
+    def get_contents_as_string(self):
+        self.bucket.gets += 1
+        if self.key not in self.bucket.keys:
+            raise S3ResponseError(404, 'Not Found')
+        return self.bucket.keys[self.key]
+
+
+class FakeBucket(object):
+    def __init__(self, failures=0):
+        self.keys = {}
+        self.touched = []
+        self.failures = failures
+        self.lookups = 0
+        self.gets = 0
+        self.put_attempts = 0
+
+    def get_key(self, name, validate=True):
+        if not validate:
+            return FakeKey(self, name)
+        self.lookups += 1
+        if name in self.keys:
+            return FakeKey(self, name)
+        return None
+
+    def copy_key(self, new_key_name, src_bucket_name, src_key_name,
+                 metadata=None):
+        assert new_key_name == src_key_name and metadata
+        self.touched.append(new_key_name)
+
+    def delete_keys(self, names, quiet=False):
+        for name in names:
+            self.keys.pop(name, None)
+        return mock.Mock(errors=[], deleted=[mock.Mock(key=name)
+                                             for name in names])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    import boto.s3.key
+    monkeypatch.setattr(boto.s3.key, 'Key', FakeKey)
+    client = S3BlobClient('blocks', retry_delay=0)
+    client._bucket = FakeBucket()
+    client._pid = os.getpid()
+    return client
+
+
+def test_known_keys_skip_existence_check(client):
+    data = 'attachment'
+    data_sha256 = sha256(data).hexdigest()
+    client.put(data_sha256, data)
+    assert client.bucket.lookups == 1
+    client.put(data_sha256, data)
+    client.put(data_sha256, data)
+    assert client.bucket.lookups == 1
+    assert client.bucket.put_attempts == 1
+    assert client.get(data_sha256) == data
+
+
+def test_gets_are_single_requests(client):
+    data = 'attachment'
+    data_sha256 = sha256(data).hexdigest()
+    client.bucket.keys[data_sha256] = data
+    assert client.get(data_sha256) == data
+    assert client.get(sha256('missing').hexdigest()) is None
+    assert client.bucket.gets == 2
+    assert client.bucket.lookups == 0
+
+
+def test_existing_keys_are_not_uploaded_again(client):
+    data = 'attachment'
+    data_sha256 = sha256(data).hexdigest()
+    client.bucket.keys[data_sha256] = data
+    client.put(data_sha256, data)
+    assert client.bucket.put_attempts == 0
+    # The existing key is marked as recently written.
+    assert client.bucket.touched == [data_sha256]
+    assert client.is_known(data_sha256)
+
+
+def test_uploads_are_retried(client):
+    data = 'attachment'
+    data_sha256 = sha256(data).hexdigest()
+    client.bucket.failures = 2
+    client.put(data_sha256, data)
+    assert client.bucket.put_attempts == 3
+    assert client.bucket.keys[data_sha256] == data
+
+
+def test_failed_uploads_raise(client):
+    data = 'attachment'
+    data_sha256 = sha256(data).hexdigest()
+    client.upload_retries = 1
+    client.bucket.failures = 2
+    with pytest.raises(IOError):
+        client.put(data_sha256, data)
+    assert not client.is_known(data_sha256)
+
+
+def test_known_keys_are_bounded(client):
+    client.max_known_keys = 2
+    for data in ('a', 'b', 'c'):
+        client.put(sha256(data).hexdigest(), data)
+    assert not client.is_known(sha256('a').hexdigest())
+    assert client.is_known(sha256('c').hexdigest())
+
+
+def test_known_keys_expire(client, monkeypatch):
+    import inbox.util.blockstore
+    now = [1000.0]
+    monkeypatch.setattr(inbox.util.blockstore, 'time',
+                        mock.Mock(time=lambda: now[0]))
+    client.known_key_ttl = 60
+    data = 'attachment'
+    data_sha256 = sha256(data).hexdigest()
+    client.put(data_sha256, data)
+    assert client.is_known(data_sha256)
+
+    # Garbage collection in another process deletes the key once it's older
+    # than its grace period, which is longer than the TTL...
+    now[0] += 3600
+    collector = S3BlobClient('blocks')
+    collector._bucket = client.bucket
+    collector._pid = os.getpid()
+    assert collector.delete_many([data_sha256]) == [data_sha256]
+
+    # ...so this process no longer trusts its LRU, and writes it again.
+    assert not client.is_known(data_sha256)
+    client.put(data_sha256, data)
+    assert client.bucket.put_attempts == 2
+    assert client.bucket.keys[data_sha256] == data
+
+
+def test_roundtrip_against_moto():
+    moto = pytest.importorskip('moto')
+    with moto.mock_s3():
+        from boto.s3.connection import S3Connection
+        S3Connection('key', 'secret').create_bucket('blocks')
+        client = S3BlobClient('blocks', aws_access_key_id='key',
+                              aws_secret_access_key='secret')
+        data = 'x' * 100000
+        data_sha256 = sha256(data).hexdigest()
+        client.put(data_sha256, data)
+        client.forget(data_sha256)
+        assert client.get(data_sha256) == data
+        assert ''.join(client.iter_range(data_sha256, 10, 20, 4)) == data[10:20]
+        assert client.get(sha256('missing').hexdigest()) is None
+
+
+def test_disk_cache_hits_and_misses(tmpdir):
+    cache = DiskBlobCache(str(tmpdir), capacity=1024 * 1024)
+    data = 'message body'
+    data_sha256 = sha256(data).hexdigest()
+    assert cache.get(data_sha256) is None
+    cache.put(data_sha256, data)
+    assert cache.get(data_sha256) == data
+    assert ''.join(cache.iter_range(data_sha256, 3, 7, 2)) == data[3:7]
+    assert cache.hits == 2 and cache.misses == 1
+
+
+def test_disk_cache_rejects_corrupted_data(tmpdir):
+    cache = DiskBlobCache(str(tmpdir), capacity=1024 * 1024)
+    data_sha256 = sha256('message body').hexdigest()
+    cache.put(data_sha256, 'corrupted body')
+    assert cache.get(data_sha256) is None
+
+
+def test_disk_cache_fills_from_complete_reads_only(tmpdir):
+    cache = DiskBlobCache(str(tmpdir), capacity=1024 * 1024)
+    data = 'abcdefgh'
+    data_sha256 = sha256(data).hexdigest()
+
+    chunks = cache.filling(data_sha256, iter(['abcd', 'efgh']), len(data))
+    assert next(chunks) == 'abcd'
+    chunks.close()
+    assert cache.get(data_sha256) is None
+
+    assert ''.join(cache.filling(data_sha256, iter(['abcd', 'efgh']), len(data))) == data
+    assert cache.get(data_sha256) == data
+    # No temporary files are left behind.
+    assert tmpdir.join(data_sha256[:2]).listdir() == \
+        [tmpdir.join(data_sha256[:2], data_sha256)]
+
+
+def test_disk_cache_skips_missing_and_truncated_blobs(tmpdir, config,
+                                                      monkeypatch):
+    monkeypatch.setitem(config, 'BLOB_VERIFY', 'never')
+    cache = DiskBlobCache(str(tmpdir), capacity=1024 * 1024)
+    data = 'abcdefgh'
+    data_sha256 = sha256(data).hexdigest()
+
+    assert list(cache.filling(data_sha256, iter([]), len(data))) == []
+    assert cache.get(data_sha256) is None
+    assert ''.join(cache.filling(data_sha256, iter(['abcd']),
+                                 len(data))) == 'abcd'
+    assert cache.get(data_sha256) is None
+
+
+def test_disk_cache_evicts_least_recently_used(tmpdir):
+    cache = DiskBlobCache(str(tmpdir), capacity=1024 * 1024)
+    blobs = [chr(ord('a') + i) * 300 for i in range(4)]
+    hashes = [sha256(data).hexdigest() for data in blobs]
+    for i, (data, data_sha256) in enumerate(zip(blobs, hashes)):
+        cache.put(data_sha256, data)
+        # Make sure modification times are ordered.
+        os.utime(cache._path(data_sha256), (i, i))
+    cache.get(hashes[0])
+
+    # Evicts down to 90% of capacity.
+    cache.capacity = 700
+    assert cache.evict() == 2
+    assert cache.evictions == 2
+    assert cache.get(hashes[0]) == blobs[0]
+    assert cache.get(hashes[1]) is None
+    assert cache.get(hashes[2]) is None
+    assert cache.get(hashes[3]) == blobs[3]
+
+
+def wait_for(condition, timeout=5):
+    with gevent.Timeout(timeout):
+        while not condition():
+            gevent.sleep(0.01)
+
+
+def test_write_behind_uploads(client, tmpdir):
+    uploader = WriteBehindUploader(client, str(tmpdir), retry_delay=0)
+    data = 'attachment'
+    data_sha256 = sha256(data).hexdigest()
+    client.bucket.failures = 1
+    client.upload_retries = 0
+    try:
+        uploader.stage(data_sha256, data)
+        # Staged blobs are readable before they're uploaded.
+        assert uploader.get(data_sha256) == data
+        assert ''.join(uploader.iter_range(data_sha256, 2, 5, 2)) == 'tac'
+        wait_for(lambda: uploader.pending == 0)
+    finally:
+        uploader.stop()
+    assert client.bucket.put_attempts == 2
+    assert client.bucket.keys[data_sha256] == data
+    assert uploader.get(data_sha256) is None
+    assert tmpdir.listdir() == []
+
+
+def test_staged_uploads_are_recovered(client, tmpdir):
+    data = 'attachment'
+    data_sha256 = sha256(data).hexdigest()
+    tmpdir.join(data_sha256).write(data)
+    uploader = WriteBehindUploader(client, str(tmpdir))
+    try:
+        uploader.start()
+        wait_for(lambda: data_sha256 in client.bucket.keys)
+    finally:
+        uploader.stop()
+    assert tmpdir.listdir() == []
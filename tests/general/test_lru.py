@@ -0,0 +1,26 @@
+import time
+
+from inbox.util.lru import LRUCache
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = LRUCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.evict() == 3
+    assert cache.values() == [1]
+
+
+def test_entries_expire(monkeypatch):
+    cache = LRUCache(max_entries=2, ttl=60)
+    cache.set('a', None)
+    assert cache.get('a', 'missing') is None
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert cache.get('a', 'missing') == 'missing'
+    assert len(cache) == 0
@@ -0,0 +1,133 @@
+import os
+import time
+from datetime import timedelta
+from hashlib import sha256
+
+import pytest
+
+from inbox.util.packfile import PackStore, INDEX_RECORD
+
+
+def blob(data):
+    return sha256(data).hexdigest(), data
+
+
+@pytest.fixture
+def store(tmpdir):
+    return PackStore(str(tmpdir), segment_size=1024)
+
+
+def test_put_and_get(store):
+    data_sha256, data = blob('signature')
+    assert store.get(data_sha256) is None
+    store.put(data_sha256, data)
+    store.put(data_sha256, data)
+    assert len(store) == 1
+    assert store.get(data_sha256) == data
+    assert ''.join(store.iter_range(data_sha256, 2, 6, 3)) == data[2:6]
+    assert store.iter_range(sha256('missing').hexdigest(), 0, 1, 1) is None
+
+
+def test_segments_roll_over(store):
+    blobs = [blob(chr(ord('a') + i) * 600) for i in range(3)]
+    assert store.put_many(blobs[:2]) == 2
+    store.put(*blobs[2])
+    assert store.segments() == [1, 2]
+    assert all(store.get(data_sha256) == data for data_sha256, data in blobs)
+
+
+def test_only_the_current_segment_is_indexed_in_memory(store):
+    reader = PackStore(store.directory, segment_size=1024)
+    blobs = [blob(chr(ord('a') + i) * 600) for i in range(3)]
+    store.put_many(blobs[:2])
+    assert reader.get(blobs[0][0]) == blobs[0][1]
+    store.put(*blobs[2])
+    assert store.segments() == [1, 2]
+
+    # The reader notices the new segment, and then looks the sealed one up in
+    # its sorted index.
+    assert all(reader.get(data_sha256) == data
+               for data_sha256, data in reversed(blobs))
+    assert len(reader._index) == 1
+    assert os.path.exists(os.path.join(store.directory,
+                                       'segment-000001.sidx'))
+    assert reader.get(sha256('missing').hexdigest()) is None
+
+
+def test_writes_are_seen_by_other_stores(store):
+    other = PackStore(store.directory, segment_size=1024)
+    assert other.get(blob('a')[0]) is None
+    store.put(*blob('a'))
+    assert other.get(blob('a')[0]) == 'a'
+
+
+def test_partial_index_records_are_ignored(store):
+    store.put(*blob('a'))
+    with open(os.path.join(store.directory, 'segment-000001.idx'), 'ab') as f:
+        f.write('\0' * (INDEX_RECORD.size // 2))
+    assert len(PackStore(store.directory)) == 1
+    store.put(*blob('b'))
+    assert PackStore(store.directory).get(blob('b')[0]) == 'b'
+
+
+def test_compaction(store):
+    live = [blob('live {}'.format(i) * 20) for i in range(3)]
+    dead = [blob('dead {}'.format(i) * 100) for i in range(3)]
+    store.put_many(live + dead)
+    store.put(*blob('x' * 1024))
+    assert store.segments() == [1, 2]
+    reader = PackStore(store.directory)
+    assert reader.get(live[0][0]) == live[0][1]
+
+    referenced = {data_sha256 for data_sha256, _ in live}
+    is_referenced = lambda hashes: referenced.intersection(hashes)
+    size = os.path.getsize(os.path.join(store.directory,
+                                        'segment-000001.pack'))
+    expected = size - sum(len(data) for _, data in live)
+    # The segment was just written to.
+    assert store.compact(is_referenced) == 0
+    no_grace = timedelta(0)
+    assert store.compact(is_referenced, grace_period=no_grace,
+                         dry_run=True) == expected
+    assert store.segments() == [1, 2]
+
+    assert store.compact(is_referenced, grace_period=no_grace) == expected
+    assert store.segments() == [2, 3]
+    assert all(store.get(data_sha256) == data for data_sha256, data in live)
+    assert all(store.get(data_sha256) is None for data_sha256, _ in dead)
+    # Stores that still have the old locations in memory find the new ones.
+    assert reader.get(live[1][0]) == live[1][1]
+
+
+def age_segment(store, segment, days):
+    mtime = time.time() - days * 24 * 3600
+    os.utime(os.path.join(store.directory,
+                          'segment-{:06d}.pack'.format(segment)),
+             (mtime, mtime))
+
+
+def test_blobs_in_old_segments_are_written_again(store):
+    old = blob('o' * 1100)
+    store.put(*old)
+    store.put(*blob('n' * 1100))
+    assert store.segments() == [1, 2]
+
+    # Writing a blob that's only in an old segment appends it again, so that
+    # compacting the old segment before the blob is referenced can't lose it.
+    assert store.put_many([old]) == 1
+    assert store.segments() == [1, 2, 3]
+    age_segment(store, 1, days=2)
+    assert store.compact(lambda hashes: set(),
+                         grace_period=timedelta(days=1)) == 1100
+    assert store.segments() == [2, 3]
+    assert store.get(old[0]) == old[1]
+
+    # Writing it again deduplicates against the current segment, and starts
+    # its grace period over.
+    age_segment(store, 3, days=2)
+    assert store.put_many([old]) == 0
+    store.put(*blob('y' * 600))
+    assert store.segments() == [2, 3, 4]
+    assert store.compact(lambda hashes: set(),
+                         grace_period=timedelta(days=1)) == 0
+    assert store.get(old[0]) == old[1]
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+from inbox.models import Category, Thread
+from tests.util.base import add_fake_message, add_fake_thread
+from tests.api.base import api_client
+
+__all__ = ['api_client']
+
+
+def assert_summary_is_current(thread):
+    assert thread.has_summary
+    summary = thread.compute_summary()
+    for key, value in summary.iteritems():
+        assert getattr(thread, key) == value, key
+
+
+def test_summary_tracks_new_messages(db, default_namespace):
+    thread = add_fake_thread(db.session, default_namespace.id)
+    assert thread.has_summary and not thread.unread
+    now = datetime.utcnow().replace(microsecond=0)
+    add_fake_message(db.session, default_namespace.id, thread,
+                     from_addr=[('', 'alice@example.com')],
+                     to_addr=[('Bob', 'bob@example.com')],
+                     received_date=now - timedelta(days=1))
+    add_fake_message(db.session, default_namespace.id, thread,
+                     from_addr=[('Alice', 'alice@example.com')],
+                     received_date=now)
+
+    db.session.expire_all()
+    assert_summary_is_current(thread)
+    assert thread.unread_count == 2
+    assert thread.receivedrecentdate == now
+    assert sorted(thread.participants) == [('Alice', 'alice@example.com'),
+                                           ('Bob', 'bob@example.com')]
+
+
+def test_summary_tracks_flag_changes(db, default_namespace, thread,
+                                     message):
+    assert thread.unread and not thread.starred
+    message.is_read = True
+    message.is_starred = True
+    db.session.commit()
+
+    db.session.expire_all()
+    assert_summary_is_current(thread)
+    assert not thread.unread and thread.starred
+
+
+def test_summary_tracks_category_changes(db, default_namespace, thread,
+                                         message):
+    inbox = Category.find_or_create(db.session, default_namespace.id,
+                                    'inbox', 'Inbox', type_='label')
+    message.categories.add(inbox)
+    db.session.commit()
+    db.session.expire_all()
+    assert_summary_is_current(thread)
+    assert thread.categories == {inbox}
+
+    message.categories.discard(inbox)
+    db.session.commit()
+    db.session.expire_all()
+    assert_summary_is_current(thread)
+    assert thread.categories == set()
+
+
+def test_summary_tracks_deleted_messages(db, default_namespace, thread,
+                                         message):
+    add_fake_message(db.session, default_namespace.id, thread)
+    message.is_starred = True
+    db.session.commit()
+    assert thread.starred
+
+    db.session.delete(message)
+    db.session.commit()
+    db.session.expire_all()
+    assert_summary_is_current(thread)
+    assert thread.unread_count == 1 and not thread.starred
+
+
+def test_unsummarized_threads_fall_back_to_messages(db, default_namespace,
+                                                    thread, message):
+    message.is_starred = True
+    db.session.commit()
+    thread._participants = None
+    assert not thread.has_summary
+    assert thread.starred
+    assert thread.receivedrecentdate == message.received_date
+
+
+def test_unsummarized_threads_are_filtered_by_messages(db, api_client,
+                                                       thread, message):
+    message.is_starred = True
+    db.session.commit()
+    # As left by the migration that added the summary columns.
+    table = Thread.__table__
+    db.session.execute(table.update().where(table.c.id == thread.id).values(
+        participants=None, unread_count=0, starred_count=0))
+    db.session.commit()
+
+    for query, matches in (('unread=true', True), ('unread=false', False),
+                           ('starred=true', True), ('starred=false', False)):
+        threads = api_client.get_data('/threads?{}'.format(query))
+        assert (thread.public_id in [t['id'] for t in threads]) == matches
@@ -50,3 +50,23 @@ def test_connection_retained_on_other_errors():
             raise ValueError
     assert conn in pool._queue
     conn.logout.assert_not_called()
+
+
+def test_connection_discarded_when_killed():
+    pool = TestableConnectionPool(1, num_connections=3, readonly=True)
+    conns = []
+
+    def use_connection():
+        with pool.get() as conn:
+            conns.append(conn)
+            # Waiting for a response when killed.
+            gevent.sleep(10)
+
+    greenlet = gevent.spawn(use_connection)
+    gevent.sleep(0)
+    greenlet.kill()
+    assert pool._queue.full()
+    while not pool._queue.empty():
+        assert pool._queue.get() is None
+    conns[0].conn.shutdown.assert_called_once_with()
+    conns[0].logout.assert_not_called()
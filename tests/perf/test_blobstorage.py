@@ -0,0 +1,54 @@
+"""
+Time encode_blob and decode_blob across body sizes, with and without
+encryption. Run with `py.test -s tests/perf/test_blobstorage.py`.
+
+"""
+import os
+import random
+import string
+import time
+
+from inbox.security.blobstorage import encode_blob, decode_blob
+
+SIZES = [int(size) for size in
+         os.environ.get('PERF_BODY_SIZES',
+                        '1024,16384,262144,4194304').split(',')]
+SECONDS = float(os.environ.get('PERF_SECONDS', 1))
+
+
+def make_body(size):
+    # Roughly as compressible as an HTML message body.
+    words = [''.join(random.choice(string.ascii_lowercase)
+                     for _ in range(random.randint(2, 10)))
+             for _ in range(2000)]
+    body = []
+    length = 0
+    while length < size:
+        word = random.choice(words)
+        body.append(word)
+        length += len(word) + 1
+    return ' '.join(body)[:size]
+
+
+def rate(func, arg):
+    count = 0
+    start = time.time()
+    while time.time() - start < SECONDS:
+        func(arg)
+        count += 1
+    return count / (time.time() - start)
+
+
+def test_encode_decode(config, monkeypatch):
+    print
+    print '{:>9} {:>8} {:>12} {:>12}'.format('size', 'encrypt', 'encode/s',
+                                             'decode/s')
+    for encrypt in (False, True):
+        monkeypatch.setitem(config, 'ENCRYPT_SECRETS', encrypt)
+        for size in SIZES:
+            body = make_body(size)
+            encoded = encode_blob(body)
+            assert decode_blob(encoded) == body
+            print '{:>9} {:>8} {:>12.0f} {:>12.0f}'.format(
+                size, encrypt, rate(encode_blob, body),
+                rate(decode_blob, encoded))
@@ -0,0 +1,60 @@
+"""
+Measure peak RSS while serving concurrent downloads of a large file. Run with
+`py.test -s tests/perf/test_file_download.py`.
+
+The streamed downloads are measured first, since the peak RSS of a process
+can only grow.
+
+"""
+import os
+import resource
+
+from inbox.models import Block
+from tests.api.base import api_client
+
+__all__ = ['api_client']
+
+FILE_SIZE = int(os.environ.get('PERF_FILE_SIZE', 25 * 1024 * 1024))
+CONCURRENCY = int(os.environ.get('PERF_CONCURRENCY', 8))
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def test_concurrent_download_peak_rss(db, api_client, default_namespace):
+    block = Block(namespace_id=default_namespace.id, filename='large.bin',
+                  content_type='application/octet-stream')
+    block.data = os.urandom(FILE_SIZE)
+    db.session.add(block)
+    db.session.commit()
+    block_id, public_id = block.id, block.public_id
+    del block
+    db.session.expunge_all()
+
+    print
+    baseline = peak_rss_mb()
+    # Interleave reading the bodies, as concurrent clients would.
+    responses = [api_client.client.get(
+        '/files/{}/download'.format(public_id), buffered=False,
+        headers=api_client.auth_header) for _ in range(CONCURRENCY)]
+    iterators = dict(enumerate(iter(r.response) for r in responses))
+    received = [0] * CONCURRENCY
+    while iterators:
+        for i, it in iterators.items():
+            try:
+                received[i] += len(next(it))
+            except StopIteration:
+                del iterators[i]
+    for r in responses:
+        r.close()
+    assert all(size == FILE_SIZE for size in received)
+    print '{} streamed downloads of {}MB: peak RSS +{:.1f}MB'.format(
+        CONCURRENCY, FILE_SIZE >> 20, peak_rss_mb() - baseline)
+
+    baseline = peak_rss_mb()
+    blobs = [db.session.query(Block).get(block_id).data
+             for _ in range(CONCURRENCY)]
+    assert all(len(blob) == FILE_SIZE for blob in blobs)
+    print '{} in-memory reads of {}MB: peak RSS +{:.1f}MB'.format(
+        CONCURRENCY, FILE_SIZE >> 20, peak_rss_mb() - baseline)
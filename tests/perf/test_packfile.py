@@ -0,0 +1,77 @@
+"""
+Compare write and read throughput of small blobs in the directory layout and
+in packfiles. Run with `py.test -s tests/perf/test_packfile.py`.
+
+"""
+import os
+import random
+import time
+from hashlib import sha256
+
+from inbox.config import config
+from inbox.models import roles
+from inbox.util.file import mkdirp
+from inbox.util.packfile import PackStore
+
+BLOBS = int(os.environ.get('PERF_BLOBS', 20000))
+MAX_BLOB_SIZE = int(os.environ.get('PERF_MAX_BLOB_SIZE', 8 * 1024))
+
+
+def timed(label, count, nbytes, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '{:<28} {:>9.0f} blobs/s {:>8.1f} MB/s'.format(
+        label, count / elapsed, nbytes / elapsed / (1 << 20))
+
+
+def test_small_blob_throughput(tmpdir, monkeypatch):
+    monkeypatch.setitem(config, 'MSG_PARTS_DIRECTORY',
+                        str(tmpdir.join('parts')))
+    blobs = []
+    for _ in range(BLOBS):
+        data = os.urandom(random.randint(200, MAX_BLOB_SIZE))
+        blobs.append((sha256(data).hexdigest(), data))
+    nbytes = sum(len(data) for _, data in blobs)
+    order = [data_sha256 for data_sha256, _ in blobs]
+    random.shuffle(order)
+
+    def write_files():
+        for data_sha256, data in blobs:
+            mkdirp(roles._data_file_directory(data_sha256))
+            with open(roles._data_file_path(data_sha256), 'wb') as f:
+                f.write(data)
+
+    def read_files():
+        for data_sha256 in order:
+            with open(roles._data_file_path(data_sha256), 'rb') as f:
+                f.read()
+
+    packs = PackStore(str(tmpdir.join('packs')))
+    batched_packs = PackStore(str(tmpdir.join('batched-packs')))
+
+    def write_packs():
+        for data_sha256, data in blobs:
+            packs.put(data_sha256, data)
+
+    def write_packs_batched():
+        for i in range(0, len(blobs), 1000):
+            batched_packs.put_many(blobs[i:i + 1000])
+
+    def read_packs():
+        for data_sha256 in order:
+            packs.get(data_sha256)
+
+    def read_packs_cold():
+        PackStore(packs.directory).get(order[0])
+
+    print
+    print '{} blobs, {:.1f}MB'.format(BLOBS, nbytes / float(1 << 20))
+    timed('write, directory layout', BLOBS, nbytes, write_files)
+    timed('write, packs', BLOBS, nbytes, write_packs)
+    timed('write, packs (batches)', BLOBS, nbytes, write_packs_batched)
+    timed('read, directory layout', BLOBS, nbytes, read_files)
+    timed('read, packs', BLOBS, nbytes, read_packs)
+    start = time.time()
+    read_packs_cold()
+    print 'loading pack index: {:.3f}s'.format(time.time() - start)
@@ -0,0 +1,68 @@
+"""
+Benchmark deep pagination through /threads with offsets vs. cursors on a
+large synthetic namespace. Run with
+`PERF_THREADS=500000 py.test -s tests/perf/test_pagination.py`.
+
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+from inbox.api import filtering
+from inbox.models import Thread
+
+NUM_THREADS = int(os.environ.get('PERF_THREADS', 100000))
+PAGE_SIZE = 100
+CHUNK_SIZE = 5000
+
+
+def populate(db_session, namespace_id):
+    start = datetime.utcnow().replace(microsecond=0)
+    for chunk_start in range(0, NUM_THREADS, CHUNK_SIZE):
+        rows = []
+        for i in range(chunk_start, min(chunk_start + CHUNK_SIZE,
+                                        NUM_THREADS)):
+            # A few threads per second, so that sort keys collide.
+            dt = start - timedelta(seconds=i // 3)
+            rows.append({'namespace_id': namespace_id,
+                         'subject': 'Thread {}'.format(i),
+                         'subjectdate': dt, 'recentdate': dt,
+                         'snippet': ''})
+        db_session.execute(Thread.__table__.insert(), rows)
+        db_session.commit()
+
+
+def fetch(db_session, namespace_id, offset=0, page_cursor=None):
+    return filtering.threads(
+        namespace_id=namespace_id, subject=None, from_addr=None, to_addr=None,
+        cc_addr=None, bcc_addr=None, any_email=None, thread_public_id=None,
+        started_before=None, started_after=None, last_message_before=None,
+        last_message_after=None, filename=None, in_=None, unread=None,
+        starred=None, limit=PAGE_SIZE, offset=offset, view=None,
+        db_session=db_session, page_cursor=page_cursor)
+
+
+def test_deep_pagination(db, default_namespace):
+    populate(db.session, default_namespace.id)
+    depths = [NUM_THREADS // 10, NUM_THREADS // 2, NUM_THREADS - PAGE_SIZE]
+
+    print
+    for depth in depths:
+        start = time.time()
+        by_offset = fetch(db.session, default_namespace.id, offset=depth)
+        offset_time = time.time() - start
+
+        # The cursor for this page comes from the last row of the previous
+        # one.
+        previous = fetch(db.session, default_namespace.id,
+                         offset=depth - PAGE_SIZE)
+        page_cursor = (previous[-1].recentdate, previous[-1].id)
+        db.session.expunge_all()
+        start = time.time()
+        by_cursor = fetch(db.session, default_namespace.id,
+                          page_cursor=page_cursor)
+        cursor_time = time.time() - start
+
+        assert [t.id for t in by_cursor] == [t.id for t in by_offset]
+        print 'depth {}: offset {:.1f}ms, cursor {:.1f}ms'.format(
+            depth, 1000 * offset_time, 1000 * cursor_time)
@@ -0,0 +1,77 @@
+"""
+Benchmark expanding recurring events for /events?expand_recurring=true.
+Run with `PERF_RECURRING_EVENTS=1000 py.test -s
+tests/perf/test_recurring_events.py`.
+
+"""
+import os
+import time
+
+import arrow
+
+from inbox.api import filtering
+from inbox.events.recurring import rrule_cache
+from inbox.models import Event, Calendar
+
+NUM_EVENTS = int(os.environ.get('PERF_RECURRING_EVENTS', 300))
+
+
+def populate(db_session, namespace_id):
+    calendar = db_session.query(Calendar).filter_by(
+        namespace_id=namespace_id).first()
+    start = arrow.utcnow().floor('day').replace(years=-1)
+    for i in range(NUM_EVENTS):
+        event_start = start.replace(minutes=+(i * 7))
+        db_session.add(Event(
+            namespace_id=namespace_id, calendar=calendar,
+            title='Daily {}'.format(i), description='',
+            uid='daily{}'.format(i), location='', busy=False, read_only=False, reminders='',
+            recurrence=['RRULE:FREQ=DAILY'], start=event_start,
+            end=event_start.replace(minutes=+30), all_day=False,
+            is_owner=True, participants=[], provider_name='inbox',
+            raw_data='', original_start_tz='America/Los_Angeles',
+            original_start_time=None, master_event_uid=None,
+            source='local'))
+    db_session.commit()
+
+
+def run_filter(db_session, namespace_id, **kwargs):
+    params = dict(
+        namespace_id=namespace_id, event_public_id=None,
+        calendar_public_id=None, title=None, description=None,
+        location=None, busy=None, starts_before=None, starts_after=None,
+        ends_before=None, ends_after=None, limit=100, offset=0,
+        view=None, expand_recurring=True, show_cancelled=False,
+        db_session=db_session)
+    params.update(kwargs)
+    return filtering.events(**params)
+
+
+def timed(label, func):
+    start = time.time()
+    result = func()
+    print '{:<40} {:8.1f}ms'.format(label, 1000 * (time.time() - start))
+    return result
+
+
+def test_recurring_event_expansion(db, default_namespace):
+    populate(db.session, default_namespace.id)
+    namespace_id = default_namespace.id
+    next_month = dict(starts_after=arrow.utcnow().datetime,
+                      ends_before=arrow.utcnow().replace(months=+1).datetime)
+    rrule_cache.clear()
+
+    print
+    print '{} daily recurring events'.format(NUM_EVENTS)
+    timed('first page, cold cache',
+          lambda: run_filter(db.session, namespace_id))
+    timed('first page, warm cache',
+          lambda: run_filter(db.session, namespace_id))
+    timed('offset 5000',
+          lambda: run_filter(db.session, namespace_id, offset=5000))
+    timed('first page of next month',
+          lambda: run_filter(db.session, namespace_id, **next_month))
+    count = timed('count over the next year',
+                  lambda: run_filter(db.session, namespace_id,
+                                     view='count'))['count']
+    print '{} instances'.format(count)
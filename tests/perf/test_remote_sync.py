@@ -0,0 +1,77 @@
+"""
+Benchmark importing and re-syncing large contact and event sets from a
+provider. Run with `PERF_SYNC_ITEMS=50000 py.test -s
+tests/perf/test_remote_sync.py`.
+
+"""
+import os
+import time
+from datetime import datetime, timedelta
+
+from inbox.contacts.remote_sync import ContactSync
+from inbox.events.remote_sync import handle_event_updates
+from inbox.models import Calendar, Contact, Event
+from tests.util.base import ContactsProviderStub
+from nylas.logging import get_logger
+log = get_logger()
+
+NUM_ITEMS = int(os.environ.get('PERF_SYNC_ITEMS', 50000))
+
+
+def contacts_provider(name):
+    provider = ContactsProviderStub('perf_provider')
+    for i in range(NUM_ITEMS):
+        provider.supply_contact('{} {}'.format(name, i),
+                                'contact{}@example.com'.format(i))
+    return provider
+
+
+def remote_events(title):
+    start = datetime(2015, 2, 22, 11, 0)
+    return [Event(uid='perf{}'.format(i), title='{} {}'.format(title, i),
+                  description='', location='', raw_data='', busy=True,
+                  all_day=False, read_only=False, is_owner=True,
+                  participants=[], start=start + timedelta(hours=i),
+                  end=start + timedelta(hours=i, minutes=30))
+            for i in range(NUM_ITEMS)]
+
+
+def timed(label, func):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print '{:<40} {:8.1f}s {:8.0f} items/s'.format(label, elapsed,
+                                                    NUM_ITEMS / elapsed)
+
+
+def test_contact_sync(db, default_account):
+    sync = ContactSync(default_account.email_address, 'gmail',
+                       default_account.id, default_account.namespace.id)
+
+    print
+    print '{} contacts'.format(NUM_ITEMS)
+    sync.provider = contacts_provider('Contact')
+    timed('initial import', sync.sync)
+    sync.provider = contacts_provider('Renamed')
+    timed('update all', sync.sync)
+    assert db.session.query(Contact).filter(
+        Contact.namespace_id == default_account.namespace.id,
+        Contact.provider_name == 'perf_provider').count() == NUM_ITEMS
+
+
+def test_event_sync(db, default_namespace):
+    calendar = Calendar(namespace_id=default_namespace.id, uid='perf',
+                        name='Benchmark', read_only=False)
+    db.session.add(calendar)
+    db.session.commit()
+
+    print
+    print '{} events'.format(NUM_ITEMS)
+    for label, title in (('initial import', 'Meeting'),
+                         ('update all', 'Renamed meeting')):
+        events = remote_events(title)
+        timed(label, lambda: handle_event_updates(
+            default_namespace.id, calendar.id, events, log, db.session))
+        db.session.expunge_all()
+    assert db.session.query(Event).filter(
+        Event.calendar_id == calendar.id).count() == NUM_ITEMS
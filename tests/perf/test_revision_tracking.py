@@ -0,0 +1,58 @@
+"""
+Benchmarks for transaction log bookkeeping on large sessions. Not run by
+default; run with `py.test -s tests/perf/test_revision_tracking.py`.
+
+"""
+import time
+
+from inbox.models import Contact, Transaction
+from inbox.models.session import new_session
+
+SESSION_SIZE = 10000
+
+
+def timed_flush(session):
+    start = time.time()
+    session.flush()
+    return time.time() - start
+
+
+def test_flush_with_large_session(db, default_namespace):
+    session = new_session(db.engine)
+    contacts = [Contact(namespace_id=default_namespace.id,
+                        uid='perf-{}'.format(i), provider_name='perf',
+                        name='Contact {}'.format(i),
+                        email_address='contact{}@example.com'.format(i))
+                for i in range(SESSION_SIZE)]
+    session.add_all(contacts)
+    insert_time = timed_flush(session)
+    session.commit()
+    assert session.query(Transaction).filter(
+        Transaction.namespace_id == default_namespace.id,
+        Transaction.object_type == 'contact',
+        Transaction.command == 'insert').count() >= SESSION_SIZE
+
+    # Load all objects into the session, then repeatedly modify a single
+    # one. The cost of each flush should not depend on the session size.
+    loaded = session.query(Contact).filter(
+        Contact.namespace_id == default_namespace.id).all()
+    assert len(loaded) >= SESSION_SIZE
+    small_flush_times = []
+    for i in range(100):
+        loaded[i].name = 'Renamed {}'.format(i)
+        small_flush_times.append(timed_flush(session))
+    session.commit()
+
+    # Modify every object in one flush.
+    for contact in loaded:
+        contact.name = contact.name + '!'
+    update_time = timed_flush(session)
+    session.commit()
+    session.close()
+
+    print
+    print 'insert {} objects: {:.3f}s'.format(SESSION_SIZE, insert_time)
+    print 'update {} objects: {:.3f}s'.format(SESSION_SIZE, update_time)
+    print 'update 1 of {} objects: {:.2f}ms (mean of {})'.format(
+        SESSION_SIZE, 1000 * sum(small_flush_times) / len(small_flush_times),
+        len(small_flush_times))
@@ -0,0 +1,75 @@
+"""
+Measure indexing throughput and query latency of the local search index.
+Run with `py.test -s tests/perf/test_search_index.py`.
+
+"""
+import datetime
+import os
+import random
+import re
+import time
+
+from inbox.config import config
+from inbox.search.adaptor import NamespaceSearchEngine
+from tests.util.base import absolute_path
+
+MESSAGES = int(os.environ.get('PERF_MESSAGES', 20000))
+QUERIES = int(os.environ.get('PERF_QUERIES', 200))
+BATCH_SIZE = 100
+
+
+def fake_messages(words):
+    start = datetime.datetime(2010, 1, 1)
+    for i in xrange(MESSAGES):
+        body = u' '.join(random.choice(words) for _ in range(200))
+        yield {'id': 'message{}'.format(i),
+               'thread_id': 'thread{}'.format(i // 5),
+               'subject': u' '.join(random.choice(words) for _ in range(5)),
+               'from': [{'name': random.choice(words),
+                         'email': '{}@example.com'.format(i % 100)}],
+               'to': [{'name': random.choice(words),
+                       'email': 'inbox@example.com'}],
+               'snippet': body[:191],
+               'body': u'<p>{}</p>'.format(body),
+               'date': start + datetime.timedelta(minutes=i)}
+
+
+def test_search_index(tmpdir, monkeypatch):
+    monkeypatch.setitem(config, 'SEARCH_INDEX_DIRECTORY', str(tmpdir))
+    with open(absolute_path('data/andra-moi-ennepe.txt')) as f:
+        words = list(set(re.findall(r'\w+', f.read().decode('utf-8'),
+                                    re.U)))
+    messages = list(fake_messages(words))
+    engine = NamespaceSearchEngine('perf', create_index=True)
+
+    start = time.time()
+    for i in range(0, MESSAGES, BATCH_SIZE):
+        engine.messages.bulk_index(
+            [('index', message) for message in messages[i:i + BATCH_SIZE]])
+    elapsed = time.time() - start
+    print
+    print 'indexed {} messages: {:.0f} messages/s'.format(
+        MESSAGES, MESSAGES / elapsed)
+    print 'index size: {:.1f}MB'.format(
+        os.path.getsize(str(tmpdir.join('perf.db'))) / float(1 << 20))
+
+    queries = {
+        'one word': lambda: random.choice(words),
+        'two words': lambda: u' '.join(random.sample(words, 2)),
+        'phrase': lambda: u'"{}"'.format(u' '.join(random.sample(words, 2))),
+        'field': lambda: u'subject:{}'.format(random.choice(words)),
+    }
+    for label, make_query in sorted(queries.items()):
+        for search in (engine.messages.search, engine.search_threads):
+            latencies = []
+            for _ in range(QUERIES):
+                query = make_query()
+                start = time.time()
+                search(query)
+                latencies.append(time.time() - start)
+            latencies.sort()
+            print '{:<10} {:<15} median {:6.1f}ms  p99 {:6.1f}ms'.format(
+                label, search.__name__,
+                1000 * latencies[len(latencies) // 2],
+                1000 * latencies[int(len(latencies) * 0.99)])
+    engine.close()
@@ -0,0 +1,48 @@
+"""
+Benchmark serializing a page of messages in pretty, compact and streamed
+form. Run with `py.test -s tests/perf/test_serialization.py`.
+
+"""
+import os
+import time
+
+from inbox.api.kellogs import APIEncoder
+from inbox.models import Message
+from tests.util.base import add_fake_message
+
+PAGE_SIZE = int(os.environ.get('PERF_PAGE_SIZE', 1000))
+ROUNDS = 5
+
+
+def timed(fn):
+    start = time.time()
+    for _ in range(ROUNDS):
+        result = fn()
+    return 1000 * (time.time() - start) / ROUNDS, result
+
+
+def test_message_page_serialization(db, default_namespace, thread):
+    for i in range(PAGE_SIZE):
+        add_fake_message(
+            db.session, default_namespace.id, thread,
+            from_addr=[('Alice', 'alice@example.com')],
+            to_addr=[('Bob', 'bob@example.com'), ('', 'carol@example.com')],
+            subject='Message {}'.format(i), snippet='Lorem ipsum ' * 10,
+            body=u'<p>{}</p>'.format('Lorem ipsum dolor sit amet. ' * 40))
+    messages = db.session.query(Message).filter(
+        Message.namespace_id == default_namespace.id).all()
+    encoder = APIEncoder(default_namespace.public_id)
+    # Warm up lazy loads, so that only serialization is measured.
+    encoder.cereal(messages)
+
+    print
+    pretty_ms, pretty = timed(lambda: encoder.cereal(messages, pretty=True))
+    compact_ms, compact = timed(lambda: encoder.cereal(messages))
+    streamed_ms, streamed = timed(
+        lambda: ''.join(encoder.iter_cereal(messages)))
+    assert streamed == compact
+    for name, ms, output in (('pretty', pretty_ms, pretty),
+                             ('compact', compact_ms, compact),
+                             ('streamed', streamed_ms, streamed)):
+        print '{} messages, {}: {:.1f}ms, {} bytes'.format(
+            len(messages), name, ms, len(output))
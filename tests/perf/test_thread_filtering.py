@@ -0,0 +1,129 @@
+"""
+Benchmark representative /threads filter combinations on a large synthetic
+namespace. Run with
+`PERF_MESSAGES=1000000 py.test -s tests/perf/test_thread_filtering.py`.
+
+"""
+import os
+import time
+import random
+from datetime import datetime, timedelta
+
+from inbox.api import filtering
+from inbox.models import (Thread, Message, Contact, MessageContactAssociation,
+                          Category, MessageCategory)
+
+NUM_MESSAGES = int(os.environ.get('PERF_MESSAGES', 200000))
+MESSAGES_PER_THREAD = 4
+NUM_CONTACTS = 2000
+CHUNK_SIZE = 5000
+
+COMBINATIONS = [
+    {'in_': 'inbox'},
+    {'in_': 'inbox', 'unread': True},
+    {'from_addr': 'contact7@example.com'},
+    {'from_addr': 'contact7@example.com', 'in_': 'inbox'},
+    {'any_email': 'contact7@example.com', 'unread': True},
+    {'to_addr': 'contact3@example.com', 'cc_addr': 'contact5@example.com'},
+    {'starred': True, 'in_': 'important'},
+    {'unread': True, 'starred': True},
+]
+
+
+def insert_chunked(db_session, table, rows):
+    for i in range(0, len(rows), CHUNK_SIZE):
+        db_session.execute(table.insert(), rows[i:i + CHUNK_SIZE])
+    db_session.commit()
+
+
+def first_id(db_session, model, namespace_id):
+    return db_session.query(model.id).filter(
+        model.namespace_id == namespace_id).order_by(model.id).first()[0]
+
+
+def populate(db_session, namespace_id):
+    rng = random.Random(0)
+    now = datetime.utcnow().replace(microsecond=0)
+    num_threads = NUM_MESSAGES // MESSAGES_PER_THREAD
+
+    insert_chunked(db_session, Category.__table__, [
+        {'namespace_id': namespace_id, 'name': name, 'display_name': name,
+         'type': 'label'} for name in ('inbox', 'important', 'all')])
+    category_ids = [id_ for id_, in db_session.query(Category.id).filter(
+        Category.namespace_id == namespace_id).order_by(Category.id)]
+
+    insert_chunked(db_session, Contact.__table__, [
+        {'namespace_id': namespace_id, 'uid': str(i), 'provider_name': 'perf',
+         'name': 'Contact {}'.format(i),
+         'email_address': 'contact{}@example.com'.format(i)}
+        for i in range(NUM_CONTACTS)])
+    first_contact = first_id(db_session, Contact, namespace_id)
+
+    insert_chunked(db_session, Thread.__table__, [
+        {'namespace_id': namespace_id, 'subject': 'Thread {}'.format(i),
+         'subjectdate': now - timedelta(minutes=i),
+         'recentdate': now - timedelta(minutes=i), 'snippet': ''}
+        for i in range(num_threads)])
+    first_thread = first_id(db_session, Thread, namespace_id)
+
+    insert_chunked(db_session, Message.__table__, [
+        {'namespace_id': namespace_id,
+         'thread_id': first_thread + i // MESSAGES_PER_THREAD,
+         'subject': 'Message {}'.format(i), 'snippet': '', 'size': 0,
+         'received_date': now - timedelta(minutes=i // MESSAGES_PER_THREAD),
+         'is_read': rng.random() < 0.9, 'is_starred': rng.random() < 0.05,
+         'from_addr': [], 'to_addr': [], 'cc_addr': [], 'bcc_addr': []}
+        for i in range(NUM_MESSAGES)])
+    first_message = first_id(db_session, Message, namespace_id)
+
+    associations = []
+    categories = []
+    for i in range(NUM_MESSAGES):
+        message_id = first_message + i
+        contacts = rng.sample(range(NUM_CONTACTS), 3)
+        for field, contact in zip(('from_addr', 'to_addr', 'cc_addr'),
+                                  contacts):
+            associations.append({'message_id': message_id,
+                                 'contact_id': first_contact + contact,
+                                 'field': field})
+        categories.append({'message_id': message_id,
+                           'category_id': category_ids[2]})
+        if rng.random() < 0.3:
+            categories.append({'message_id': message_id,
+                               'category_id': category_ids[0]})
+        if rng.random() < 0.1:
+            categories.append({'message_id': message_id,
+                               'category_id': category_ids[1]})
+    insert_chunked(db_session, MessageContactAssociation.__table__,
+                   associations)
+    insert_chunked(db_session, MessageCategory.__table__, categories)
+
+
+def run_filter(db_session, namespace_id, view, **kwargs):
+    params = dict(
+        namespace_id=namespace_id, subject=None, from_addr=None,
+        to_addr=None, cc_addr=None, bcc_addr=None, any_email=None,
+        thread_public_id=None, started_before=None, started_after=None,
+        last_message_before=None, last_message_after=None, filename=None,
+        in_=None, unread=None, starred=None, limit=100, offset=0, view=view,
+        db_session=db_session)
+    params.update(kwargs)
+    return filtering.threads(**params)
+
+
+def test_thread_filter_combinations(db, default_namespace):
+    populate(db.session, default_namespace.id)
+
+    print
+    for combination in COMBINATIONS:
+        start = time.time()
+        count = run_filter(db.session, default_namespace.id, 'count',
+                           **combination)['count']
+        count_time = time.time() - start
+
+        start = time.time()
+        run_filter(db.session, default_namespace.id, 'ids', **combination)
+        page_time = time.time() - start
+
+        print '{}: {} threads, count {:.1f}ms, first page {:.1f}ms'.format(
+            combination, count, 1000 * count_time, 1000 * page_time)
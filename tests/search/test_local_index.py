@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import sqlite3
+
+import pytest
+
+from inbox.api.kellogs import encode
+from inbox.search.adaptor import (NamespaceSearchEngine, LocalSearchClient,
+                                  match_expression, index_complete)
+from inbox.search.base import get_search_client
+from tests.util.base import add_fake_message, add_fake_thread
+
+COLUMNS = ('subject', 'participants', 'snippet', 'body')
+
+
+@pytest.fixture
+def index_directory(config, tmpdir, monkeypatch):
+    monkeypatch.setitem(config, 'SEARCH_INDEX_DIRECTORY', str(tmpdir))
+    return str(tmpdir)
+
+
+def fake_message(public_id, thread_id, subject, body, date,
+                 sender='Ben Bitdiddle'):
+    return {'id': public_id, 'thread_id': thread_id, 'subject': subject,
+            'from': [{'name': sender, 'email': 'ben@bitdiddle.com'}],
+            'to': [{'name': 'Alyssa P. Hacker', 'email': 'alyssa@nylas.com'}],
+            'snippet': body[:20], 'body': u'<p>{}</p>'.format(body),
+            'date': date}
+
+
+@pytest.yield_fixture
+def engine(index_directory):
+    engine = NamespaceSearchEngine('ns', create_index=True)
+    engine.messages.bulk_index([
+        ('index', fake_message('m1', 't1', u'Héllo there',
+                               'the linux kernel is out',
+                               datetime.datetime(2015, 1, 1))),
+        ('index', fake_message('m2', 't2', 'Invoice', 'please pay',
+                               datetime.datetime(2015, 1, 2))),
+        ('index', fake_message('m3', 't2', 'Re: Invoice', 'paid',
+                               datetime.datetime(2015, 1, 3),
+                               sender='Louis Reasoner'))])
+    engine.threads.bulk_index([
+        ('index', {'id': 't3', 'subject': 'Invoice reminder',
+                   'participants': [], 'snippet': '',
+                   'last_message_timestamp': datetime.datetime(2014, 1, 1)})])
+    yield engine
+    engine.close()
+
+
+def test_match_expression():
+    assert match_expression(u'linux kernel', COLUMNS) == u'linux* kernel*'
+    assert match_expression(u'"linux kernel"', COLUMNS) == u'"linux kernel"'
+    assert match_expression(u'from:ben subject:invoice', COLUMNS) == \
+        u'participants:ben* subject:invoice*'
+    assert match_expression(u'body:pay', ('subject',)) is None
+    assert match_expression(u'!!!', COLUMNS) is None
+
+
+def test_message_search(engine):
+    assert engine.messages.search('invoice') == ['m3', 'm2']
+    assert engine.messages.search(u'héllo') == ['m1']
+    assert engine.messages.search('kern') == ['m1']
+    assert engine.messages.search('"linux kernel"') == ['m1']
+    assert engine.messages.search('"kernel linux"') == []
+    assert engine.messages.search('from:louis') == ['m3']
+    assert engine.messages.search('subject:pay') == []
+    assert engine.messages.search('invoice', offset=1, limit=1) == ['m2']
+
+
+def test_updates_and_deletes(engine):
+    engine.messages.bulk_index([
+        ('delete', {'id': 'm3'}),
+        ('index', fake_message('m1', 't1', 'Changed', 'body',
+                               datetime.datetime(2015, 1, 1)))])
+    assert engine.messages.search('invoice') == ['m2']
+    assert engine.messages.search('kernel') == []
+    assert engine.messages.search('changed') == ['m1']
+
+
+def test_thread_search(engine):
+    # Threads match through their own fields or through their messages.
+    assert engine.search_threads('invoice') == ['t2', 't3']
+    assert engine.search_threads('body:paid') == ['t2']
+    assert engine.search_threads('reminder') == ['t3']
+
+
+def test_completeness_is_checked_without_opening_the_index(index_directory,
+                                                           monkeypatch):
+    engine = NamespaceSearchEngine('ns', create_index=True)
+    assert not index_complete('ns')
+    engine.mark_complete()
+    engine.close()
+
+    connect = sqlite3.connect
+    monkeypatch.setattr(sqlite3, 'connect', None)
+    assert index_complete('ns')
+    monkeypatch.setattr(sqlite3, 'connect', connect)
+
+    # A new index doesn't inherit the completeness of a deleted one.
+    os.remove(os.path.join(index_directory, 'ns.db'))
+    NamespaceSearchEngine('ns', create_index=True).close()
+    assert not index_complete('ns')
+
+
+def test_search_api_uses_local_index(db, api_client, default_account,
+                                     index_directory):
+    namespace = default_account.namespace
+    thread = add_fake_thread(db.session, namespace.id)
+    message = add_fake_message(db.session, namespace.id, thread=thread,
+                               subject='Quarterly report',
+                               body='<p>Numbers are up</p>')
+    add_fake_message(db.session, namespace.id,
+                     thread=add_fake_thread(db.session, namespace.id),
+                     subject='Lunch?')
+    assert not isinstance(get_search_client(default_account),
+                          LocalSearchClient)
+
+    engine = NamespaceSearchEngine(namespace.public_id, create_index=True)
+    try:
+        engine.messages.bulk_index([('index', encode(
+            message, namespace_public_id=namespace.public_id))])
+        # The index isn't used until it has been backfilled.
+        assert not isinstance(get_search_client(default_account),
+                              LocalSearchClient)
+        engine.mark_complete()
+    finally:
+        engine.close()
+    assert isinstance(get_search_client(default_account), LocalSearchClient)
+
+    messages = api_client.get_data('/messages/search?q=numbers')
+    assert [m['id'] for m in messages] == [message.public_id]
+    threads = api_client.get_data('/threads/search?q=quarterly')
+    assert [t['id'] for t in threads] == [thread.public_id]
+    assert api_client.get_data('/messages/search?q=lunch') == []
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 import datetime
+import socket
+import gevent
 from pytest import fixture
 from sqlalchemy import desc
 from inbox.models import Folder, Message, Thread
 from inbox.models.backends.imap import ImapUid
 from inbox.search.base import get_search_client
+from inbox.search.backends.imap import search_cache
 from tests.util.base import (add_fake_message, add_fake_thread,
                              add_fake_imapuid, add_fake_folder)
 from tests.api.base import api_client, new_api_client
@@ -210,6 +213,16 @@ def patch_crispin_client(monkeypatch, patch_connection):
     monkeypatch.setattr('inbox.crispin.GmailCrispinClient',
                         MockCrispinClient)
 
+    # Don't reuse connection pools or results across tests.
+    from inbox.crispin import CrispinConnectionPool
+    monkeypatch.setattr(
+        'inbox.search.backends.imap.search_connection_pool',
+        lambda account_id: CrispinConnectionPool(account_id,
+                                                 num_connections=3,
+                                                 readonly=True,
+                                                 update_sync_state=False))
+    search_cache.clear()
+
 
 def test_gmail_message_search(api_client, default_account,
                               patch_crispin_client,
@@ -427,3 +440,67 @@ def test_correct_thread_count(db, default_account,
                                               '&limit=2')
 
     assert len(first_two_threads) == 2
+
+
+def test_imap_folders_are_searched_concurrently(db, generic_account,
+                                                patch_connection,
+                                                patch_crispin_client,
+                                                patch_handler_from_provider,
+                                                monkeypatch):
+    for i in range(6):
+        name = 'folder{}'.format(i)
+        Folder.find_or_create(db.session, generic_account, name, name)
+    db.session.commit()
+
+    searches = []
+    running = []
+    max_running = []
+
+    def search(criteria, **kwargs):
+        running.append(criteria)
+        max_running.append(len(running))
+        gevent.sleep(0.01)
+        running.remove(criteria)
+        searches.append(criteria)
+        return [len(searches)]
+
+    monkeypatch.setattr(patch_connection, 'search', search)
+    search_client = get_search_client(generic_account)
+
+    assert search_client._search(db.session, 'hello') == set(range(1, 7))
+    # At most as many folders as the pool has connections at once.
+    assert max(max_running) == 3
+
+    # Results are cached per query.
+    assert search_client._search(db.session, 'again') == set(range(7, 13))
+    assert search_client._search(db.session, 'again') == set(range(7, 13))
+    assert searches.count('TEXT again') == 6
+
+
+def test_imap_search_retries_dropped_connections(db, generic_account,
+                                                 patch_connection,
+                                                 patch_crispin_client,
+                                                 patch_handler_from_provider,
+                                                 monkeypatch):
+    Folder.find_or_create(db.session, generic_account, 'INBOX', 'inbox')
+    generic_account.sync_state = 'stopped'
+    db.session.commit()
+    searches = []
+
+    def search(criteria, **kwargs):
+        searches.append(criteria)
+        if len(searches) == 1:
+            # The server closed the connection while it was idle.
+            raise socket.error('Connection reset by peer')
+        return [1]
+
+    monkeypatch.setattr(patch_connection, 'search', search)
+    search_client = get_search_client(generic_account)
+    folder_count = db.session.query(Folder).filter(
+        Folder.account_id == generic_account.id).count()
+    assert search_client._search(db.session, 'hello') == {1}
+    assert len(searches) == folder_count + 1
+
+    # Searching doesn't change the account's sync state.
+    db.session.expire(generic_account)
+    assert generic_account.sync_state == 'stopped'
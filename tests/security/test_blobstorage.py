@@ -32,3 +32,14 @@ def test_message_body_storage(config, message, sample_input, encrypt):
     assert message._compacted_body.startswith(
         chr(encrypt) + '\x00\x00\x00\x00')
     assert message.body == sample_input
+
+
+def test_cipher_is_reused(config, monkeypatch):
+    from inbox.security.oracles import (get_encryption_oracle,
+                                        get_decryption_oracle)
+    monkeypatch.setitem(config, 'ENCRYPT_SECRETS', True)
+    e_oracle = get_encryption_oracle('BLOCK_ENCRYPTION_KEY')
+    d_oracle = get_decryption_oracle('BLOCK_ENCRYPTION_KEY')
+    assert e_oracle._secret_box is d_oracle._secret_box
+    assert get_encryption_oracle('SECRET_ENCRYPTION_KEY')._secret_box is not \
+        e_oracle._secret_box
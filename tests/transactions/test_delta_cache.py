@@ -0,0 +1,51 @@
+import time
+from inbox.transactions.delta_cache import DeltaCache, cache_key
+from tests.api.base import api_client
+from tests.transactions.test_delta_sync import get_cursor
+
+__all__ = ['api_client']
+
+
+def test_cache_is_bounded():
+    cache = DeltaCache(max_entries=2)
+    keys = [cache_key(i, 'message', False, False) for i in range(3)]
+    cache.set_many({keys[0]: {'id': 0}})
+    cache.set_many({keys[1]: {'id': 1}})
+    # Touch the first entry so that the second one is evicted instead.
+    assert cache.get_many([keys[0]]) == {keys[0]: {'id': 0}}
+    cache.set_many({keys[2]: {'id': 2}})
+    assert len(cache) == 2
+    assert cache.get_many(keys) == {keys[0]: {'id': 0}, keys[2]: {'id': 2}}
+
+
+def test_hit_rate():
+    cache = DeltaCache()
+    key = cache_key(1, 'thread', False, False)
+    assert cache.get_many([key]) == {}
+    cache.set_many({key: {'id': 1}})
+    assert cache.get_many([key]) == {key: {'id': 1}}
+    assert cache.hits == 1 and cache.misses == 1
+    assert cache.hit_rate == 0.5
+
+
+def test_encoding_options_are_part_of_key():
+    assert cache_key(1, 'thread', False, False) != \
+        cache_key(1, 'thread', True, False)
+    assert cache_key(1, 'thread', False, False) != \
+        cache_key(1, 'thread', False, True)
+
+
+def test_repeated_delta_requests_hit_cache(api_client, message, monkeypatch):
+    cache = DeltaCache()
+    monkeypatch.setattr('inbox.transactions.delta_sync.get_delta_cache',
+                        lambda: cache)
+    cursor = get_cursor(api_client, int(time.time() + 22))
+    message_id = api_client.get_data('/messages/')[0]['id']
+    api_client.put_data('/messages/{}'.format(message_id), {'unread': False})
+
+    first = api_client.get_data('/delta?cursor={}'.format(cursor))
+    assert cache.hits == 0 and len(cache) > 0
+
+    second = api_client.get_data('/delta?cursor={}'.format(cursor))
+    assert cache.hits > 0
+    assert first['deltas'] == second['deltas']
@@ -0,0 +1,89 @@
+from contextlib import contextmanager
+
+from pytest import yield_fixture
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
+
+from inbox.models import Transaction
+from inbox.models.search import SearchIndexCursor
+from inbox.search.adaptor import NamespaceSearchEngine
+from inbox.transactions.search import SearchIndexService
+from tests.util.base import add_fake_message, add_fake_thread
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def latest_transaction_id(db_session):
+    return db_session.query(func.max(Transaction.id)).scalar() or 0
+
+
+@yield_fixture
+def search_index_service(db, config, tmpdir, monkeypatch):
+    monkeypatch.setitem(config, 'SEARCH_INDEX_DIRECTORY', str(tmpdir))
+    service = SearchIndexService(chunk_size=1000)
+    service.transaction_pointer = latest_transaction_id(db.session)
+    yield service
+    db.session.query(SearchIndexCursor).delete()
+    db.session.commit()
+
+
+def test_index_batch(db, default_namespace, search_index_service):
+    thread = add_fake_thread(db.session, default_namespace.id)
+    message = add_fake_message(db.session, default_namespace.id,
+                               thread=thread, subject='Quarterly report')
+    message.subject = 'Quarterly report, final'
+    db.session.commit()
+    deleted = add_fake_message(db.session, default_namespace.id,
+                               thread=thread, subject='Quarterly draft')
+    db.session.delete(deleted)
+    db.session.commit()
+    pointer = latest_transaction_id(db.session)
+
+    assert search_index_service.index_batch() > 0
+    assert search_index_service.transaction_pointer == pointer
+    assert db.session.query(SearchIndexCursor).one().transaction_id == \
+        pointer
+    assert search_index_service.index_batch() == 0
+
+    engine = NamespaceSearchEngine(default_namespace.public_id)
+    try:
+        assert engine.messages.search('quarterly') == [message.public_id]
+        assert engine.messages.search('final') == [message.public_id]
+    finally:
+        engine.close()
+
+
+def test_objects_are_loaded_in_bulk(db, default_namespace,
+                                    search_index_service):
+    def queries_to_index(count):
+        pointer = latest_transaction_id(db.session)
+        for _ in range(count):
+            message = add_fake_message(
+                db.session, default_namespace.id,
+                thread=add_fake_thread(db.session, default_namespace.id),
+                subject='Hello')
+            # Repeated modifications are indexed once.
+            message.is_read = True
+            db.session.commit()
+        transactions = db.session.query(Transaction).filter(
+            Transaction.id > pointer,
+            Transaction.object_type == 'message').all()
+        assert len(transactions) == 2 * count
+        with count_queries() as statements:
+            search_index_service.index(transactions, db.session)
+        return len(statements)
+
+    assert queries_to_index(10) == queries_to_index(2)
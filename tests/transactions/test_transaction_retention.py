@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+
+from pytest import yield_fixture
+
+from inbox.models import Namespace, Transaction
+from inbox.models.transaction import (TransactionLogHorizon,
+                                      CompactedTransaction)
+from inbox.transactions.retention import (TransactionRetentionService,
+                                          log_trimmed)
+from tests.util.base import add_fake_message, add_fake_thread
+from tests.api.base import api_client
+
+__all__ = ['api_client']
+
+
+@yield_fixture
+def retention_service(db):
+    yield TransactionRetentionService(retention_days=60, compaction_days=7,
+                                      batch_size=100, batch_interval=0)
+    # Don't leak the trimmed state into other tests.
+    db.session.query(TransactionLogHorizon).delete()
+    db.session.query(CompactedTransaction).delete()
+    db.session.commit()
+
+
+def age_transactions(db_session, days, namespace_id=None):
+    query = db_session.query(Transaction)
+    if namespace_id is not None:
+        query = query.filter(Transaction.namespace_id == namespace_id)
+    query.update({'created_at': datetime.utcnow() - timedelta(days=days)},
+                 synchronize_session=False)
+    db_session.commit()
+
+
+def message_transactions(db_session, message):
+    return db_session.query(Transaction).filter(
+        Transaction.object_type == 'message',
+        Transaction.record_id == message.id).order_by(Transaction.id).all()
+
+
+def test_compaction_collapses_updates(db, default_namespace,
+                                      retention_service):
+    thread = add_fake_thread(db.session, default_namespace.id)
+    message = add_fake_message(db.session, default_namespace.id, thread)
+    for is_read in (True, False, True):
+        message.is_read = is_read
+        db.session.commit()
+    assert [t.command for t in message_transactions(db.session, message)] == \
+        ['insert', 'update', 'update', 'update']
+    latest_id = message_transactions(db.session, message)[-1].id
+
+    age_transactions(db.session, days=30)
+    retention_service.compact(datetime.utcnow() - timedelta(days=7))
+
+    remaining = message_transactions(db.session, message)
+    assert [t.command for t in remaining] == ['insert', 'update']
+    assert remaining[-1].id == latest_id
+    # Compaction alone doesn't expire any cursors.
+    assert not log_trimmed(db.session, default_namespace,
+                           remaining[-1].public_id)
+
+
+def test_compacted_cursor(db, api_client, default_namespace,
+                          retention_service):
+    thread = add_fake_thread(db.session, default_namespace.id)
+    message = add_fake_message(db.session, default_namespace.id, thread)
+    for is_read in (True, False):
+        message.is_read = is_read
+        db.session.commit()
+    cursor = message_transactions(db.session, message)[1].public_id
+
+    age_transactions(db.session, days=10)
+    retention_service.compact(datetime.utcnow() - timedelta(days=7))
+    assert cursor not in [t.public_id for t in
+                          message_transactions(db.session, message)]
+
+    deltas = api_client.get_data('/delta?cursor={}'.format(cursor))['deltas']
+    assert [d['id'] for d in deltas
+            if d['object'] == 'message'] == [message.public_id]
+    resp = api_client.get_raw('/delta/streaming?cursor={}&timeout=.1'.format(
+        cursor))
+    assert resp.status_code == 200
+
+
+def test_recent_transactions_are_not_compacted(db, default_namespace,
+                                               retention_service):
+    thread = add_fake_thread(db.session, default_namespace.id)
+    message = add_fake_message(db.session, default_namespace.id, thread)
+    message.is_read = True
+    db.session.commit()
+    message.is_read = False
+    db.session.commit()
+
+    retention_service.compact(datetime.utcnow() - timedelta(days=7))
+    assert len(message_transactions(db.session, message)) == 3
+
+
+def test_expiry(db, default_namespace, retention_service):
+    thread = add_fake_thread(db.session, default_namespace.id)
+    message = add_fake_message(db.session, default_namespace.id, thread)
+    age_transactions(db.session, days=90, namespace_id=default_namespace.id)
+
+    reclaimed = retention_service.run_once()
+    assert reclaimed > 0
+    assert message_transactions(db.session, message) == []
+    assert db.session.query(Transaction).filter(
+        Transaction.namespace_id == default_namespace.id).count() == 0
+
+
+def test_expired_cursor(db, api_client, default_namespace, thread,
+                        retention_service):
+    cursor = db.session.query(Transaction).filter(
+        Transaction.namespace_id == default_namespace.id).first().public_id
+    age_transactions(db.session, days=90, namespace_id=default_namespace.id)
+    retention_service.expire(datetime.utcnow() - timedelta(days=60))
+
+    # The namespace was created after the expired part of the log.
+    resp = api_client.get_raw('/delta?cursor={}'.format(cursor))
+    assert resp.status_code == 400
+
+    db.session.query(Namespace).filter(
+        Namespace.id == default_namespace.id).update(
+            {'created_at': datetime.utcnow() - timedelta(days=100)},
+            synchronize_session=False)
+    db.session.commit()
+    resp = api_client.get_raw('/delta?cursor={}'.format(cursor))
+    assert resp.status_code == 410
+    # Malformed cursors are still invalid.
+    resp = api_client.get_raw('/delta?cursor=not-a-cursor')
+    assert resp.status_code == 400